@@ -0,0 +1,60 @@
+/**
+ * TTS Batch Generate API Route
+ *
+ * 课程预加载: 一次请求提交整课句子，按完成顺序以 NDJSON 逐行返回
+ * 前端调用: POST /api/tts/generate/batch  { items: [{ text, voice, language, speed }] }
+ * 每行: { index, success, url?, cached?, hash? }
+ */
+
+import { NextRequest, NextResponse } from 'next/server';
+import { getTTSAudioBatchCore } from '@/lib/tts/service';
+import { createLogger } from '@/lib/logger';
+
+const log = createLogger('api:tts:generate:batch');
+
+// 与 Python TTSBatchRequest.items 上限一致
+const MAX_BATCH_ITEMS = 500;
+
+export async function POST(request: NextRequest) {
+    const body = await request.json().catch(() => null);
+    const items = body?.items;
+
+    // [Validation] 防止无效请求导致 Python 服务挂起
+    if (!Array.isArray(items) || items.length === 0 || items.length > MAX_BATCH_ITEMS
+        || items.some((item: any) => !item?.text || typeof item.text !== 'string')) {
+        return NextResponse.json(
+            { success: false, error: `items must be 1-${MAX_BATCH_ITEMS} entries with text` },
+            { status: 400 }
+        );
+    }
+
+    const encoder = new TextEncoder();
+    const stream = new ReadableStream({
+        async start(controller) {
+            try {
+                await getTTSAudioBatchCore(
+                    items.map((item: any) => ({
+                        text: item.text,
+                        voice: item.voice,
+                        language: item.language,
+                        speed: item.speed,
+                        cacheType: item.cacheType,
+                    })),
+                    (index, result) => {
+                        const line = result ? { index, success: true, ...result } : { index, success: false };
+                        controller.enqueue(encoder.encode(JSON.stringify(line) + '\n'));
+                    },
+                    body.priority
+                );
+            } catch (error: any) {
+                log.error({ error: error.message }, 'TTS batch generation failed');
+            } finally {
+                controller.close();
+            }
+        },
+    });
+
+    return new Response(stream, {
+        headers: { 'Content-Type': 'application/x-ndjson' },
+    });
+}
@@ -30,6 +30,7 @@ export async function POST(request: NextRequest) {
             language: body.language,
             speed: body.speed,
             cacheType: body.cacheType,
+            priority: body.priority,
         });
 
         return NextResponse.json({
@@ -41,8 +42,9 @@ export async function POST(request: NextRequest) {
 
     } catch (error: any) {
         log.error({ error: error.message }, 'TTS generation failed');
-        // 透传 429 状态码，允许前端做 backoff
-        const status = error.message?.includes('429') ? 429 : 500;
+        // 透传 429 / 503 (Python 准入队列满 / 排队超时)，允许前端做 backoff
+        const status = error.message?.includes('429') ? 429
+            : error.message?.includes('(503)') ? 503 : 500;
         return NextResponse.json(
             { success: false, error: error.message },
             { status }
@@ -0,0 +1,57 @@
+/**
+ * TTS Stream API Route
+ *
+ * 未命中时边合成边返回 WAV 音频 (不等整句合成完，也不需要再请求一次 URL)
+ * 前端调用: POST /api/tts/stream  { text, voice, language, speed, cacheType }
+ * DB 命中时 303 重定向到缓存文件 URL
+ */
+
+import { NextRequest, NextResponse } from 'next/server';
+import { getTTSAudioStreamCore } from '@/lib/tts/service';
+import { createLogger } from '@/lib/logger';
+
+const log = createLogger('api:tts:stream');
+
+export async function POST(request: NextRequest) {
+    try {
+        const body = await request.json();
+
+        // [Validation] 防止无效请求导致 Python 服务挂起
+        if (!body.text || typeof body.text !== 'string') {
+            return NextResponse.json(
+                { success: false, error: 'Missing required field: text' },
+                { status: 400 }
+            );
+        }
+
+        const result = await getTTSAudioStreamCore({
+            text: body.text,
+            voice: body.voice,
+            language: body.language,
+            speed: body.speed,
+            cacheType: body.cacheType,
+            priority: body.priority,
+        });
+
+        if (result.cached) {
+            return NextResponse.redirect(new URL(result.url, request.url), 303);
+        }
+
+        return new Response(result.stream, {
+            headers: {
+                'Content-Type': 'audio/wav',
+                'X-Audio-Hash': result.hash,
+            },
+        });
+
+    } catch (error: any) {
+        log.error({ error: error.message }, 'TTS stream failed');
+        // 透传 429 / 503 (Python 准入队列满 / 排队超时)，允许前端做 backoff
+        const status = error.message?.includes('(429)') ? 429
+            : error.message?.includes('(503)') ? 503 : 500;
+        return NextResponse.json(
+            { success: false, error: error.message },
+            { status }
+        );
+    }
+}
@@ -1,27 +1,5 @@
 import { useEffect, useRef } from 'react';
-import { generateAndPreloadAudio, PreloadTarget } from '@/lib/tts/preload';
-
-/**
- * 受控并发执行器：限制同时在飞的请求数量，避免瞬间打满外部 API 限额
- */
-async function runWithConcurrency<T>(
-    items: T[],
-    fn: (item: T) => Promise<void>,
-    maxConcurrent: number
-): Promise<void> {
-    let index = 0;
-    const workers = Array.from({ length: Math.min(maxConcurrent, items.length) }, async () => {
-        while (index < items.length) {
-            const currentIndex = index++;
-            try {
-                await fn(items[currentIndex]);
-            } catch {
-                // 预加载失败静默忽略
-            }
-        }
-    });
-    await Promise.all(workers);
-}
+import { generateAndPreloadBatch, PreloadTarget } from '@/lib/tts/preload';
 
 interface UseAudioPreloadParams<T> {
     /** 
@@ -108,10 +86,10 @@ export function useAudioPreload<T>({
                 prefetchedIndicesRef.current.add(targetIndex);
             }
 
-            // 使用受控并发（最多同时 2 个请求），避免瞬间打满 DashScope API 限额
+            // 一次批量请求：Python 侧按 Hash 去重，未命中以 prefetch 优先级排队，不与用户点击抢并发
             if (allTargets.length > 0) {
-                console.log(`[useAudioPreload] Dispatching ${allTargets.length} generation requests ahead of ${currentIndex} (concurrency=2)`);
-                await runWithConcurrency(allTargets, generateAndPreloadAudio, 2);
+                console.log(`[useAudioPreload] Dispatching ${allTargets.length} generation requests ahead of ${currentIndex} (batch)`);
+                await generateAndPreloadBatch(allTargets);
             }
 
         }, 500);
@@ -31,35 +31,93 @@ export const generateAndPreloadAudio = async (
                 text: target.text,
                 voice: target.voice,
                 language: 'en-US',
-                speed: target.speed
+                speed: target.speed,
+                priority: 'prefetch'
             })
         });
 
         if (!response.ok) return;
 
         const { url } = await response.json();
-        if (!url || preloadedAudiosCache.has(url)) return;
+        if (url) preloadAudioUrl(target, url);
+    } catch (err) {
+        // Silent failure - caching is progressive enhancement only
+        console.warn(`[TTS Prefetch] Silent Fail: ${target.text.slice(0, 10)}`, err);
+    }
+};
 
-        // ✅ Cache raw audio into browser memory
-        const audio = new window.Audio(url);
-        audio.preload = 'auto';
-        audio.load(); // Kick off network request immediately
+/**
+ * Generates a whole set of targets with one request to /api/tts/generate/batch.
+ * Results stream back as NDJSON in completion order, so cached items are preloaded immediately
+ * while misses are still being synthesized.
+ * @param targets Details needed to generate each TTS
+ */
+export const generateAndPreloadBatch = async (
+    targets: PreloadTarget[]
+): Promise<void> => {
+    try {
+        const response = await fetch('/api/tts/generate/batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                priority: 'prefetch',
+                items: targets.map((target) => ({
+                    text: target.text,
+                    voice: target.voice,
+                    language: 'en-US',
+                    speed: target.speed
+                }))
+            })
+        });
 
-        preloadedAudiosCache.set(url, audio);
+        if (!response.ok || !response.body) return;
 
-        // Share the URL with the application-level TTS hook so it doesn't fetch again
-        const hash = generateAudioHash({
-            text: target.text,
-            voice: target.voice,
-            language: 'en-US',
-            speed: target.speed
-        });
-        ttsMemoryCache.set(hash, url);
+        const handleLine = (line: string) => {
+            if (!line.trim()) return;
+            const { index, success, url } = JSON.parse(line);
+            if (success && url && targets[index]) preloadAudioUrl(targets[index], url);
+        };
 
-        // Log lightly for debug traces
-        console.log(`[TTS Prefetch] Loaded: ${target.text.slice(0, 15)}...`);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop() || '';
+            lines.forEach(handleLine);
+        }
+        handleLine(buffer);
     } catch (err) {
         // Silent failure - caching is progressive enhancement only
-        console.warn(`[TTS Prefetch] Silent Fail: ${target.text.slice(0, 10)}`, err);
+        console.warn(`[TTS Prefetch] Batch Silent Fail (${targets.length} items)`, err);
     }
 };
+
+/**
+ * Forces native audio preloading for a generated URL and shares it with the TTS hook.
+ */
+const preloadAudioUrl = (target: PreloadTarget, url: string): void => {
+    if (preloadedAudiosCache.has(url)) return;
+
+    // ✅ Cache raw audio into browser memory
+    const audio = new window.Audio(url);
+    audio.preload = 'auto';
+    audio.load(); // Kick off network request immediately
+
+    preloadedAudiosCache.set(url, audio);
+
+    // Share the URL with the application-level TTS hook so it doesn't fetch again
+    const hash = generateAudioHash({
+        text: target.text,
+        voice: target.voice,
+        language: 'en-US',
+        speed: target.speed
+    });
+    ttsMemoryCache.set(hash, url);
+
+    // Log lightly for debug traces
+    console.log(`[TTS Prefetch] Loaded: ${target.text.slice(0, 15)}...`);
+};
@@ -17,6 +17,8 @@ export interface TTSOptions {
     language?: string;
     speed?: number;
     cacheType?: 'vocab' | 'phrase' | 'temporary';
+    // 未命中时 Python 侧的合成排队优先级 (预加载传 prefetch，不与用户点击抢并发)
+    priority?: 'interactive' | 'prefetch' | 'bulk';
 }
 
 export interface TTSResult {
@@ -25,6 +27,35 @@ export interface TTSResult {
     hash: string;
 }
 
+/**
+ * 找出 DB 中仍有记录、但文件已被 Python 侧容量淘汰删除的条目
+ *
+ * 只有 temporary 会被淘汰 (vocab / phrase 永不淘汰，不检查)，DB 命中时经 /tts/check 确认文件存在；
+ * 已淘汰的删除 DB 记录，由调用方按未命中重新生成。Python 服务不可用时按存在处理
+ */
+async function findEvicted(rows: { id: string; cacheType: string }[]): Promise<Set<string>> {
+    const temporary = rows.filter((row) => row.cacheType === 'temporary').map((row) => row.id);
+    if (temporary.length === 0) return new Set();
+
+    try {
+        const response = await fetch(`${PYTHON_TTS_URL}/tts/check`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ hashes: temporary }),
+        });
+        if (!response.ok) return new Set();
+        const { results } = await response.json();
+        const evicted = temporary.filter((id) => results?.[id] && !results[id].exists);
+        if (evicted.length > 0) {
+            await prisma.tTSCache.deleteMany({ where: { id: { in: evicted } } }).catch(() => { });
+        }
+        return new Set(evicted);
+    } catch (e) {
+        console.error('TTS cache check failed:', e);
+        return new Set();
+    }
+}
+
 /**
  * 获取 TTS 音频 URL
  * 
@@ -32,7 +63,7 @@ export interface TTSResult {
  * 1. 清洗文本 (去除 Markdown/XML 标记)
  * 2. 计算 Hash
  * 3. 查 DB (极速)
- * 4. 命中 → 更新 lastUsedAt → 返回 URL
+ * 4. 命中 → (temporary 确认文件未被淘汰) → 更新 lastUsedAt → 返回 URL
  * 5. 未命中 → 调用 Python → 写 DB → 返回 URL
  */
 export async function getTTSAudioCore(options: TTSOptions): Promise<TTSResult> {
@@ -42,6 +73,7 @@ export async function getTTSAudioCore(options: TTSOptions): Promise<TTSResult> {
         language = 'en-US',
         speed = 1.0,
         cacheType = 'temporary',
+        priority = 'interactive',
     } = options;
 
     // [V6.2] 清洗文本: 去除 **markdown** 和 <xml> 标记
@@ -50,12 +82,12 @@ export async function getTTSAudioCore(options: TTSOptions): Promise<TTSResult> {
     // 1. 计算 Hash (generateAudioHash 内部也会清洗，但这里提前清洗用于后续 Python 调用)
     const hash = generateAudioHash({ text: cleanText, voice, language, speed });
 
-    // 2. 查 DB (极速，不触碰文件系统 IO)
+    // 2. 查 DB (极速，不触碰文件系统 IO)；temporary 条目可能已被淘汰，按未命中处理
     const cache = await prisma.tTSCache.findUnique({
         where: { id: hash },
     });
 
-    if (cache) {
+    if (cache && !(await findEvicted([cache])).has(hash)) {
         // 命中缓存，更新 lastUsedAt (异步，不阻塞返回)
         prisma.tTSCache.update({
             where: { id: hash },
@@ -73,13 +105,15 @@ export async function getTTSAudioCore(options: TTSOptions): Promise<TTSResult> {
     const pyResponse = await fetch(`${PYTHON_TTS_URL}/tts/generate`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ text: cleanText, voice, language, speed }),
+        // cache_type 决定 Python 侧容量淘汰策略 (vocab / phrase 永不淘汰)
+        body: JSON.stringify({ text: cleanText, voice, language, speed, cache_type: cacheType, priority }),
     });
 
     if (!pyResponse.ok) {
         const errorText = await pyResponse.text();
         console.error(`TTS Service Error: Status ${pyResponse.status}, Body: ${errorText}`);
-        throw new Error(`TTS 生成失败: ${errorText}`);
+        // 状态码写入错误信息，Route Handler 据此透传 429 / 503
+        throw new Error(`TTS 生成失败 (${pyResponse.status}): ${errorText}`);
     }
 
     const pyResult = await pyResponse.json();
@@ -88,16 +122,99 @@ export async function getTTSAudioCore(options: TTSOptions): Promise<TTSResult> {
     const { url, file_size: fileSize } = pyResult;
 
     // 4. 写 DB (使用 upsert 处理并发)
+    await recordTTSCache({ hash, text: cleanText, voice, language, speed, cacheType, url, fileSize });
+
+    return {
+        url,
+        cached: false,
+        hash,
+    };
+}
+
+export type TTSStreamResult =
+    | { cached: true; url: string; hash: string }
+    | { cached: false; stream: ReadableStream<Uint8Array>; hash: string };
+
+/**
+ * 流式获取 TTS 音频 (未命中时首包延迟约等于 DashScope 首包时间)
+ *
+ * DB 命中返回 URL (由调用方重定向)；未命中返回 Python /tts/stream 的 WAV 字节流，
+ * 流读完后写 DB (Python 侧同时已写入文件缓存)
+ */
+export async function getTTSAudioStreamCore(options: TTSOptions): Promise<TTSStreamResult> {
+    const {
+        text,
+        voice = 'Cherry',
+        language = 'en-US',
+        speed = 1.0,
+        cacheType = 'temporary',
+        priority = 'interactive',
+    } = options;
+
+    const cleanText = sanitizeForTTS(text);
+    const hash = generateAudioHash({ text: cleanText, voice, language, speed });
+
+    const cache = await prisma.tTSCache.findUnique({
+        where: { id: hash },
+    });
+    if (cache && !(await findEvicted([cache])).has(hash)) {
+        prisma.tTSCache.update({
+            where: { id: hash },
+            data: { lastUsedAt: new Date() },
+        }).catch(() => { });
+        return { cached: true, url: cache.url, hash };
+    }
+
+    const pyResponse = await fetch(`${PYTHON_TTS_URL}/tts/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ text: cleanText, voice, language, speed, cache_type: cacheType, priority }),
+    });
+
+    if (!pyResponse.ok || !pyResponse.body) {
+        const errorText = await pyResponse.text();
+        console.error(`TTS Service Error: Status ${pyResponse.status}, Body: ${errorText}`);
+        throw new Error(`TTS 生成失败 (${pyResponse.status}): ${errorText}`);
+    }
+
+    const url = pyResponse.headers.get('X-Audio-Url') || '';
+    let fileSize = 0;
+    const stream = pyResponse.body.pipeThrough(new TransformStream<Uint8Array, Uint8Array>({
+        transform(chunk, controller) {
+            fileSize += chunk.byteLength;
+            controller.enqueue(chunk);
+        },
+        // 完整读完才记录 (中途断开的流不写 DB，下次请求由 Python 缓存命中后补记)
+        async flush() {
+            if (url) {
+                await recordTTSCache({ hash, text: cleanText, voice, language, speed, cacheType, url, fileSize });
+            }
+        },
+    }));
+
+    return { cached: false, stream, hash };
+}
+
+/**
+ * 写入 TTSCache 记录 (Python 生成成功后)
+ */
+async function recordTTSCache(record: {
+    hash: string;
+    text: string;
+    voice: string;
+    language: string;
+    speed: number;
+    cacheType: string;
+    url: string;
+    fileSize?: number;
+}): Promise<void> {
+    const { hash, url, fileSize, ...fields } = record;
     try {
         await prisma.tTSCache.upsert({
             where: { id: hash },
             create: {
                 id: hash,
-                text: cleanText,
-                voice,
-                language,
-                speed,
-                cacheType,
+                ...fields,
                 filePath: url,  // Python 返回的相对路径
                 url,
                 fileSize: fileSize || 0,
@@ -113,12 +230,111 @@ export async function getTTSAudioCore(options: TTSOptions): Promise<TTSResult> {
             console.error('TTSCache 写入失败:', e);
         }
     }
+}
 
-    return {
-        url,
-        cached: false,
-        hash,
+/**
+ * 批量获取 TTS 音频 URL (课程预加载)
+ *
+ * DB 命中立即回调；未命中一次性提交 Python /tts/generate/batch，
+ * 按 NDJSON 逐行 (按完成顺序) 写 DB 并回调。失败的条目回调 null。
+ *
+ * @param onResult 每个条目完成时回调，index 为 items 中的下标
+ */
+export async function getTTSAudioBatchCore(
+    items: TTSOptions[],
+    onResult: (index: number, result: TTSResult | null) => void,
+    priority: TTSOptions['priority'] = 'prefetch'
+): Promise<void> {
+    const entries = items.map((options) => {
+        const {
+            text,
+            voice = 'Cherry',
+            language = 'en-US',
+            speed = 1.0,
+            cacheType = 'temporary',
+        } = options;
+        const cleanText = sanitizeForTTS(text);
+        const hash = generateAudioHash({ text: cleanText, voice, language, speed });
+        return { text: cleanText, voice, language, speed, cacheType, hash };
+    });
+
+    // 1. 批量查 DB
+    const hashes = Array.from(new Set(entries.map((entry) => entry.hash)));
+    const cached = await prisma.tTSCache.findMany({
+        where: { id: { in: hashes } },
+        select: { id: true, url: true, cacheType: true },
+    });
+    const evicted = await findEvicted(cached);
+    const cachedUrls = new Map(
+        cached.filter((row) => !evicted.has(row.id)).map((row) => [row.id, row.url])
+    );
+
+    if (cachedUrls.size > 0) {
+        prisma.tTSCache.updateMany({
+            where: { id: { in: Array.from(cachedUrls.keys()) } },
+            data: { lastUsedAt: new Date() },
+        }).catch(() => { });
+    }
+
+    const misses: number[] = [];
+    entries.forEach((entry, index) => {
+        const url = cachedUrls.get(entry.hash);
+        if (url) {
+            onResult(index, { url, cached: true, hash: entry.hash });
+        } else {
+            misses.push(index);
+        }
+    });
+    if (misses.length === 0) return;
+
+    // 2. 未命中 → 一次请求 Python 批量接口 (Python 侧按 Hash 去重)
+    const pyResponse = await fetch(`${PYTHON_TTS_URL}/tts/generate/batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            priority,
+            items: misses.map((index) => {
+                const { text, voice, language, speed, cacheType } = entries[index];
+                return { text, voice, language, speed, cache_type: cacheType };
+            }),
+        }),
+    });
+
+    if (!pyResponse.ok || !pyResponse.body) {
+        const errorText = await pyResponse.text();
+        console.error(`TTS Batch Service Error: Status ${pyResponse.status}, Body: ${errorText}`);
+        misses.forEach((index) => onResult(index, null));
+        return;
+    }
+
+    // 3. 逐行读取结果: { indices, success, url, hash, file_size, ... }
+    const handleLine = async (line: string) => {
+        if (!line.trim()) return;
+        const result = JSON.parse(line);
+        const indices: number[] = (result.indices || []).map((i: number) => misses[i]);
+        if (!result.success) {
+            indices.forEach((index) => onResult(index, null));
+            return;
+        }
+        const entry = entries[indices[0]];
+        await recordTTSCache({ ...entry, url: result.url, fileSize: result.file_size });
+        indices.forEach((index) => onResult(index, { url: result.url, cached: result.cached, hash: entry.hash }));
     };
+
+    const reader = pyResponse.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop() || '';
+        for (const line of lines) {
+            await handleLine(line);
+        }
+    }
+    await handleLine(buffer);
 }
 
 /**
@@ -127,9 +343,9 @@ export async function getTTSAudioCore(options: TTSOptions): Promise<TTSResult> {
 export async function checkTTSCacheCore(hash: string): Promise<boolean> {
     const cache = await prisma.tTSCache.findUnique({
         where: { id: hash },
-        select: { id: true },
+        select: { id: true, cacheType: true },
     });
-    return !!cache;
+    return !!cache && !(await findEvicted([cache])).has(hash);
 }
 
 /**
@@ -25,6 +25,19 @@ const nextConfig = {
     output: "standalone",
     // TTS 请求现由 app/api/tts/generate/route.ts 处理
     // rewrite 已移除，确保 Next.js 作为主脑处理 DB 缓存
+    // 音频静态文件 (非 TTS API): 缓存分片迁移后 DB 中旧的扁平 URL /audio/<hash>.wav
+    // 在 public 中找不到文件时回退到 /audio/ab/cd/<hash>.wav
+    // 扩展名集合与 nginx/nginx.conf 及 TTS 服务 HASH_FILE_EXTENSIONS 保持一致
+    async rewrites() {
+        return {
+            fallback: [
+                {
+                    source: "/audio/:a([0-9a-f]{2}):b([0-9a-f]{2}):rest([0-9a-f]{28}\\.(?:wav|mp3|opus|ogg|m4a))",
+                    destination: "/audio/:a/:b/:a:b:rest",
+                },
+            ],
+        };
+    },
     // 静态音频文件长缓存 (Hash 变则 URL 变，所以可以永久缓存)
     async headers() {
         return [
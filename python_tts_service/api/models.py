@@ -2,7 +2,9 @@
 Pydantic 数据模型
 """
 from pydantic import BaseModel, Field, field_validator
-from typing import Optional
+from typing import Any, Dict, List, Literal, Optional
+
+from core.config import config
 
 # 阿里云 DashScope TTS 支持的音色列表
 SUPPORTED_VOICES = [
@@ -20,8 +22,8 @@ class TTSRequest(BaseModel):
     text: str = Field(
         ...,
         min_length=1,
-        max_length=500,
-        description="待转换的文本内容"
+        max_length=config.MAX_LONG_TEXT_LENGTH,
+        description="待转换的文本内容；超过 MAX_TEXT_LENGTH 时按句切分合成后拼接 (仅 /tts/generate 与批量接口)"
     )
     voice: str = Field(
         default="Cherry",
@@ -37,6 +39,18 @@ class TTSRequest(BaseModel):
         le=2.0,
         description="播放速度，范围 0.5-2.0"
     )
+    cache_type: Literal["vocab", "phrase", "temporary"] = Field(
+        default="temporary",
+        description="缓存类型 (与 Prisma TTSCache.cacheType 一致)，vocab / phrase 不参与容量淘汰"
+    )
+    format: Optional[Literal["wav", "opus", "mp3", "aac"]] = Field(
+        default=None,
+        description="返回的音频格式，未指定时按 Accept 头协商，默认 wav"
+    )
+    priority: Literal["interactive", "prefetch", "bulk"] = Field(
+        default="interactive",
+        description="未命中缓存时的合成优先级: interactive (用户操作) > prefetch (预加载) > bulk (批量)"
+    )
     
     @field_validator('text')
     @classmethod
@@ -56,6 +70,22 @@ class TTSRequest(BaseModel):
         return v
 
 
+class TTSBatchRequest(BaseModel):
+    """批量 TTS 生成请求模型"""
+    
+    # 条目在接口内逐条按 TTSRequest 校验: 个别条目无效只在其结果行报错，不让整批返回 422
+    items: List[Dict[str, Any]] = Field(
+        ...,
+        min_length=1,
+        max_length=500,
+        description="待生成的条目 (TTSRequest 字段)，相同 Hash 的条目只处理一次"
+    )
+    priority: Literal["interactive", "prefetch", "bulk"] = Field(
+        default="prefetch",
+        description="本批次未命中条目的合成优先级 (覆盖条目自身的 priority)"
+    )
+
+
 class TTSResponse(BaseModel):
     """TTS 生成响应模型"""
     
@@ -64,6 +94,7 @@ class TTSResponse(BaseModel):
     hash: str = Field(description="音频 Hash 值")
     url: str = Field(description="音频访问 URL")
     file_size: int = Field(description="文件大小（字节）")
+    format: str = Field(default="wav", description="音频格式 (请求的压缩格式不可用时回退为 wav)")
     duration: Optional[float] = Field(default=None, description="音频时长（秒）")
 
 
@@ -75,6 +106,22 @@ class CacheCheckResponse(BaseModel):
     file_size: Optional[int] = Field(default=None, description="文件大小（字节）")
 
 
+class CacheBulkCheckRequest(BaseModel):
+    """批量缓存检查请求模型"""
+    
+    hashes: List[str] = Field(
+        ...,
+        max_length=5000,
+        description="音频 Hash 列表"
+    )
+
+
+class CacheBulkCheckResponse(BaseModel):
+    """批量缓存检查响应模型"""
+    
+    results: Dict[str, CacheCheckResponse] = Field(description="Hash → 检查结果 (与请求顺序一致)")
+
+
 class ErrorResponse(BaseModel):
     """错误响应模型"""
     
@@ -90,3 +137,5 @@ class HealthResponse(BaseModel):
     service: str = Field(default="opus-tts")
     version: str = Field(default="1.0.0")
     dashscope_connected: bool = Field(description="DashScope 连接状态")
+    circuit_state: str = Field(default="closed", description="首选提供方的熔断状态: closed / half_open / open / unknown (无熔断器)")
+    providers: Dict[str, str] = Field(default_factory=dict, description="各提供方的熔断状态")
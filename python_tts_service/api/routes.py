@@ -1,32 +1,52 @@
 """
 FastAPI 路由定义
 """
+import re
+import json
 import asyncio
+import contextlib
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 
 import structlog
-from fastapi import APIRouter, HTTPException, status, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, status, Request, Query, Response
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
 
 from api.models import (
     TTSRequest,
     TTSResponse,
+    TTSBatchRequest,
     CacheCheckResponse,
+    CacheBulkCheckRequest,
+    CacheBulkCheckResponse,
     ErrorResponse,
     HealthResponse
 )
+from core.admission import AdmissionRejected, admission
 from core.hash import generate_audio_hash
-from core.cache import cache_manager
+from core.cache import CachedAudio, cache_manager
 from core.config import config
-from services.dashscope import tts_service, DashScopeError
+from core.resilience import CircuitOpenError
+from core.stream_metrics import ws_latency
+from core.transcode import AUDIO_VARIANTS, negotiate_format
+from services.dashscope import DashScopeError
+from services.provider import TTSProviderError
+from services.router import tts_service
+from services.synthesis import (
+    local_speed_variant, stream_synthesis, synthesize_text_to_cache, synthesis_flights
+)
 
 logger = structlog.get_logger()
 
 # 创建路由器
 router = APIRouter()
 
-# 并发控制：由 main.py 在 startup 时初始化 app.state.semaphore
+# 并发控制: 缓存命中不受限，未命中的 DashScope 调用经过准入队列 (core/admission.py)
+
+AUDIO_MEDIA_TYPES = {variant.ext: variant.media_type for variant in AUDIO_VARIANTS.values()}
+_HASH_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
 
 
 @router.post(
@@ -34,7 +54,9 @@ router = APIRouter()
     response_model=TTSResponse,
     responses={
         400: {"model": ErrorResponse},
-        500: {"model": ErrorResponse}
+        429: {"model": ErrorResponse},
+        500: {"model": ErrorResponse},
+        503: {"model": ErrorResponse}
     },
     summary="生成 TTS 音频",
     description="生成语音音频，采用 Cache-First 策略"
@@ -47,105 +69,374 @@ async def generate_tts(request_data: TTSRequest, request: Request) -> TTSRespons
     1. 生成 Hash
     2. 检查缓存
     3. 如果缓存命中，直接返回
-    4. 否则调用 DashScope API 生成
+    4. 否则按 priority 进入准入队列，调用 DashScope API 生成 (相同 Hash 的并发请求合并为一次调用)；
+       超过 MAX_TEXT_LENGTH 的长文本按句切分并行合成 (每句单独缓存) 后拼接；
+       非 1.0 语速由 1.0× 主文件本地变速生成
     5. 保存到缓存并返回
+
+    准入队列已满返回 429、排队超时返回 503，均带 Retry-After
+    """
+    try:
+        # 1. 生成 Hash
+        logger.info("request_received_in_handler", text=request_data.text)
+        audio_hash = generate_audio_hash(
+            text=request_data.text,
+            voice=request_data.voice,
+            language=request_data.language,
+            speed=request_data.speed
+        )
+        
+        logger.info(
+            "tts_generate_request",
+            hash=audio_hash,
+            text_length=len(request_data.text),
+            voice=request_data.voice,
+            language=request_data.language
+        )
+        
+        audio_format = request_data.format or negotiate_format(request.headers.get("accept"))
+        return await _generate(request_data, audio_hash, audio_format)
+    
+    except Exception as e:
+        raise _http_error(e)
+
+
+@router.post(
+    "/stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"audio/wav": {}}},
+        429: {"model": ErrorResponse},
+        500: {"model": ErrorResponse},
+        503: {"model": ErrorResponse}
+    },
+    summary="流式生成 TTS 音频",
+    description="直接返回 WAV 音频字节: 缓存命中返回文件，未命中在 DashScope 第一个分片到达时开始输出 (chunked)"
+)
+async def stream_tts(request_data: TTSRequest) -> Response:
     """
-    # 获取全局 Semaphore (从 app.state 获取，避免 Windows 事件循环问题)
-    semaphore = request.app.state.semaphore
+    流式生成 TTS 音频 (非 WebSocket 客户端的低首包延迟路径)
 
-    async with semaphore:
+    - 未命中: 边合成边输出，同一份字节写入临时文件，合成完成后原子提交到缓存；
+      客户端中途断开不影响缓存写入，之后的 /tts/generate 直接命中
+    - 同 Hash 进行中的合成 (流式或非流式) 合并为一次 DashScope 调用
+    - 只输出 WAV (流式 WAV 头的长度字段为 0xFFFFFFFF)；format 参数忽略
+    - 响应头 X-Audio-Hash / X-Audio-Url 为缓存 Hash 与文件 URL，X-Cache 为 HIT / MISS
+    - 准入拒绝与第一个分片之前的合成失败返回 429 / 503 / 500；开始输出后失败则中断连接
+    - 超过 MAX_TEXT_LENGTH 的长文本返回 400 (改用 /tts/generate)
+    - 本地变速的语速 (1.0× 主文件已缓存时只需变速) 等变速完成后返回整个文件
+    """
+    if len(request_data.text) > config.MAX_TEXT_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "success": False,
+                "error": f"Text longer than {config.MAX_TEXT_LENGTH} characters, use /tts/generate",
+                "error_code": "TEXT_TOO_LONG"
+            }
+        )
+    audio_hash = generate_audio_hash(
+        text=request_data.text,
+        voice=request_data.voice,
+        language=request_data.language,
+        speed=request_data.speed
+    )
+    logger.info(
+        "tts_stream_request",
+        hash=audio_hash,
+        text_length=len(request_data.text),
+        voice=request_data.voice,
+        language=request_data.language
+    )
+    headers = {"X-Audio-Hash": audio_hash}
+    
+    cached = await cache_manager.alookup(
+        audio_hash,
+        cache_type=request_data.cache_type,
+        voice=request_data.voice,
+        language=request_data.language
+    )
+    if cached:
+        logger.info("cache_hit", hash=audio_hash)
+        headers.update({
+            "X-Audio-Url": cache_manager.get_audio_url(audio_hash, cached.path),
+            "X-Cache": "HIT"
+        })
+        return FileResponse(cached.path, media_type=AUDIO_MEDIA_TYPES["wav"], headers=headers)
+    logger.info("cache_miss", hash=audio_hash)
+    
+    metadata = {
+        "text": request_data.text,
+        "voice": request_data.voice,
+        "language": request_data.language,
+        "speed": request_data.speed,
+        "cache_type": request_data.cache_type
+    }
+    if local_speed_variant(request_data.speed):
         try:
-            # 1. 生成 Hash
-            logger.info("request_received_in_handler", text=request_data.text)
-            audio_hash = generate_audio_hash(
-                text=request_data.text,
-                voice=request_data.voice,
-                language=request_data.language,
-                speed=request_data.speed
-            )
-            
-            logger.info(
-                "tts_generate_request",
-                hash=audio_hash,
-                text_length=len(request_data.text),
-                voice=request_data.voice,
-                language=request_data.language
-            )
-            
-            # 2. 检查缓存
-            if cache_manager.exists(audio_hash):
-                audio_path = cache_manager.get_audio_path(audio_hash)
-                file_size = audio_path.stat().st_size
-                
-                return TTSResponse(
-                    success=True,
-                    cached=True,
-                    hash=audio_hash,
-                    url=f"/audio/{audio_hash}.{config.AUDIO_FORMAT}",
-                    file_size=file_size
-                )
-            
-            # 3. 调用 DashScope API（同步调用，在线程池中执行）
-            loop = asyncio.get_event_loop()
-            audio_data = await loop.run_in_executor(
-                None,
-                tts_service.synthesize,
+            generated, _ = await synthesize_text_to_cache(
+                audio_hash,
                 request_data.text,
                 request_data.voice,
                 request_data.language,
-                request_data.speed
-            )
-            
-            # 4. 保存到缓存
-            audio_path = cache_manager.save_audio(
-                hash_key=audio_hash,
-                audio_data=audio_data,
-                metadata={
-                    "text": request_data.text,
-                    "voice": request_data.voice,
-                    "language": request_data.language,
-                    "speed": request_data.speed
-                }
-            )
-            
-            file_size = audio_path.stat().st_size
-            
-            logger.info(
-                "tts_generated",
-                hash=audio_hash,
-                file_size=file_size,
-                cached=False
-            )
-            
-            return TTSResponse(
-                success=True,
-                cached=False,
-                hash=audio_hash,
-                url=f"/audio/{audio_hash}.{config.AUDIO_FORMAT}",
-                file_size=file_size
+                request_data.speed,
+                metadata=metadata,
+                priority=request_data.priority
             )
-        
-        except DashScopeError as e:
-            logger.error("dashscope_error", error=str(e))
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail={
-                    "success": False,
-                    "error": str(e),
-                    "error_code": "DASHSCOPE_ERROR"
-                }
-            )
-        
         except Exception as e:
-            logger.error("unexpected_error", error=str(e), exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail={
-                    "success": False,
-                    "error": "Internal server error",
-                    "error_code": "INTERNAL_ERROR"
-                }
+            raise _http_error(e)
+        headers.update({
+            "X-Audio-Url": cache_manager.get_audio_url(audio_hash, generated.path),
+            "X-Cache": "MISS"
+        })
+        return FileResponse(generated.path, media_type=AUDIO_MEDIA_TYPES["wav"], headers=headers)
+    
+    chunks = stream_synthesis(
+        audio_hash,
+        request_data.text,
+        request_data.voice,
+        request_data.language,
+        request_data.speed,
+        metadata=metadata,
+        priority=request_data.priority
+    )
+    # 等到第一个分片再发送响应头，之前的失败仍可返回错误状态码
+    try:
+        first = await chunks.__anext__()
+    except Exception as e:
+        await chunks.aclose()
+        raise _http_error(e)
+    
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            logger.error("tts_stream_interrupted", hash=audio_hash, error=str(e))
+            raise
+        finally:
+            await chunks.aclose()
+    
+    headers.update({"X-Audio-Url": cache_manager.get_audio_url(audio_hash), "X-Cache": "MISS"})
+    return StreamingResponse(body(), media_type=AUDIO_MEDIA_TYPES["wav"], headers=headers)
+
+
+@router.post(
+    "/generate/batch",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    summary="批量生成 TTS 音频",
+    description="一次提交多条 TTS 请求，按完成顺序以 NDJSON 逐行返回结果 (缓存命中立即返回)"
+)
+async def generate_tts_batch(batch: TTSBatchRequest, request: Request) -> StreamingResponse:
+    """
+    批量生成 TTS 音频 (课程预加载: 一次往返代替逐句请求)
+    
+    - 按 (Hash, 格式) 去重，每个唯一条目只处理一次，结果行的 indices 为其在 items 中的全部下标
+    - 未命中与单条请求走同一准入队列 (优先级取 batch.priority)，
+      本批次同时进行的合成不超过 BATCH_MAX_CONCURRENCY，避免一次占满队列
+    - 每行一个 JSON: 成功为 TTSResponse 字段，失败为 ErrorResponse 字段 + status (+ retry_after)
+    - 条目逐条校验，无效条目 (音色不支持、文本为空或过长等) 单独返回 INVALID_ITEM (status 422) 行，不影响其他条目
+    """
+    accept_format = negotiate_format(request.headers.get("accept"))
+    unique: Dict[Tuple[str, Optional[str]], Tuple[TTSRequest, List[int]]] = {}
+    invalid: List[str] = []
+    for index, raw in enumerate(batch.items):
+        try:
+            item = TTSRequest.model_validate(raw)
+        except ValidationError as e:
+            error = "; ".join(
+                f"{'.'.join(str(part) for part in err['loc']) or 'item'}: {err['msg']}" for err in e.errors()
             )
+            invalid.append(json.dumps({
+                "indices": [index],
+                "success": False,
+                "error": error,
+                "error_code": "INVALID_ITEM",
+                "status": status.HTTP_422_UNPROCESSABLE_ENTITY
+            }, ensure_ascii=False) + "\n")
+            continue
+        audio_hash = generate_audio_hash(
+            text=item.text,
+            voice=item.voice,
+            language=item.language,
+            speed=item.speed
+        )
+        audio_format = item.format or accept_format
+        entry = unique.setdefault(
+            (audio_hash, audio_format),
+            (item.model_copy(update={"priority": batch.priority}), [])
+        )
+        entry[1].append(index)
+    
+    logger.info(
+        "tts_batch_request",
+        items=len(batch.items),
+        unique=len(unique),
+        invalid=len(invalid),
+        priority=batch.priority
+    )
+    limiter = asyncio.Semaphore(config.BATCH_MAX_CONCURRENCY)
+    
+    async def run_item(audio_hash: str, audio_format: Optional[str], item: TTSRequest, indices: List[int]) -> str:
+        try:
+            result = await _generate(item, audio_hash, audio_format, limiter=limiter)
+            line = {"indices": indices, **result.model_dump(exclude_none=True)}
+        except Exception as e:
+            error = _http_error(e)
+            line = {"indices": indices, "hash": audio_hash, **error.detail, "status": error.status_code}
+            if error.headers and "Retry-After" in error.headers:
+                line["retry_after"] = int(error.headers["Retry-After"])
+        return json.dumps(line, ensure_ascii=False) + "\n"
+    
+    async def stream() -> AsyncIterator[str]:
+        for line in invalid:
+            yield line
+        tasks = [
+            asyncio.ensure_future(run_item(audio_hash, audio_format, item, indices))
+            for (audio_hash, audio_format), (item, indices) in unique.items()
+        ]
+        try:
+            for completed in asyncio.as_completed(tasks):
+                yield await completed
+        finally:
+            # 客户端断开: 取消尚未完成的条目 (已开始的合成由 single-flight 继续写入缓存)
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+async def _generate(
+    request_data: TTSRequest,
+    audio_hash: str,
+    audio_format: Optional[str],
+    limiter: Optional[asyncio.Semaphore] = None
+) -> TTSResponse:
+    """
+    查缓存，未命中则合成并写入缓存 (单条 / 批量共用)
+    
+    Args:
+        limiter: 批量请求的本批次并发限制，只约束未命中的合成
+    """
+    # 2. 检查缓存 (磁盘 I/O 不在事件循环中执行)
+    cached = await cache_manager.alookup(
+        audio_hash,
+        cache_type=request_data.cache_type,
+        voice=request_data.voice,
+        language=request_data.language
+    )
+    if cached:
+        logger.info("cache_hit", hash=audio_hash)
+        audio, audio_format = await _select_variant(audio_hash, cached, audio_format)
+        return TTSResponse(
+            success=True,
+            cached=True,
+            hash=audio_hash,
+            url=cache_manager.get_audio_url(audio_hash, audio.path),
+            file_size=audio.size,
+            format=audio_format
+        )
+    logger.info("cache_miss", hash=audio_hash)
+    
+    # 3. 调用 DashScope API 并保存到缓存 (同 Hash 进行中的合成直接等待其结果)
+    metadata = {
+        "text": request_data.text,
+        "voice": request_data.voice,
+        "language": request_data.language,
+        "speed": request_data.speed,
+        "cache_type": request_data.cache_type
+    }
+    async with limiter or contextlib.nullcontext():
+        generated, coalesced = await synthesize_text_to_cache(
+            audio_hash,
+            request_data.text,
+            request_data.voice,
+            request_data.language,
+            request_data.speed,
+            metadata=metadata,
+            priority=request_data.priority
+        )
+    if coalesced:
+        # 合成由其他请求发起，按本请求的 cache_type 记录访问 (vocab / phrase 提升)
+        cache_manager.touch(audio_hash, request_data.cache_type)
+    
+    logger.info(
+        "tts_generated",
+        hash=audio_hash,
+        file_size=generated.size,
+        cached=False,
+        coalesced=coalesced
+    )
+    
+    audio, audio_format = await _select_variant(audio_hash, generated, audio_format)
+    return TTSResponse(
+        success=True,
+        cached=False,
+        hash=audio_hash,
+        url=cache_manager.get_audio_url(audio_hash, audio.path),
+        file_size=audio.size,
+        format=audio_format
+    )
+
+
+def _http_error(e: Exception) -> HTTPException:
+    """生成过程中的异常 → HTTP 错误 (准入拒绝 429 / 503，上游熔断 503，合成失败 500)"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, AdmissionRejected):
+        return HTTPException(
+            status_code=e.status_code,
+            detail={
+                "success": False,
+                "error": "TTS service busy, retry later",
+                "error_code": "QUEUE_FULL" if e.reason == "queue_full" else "QUEUE_TIMEOUT"
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if isinstance(e, CircuitOpenError):
+        # 上游熔断: 快速失败，缓存命中不受影响
+        return HTTPException(
+            status_code=e.status_code,
+            detail={
+                "success": False,
+                "error": str(e),
+                "error_code": "PROVIDER_UNAVAILABLE"
+            },
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if isinstance(e, TTSProviderError):
+        logger.error("tts_provider_error", error=str(e))
+        return HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail={
+                "success": False,
+                "error": str(e),
+                "error_code": "DASHSCOPE_ERROR" if isinstance(e, DashScopeError) else "TTS_PROVIDER_ERROR"
+            }
+        )
+    logger.error("unexpected_error", error=str(e), exc_info=e)
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail={
+            "success": False,
+            "error": "Internal server error",
+            "error_code": "INTERNAL_ERROR"
+        }
+    )
+
+async def _select_variant(
+    audio_hash: str,
+    cached: CachedAudio,
+    audio_format: Optional[str]
+) -> Tuple[CachedAudio, str]:
+    """取请求格式的缓存文件 (按需转码)，不可用时回退为主格式"""
+    if audio_format and audio_format != config.AUDIO_FORMAT:
+        variant = await cache_manager.aensure_variant(audio_hash, audio_format, cached)
+        if variant is not None:
+            return variant, audio_format
+    return cached, config.AUDIO_FORMAT
 
 
 @router.get(
@@ -164,29 +455,220 @@ async def check_cache(hash: str) -> CacheCheckResponse:
     Returns:
         CacheCheckResponse: 缓存检查结果
     """
-    exists = cache_manager.exists(hash)
+    cached = await cache_manager.alookup(hash)
     
-    if exists:
-        audio_path = cache_manager.get_audio_path(hash)
-        file_size = audio_path.stat().st_size
-        
+    if cached:
         return CacheCheckResponse(
             exists=True,
-            url=f"/audio/{hash}.{config.AUDIO_FORMAT}",
-            file_size=file_size
+            url=cache_manager.get_audio_url(hash, cached.path),
+            file_size=cached.size
         )
     
     return CacheCheckResponse(exists=False)
 
 
+@router.post(
+    "/check",
+    response_model=None,
+    responses={200: {"model": CacheBulkCheckResponse}},
+    summary="批量检查缓存是否存在",
+    description="一次检查多个 Hash (最多 5000 个)，返回每个 Hash 的存在性、URL 与文件大小"
+)
+async def check_cache_bulk(request_data: CacheBulkCheckRequest) -> JSONResponse:
+    """
+    批量检查缓存是否存在
+
+    索引已加载时直接由内存回答，其余 Hash 按目录分组一次查磁盘；
+    只判断存在，不计入命中统计与访问时间。非法 Hash 视为不存在。
+    结果直接序列化 (千级条目逐个构造 / 校验响应模型的开销比查询本身更大)。
+    """
+    found = await cache_manager.acheck_many(
+        hash_key for hash_key in request_data.hashes if _HASH_PATTERN.match(hash_key)
+    )
+    missing = {"exists": False, "url": None, "file_size": None}
+    results = {}
+    for hash_key in request_data.hashes:
+        audio = found.get(hash_key)
+        results[hash_key] = {"exists": True, "url": audio[0], "file_size": audio[1]} if audio else missing
+    return JSONResponse({"results": results})
+
+
 @router.get(
     "/stats",
     summary="获取缓存统计",
-    description="获取缓存目录的统计信息"
+    description="获取缓存统计信息 (增量计数器)；recompute=true 时先全量审计缓存目录"
 )
-async def get_cache_stats() -> Dict[str, Any]:
-    """获取缓存统计信息"""
-    return cache_manager.get_cache_stats()
+async def get_cache_stats(recompute: bool = False) -> Dict[str, Any]:
+    """获取缓存统计信息 (含本进程的请求合并计数)"""
+    stats = await cache_manager.aget_cache_stats(recompute=recompute)
+    return {
+        **stats,
+        "singleflight": synthesis_flights.get_stats(),
+        "admission": admission.get_stats(),
+        "provider": tts_service.get_stats(),
+        "websocket": ws_latency.get_stats()
+    }
+
+
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    summary="Prometheus 指标",
+    description="准入队列深度 / 排队时间 / 拒绝数、自适应并发上限及其变化原因、上游熔断 / 重试 / 对冲、请求合并与缓存命中计数、WebSocket 首包延迟与分片间隔 (Prometheus 文本格式)"
+)
+async def get_metrics() -> PlainTextResponse:
+    """本进程的指标 (每个 worker 各自一份)"""
+    flights = synthesis_flights.get_stats()
+    cache = await cache_manager.run_io(cache_manager.stats.snapshot)
+    lines = admission.metric_lines() + tts_service.metric_lines() + [
+        "# HELP tts_singleflight_in_flight Synthesis calls in flight.",
+        "# TYPE tts_singleflight_in_flight gauge",
+        f"tts_singleflight_in_flight {flights['in_flight']}",
+        "# HELP tts_singleflight_coalesced_total Requests coalesced into an in-flight synthesis.",
+        "# TYPE tts_singleflight_coalesced_total counter",
+        f"tts_singleflight_coalesced_total {flights['coalesced']}",
+        "# HELP tts_cache_lookups_total Cache lookups by result (all workers, persisted).",
+        "# TYPE tts_cache_lookups_total counter",
+        f'tts_cache_lookups_total{{result="hit"}} {cache.get("hits", 0)}',
+        f'tts_cache_lookups_total{{result="miss"}} {cache.get("misses", 0)}',
+    ] + ws_latency.metric_lines()
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@router.get(
+    "/metadata",
+    summary="查询缓存元数据",
+    description="按音色 / 语言 / 创建时间范围查询缓存元数据"
+)
+async def query_metadata(
+    voice: Optional[str] = None,
+    language: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000)
+) -> List[Dict[str, Any]]:
+    """查询缓存元数据 (since / until 为 ISO 时间字符串)"""
+    return await cache_manager.aquery_metadata(
+        voice=voice,
+        language=language,
+        since=since,
+        until=until,
+        limit=limit
+    )
+
+
+@router.get(
+    "/metadata/{hash}",
+    summary="获取单条缓存元数据"
+)
+async def get_metadata(hash: str) -> Dict[str, Any]:
+    """按 Hash 获取缓存元数据"""
+    metadata = await cache_manager.aget_metadata(hash)
+    if metadata is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={
+                "success": False,
+                "error": "Metadata not found",
+                "error_code": "NOT_FOUND"
+            }
+        )
+    return metadata
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range 头，返回闭区间 (start, end)
+
+    多段或格式不支持时返回 None (按 RFC 9110 回退为完整响应)；
+    范围无法满足时抛出 ValueError (416)
+    """
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # bytes=-N: 最后 N 字节
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+@router.get(
+    "/audio/{hash}",
+    summary="获取音频文件",
+    description="按 Hash 返回音频字节 (热点内存缓存 → 磁盘)，支持格式协商、Range 与 ETag 条件请求",
+    responses={404: {"model": ErrorResponse}}
+)
+async def get_audio(
+    hash: str,
+    request: Request,
+    format: Optional[str] = Query(default=None, pattern="^(wav|opus|mp3|aac)$")
+) -> Response:
+    """
+    直接由服务返回音频 (没有 nginx /audio/ alias 的部署使用)
+
+    - 格式: ?format= 优先，其次 Accept 头；压缩变体不可用时回退为 wav
+    - 同一 Hash 的内容不变，返回长期缓存头 (Cache-Control immutable)
+    - If-None-Match 命中返回 304；Range 返回 206 / 416
+    """
+    audio = None
+    if _HASH_PATTERN.match(hash):
+        audio_format = format or negotiate_format(request.headers.get("accept"))
+        if audio_format and audio_format != config.AUDIO_FORMAT:
+            audio = await cache_manager.aread_audio(hash, audio_format)
+        if audio is None:
+            audio = await cache_manager.aread_audio(hash)
+    if audio is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={
+                "success": False,
+                "error": "Audio not found",
+                "error_code": "NOT_FOUND"
+            }
+        )
+    
+    size = len(audio.data)
+    headers = {
+        "ETag": audio.etag,
+        "Cache-Control": f"public, max-age={config.AUDIO_HTTP_MAX_AGE}, immutable",
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept",
+    }
+    media_type = AUDIO_MEDIA_TYPES.get(audio.ext, "application/octet-stream")
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or audio.etag in [
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    ]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    range_header = request.headers.get("range")
+    # If-Range 与当前 ETag 不一致时忽略 Range，返回完整内容
+    if range_header and request.headers.get("if-range", audio.etag) == audio.etag:
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{size}"}
+            )
+        if byte_range is not None:
+            start, end = byte_range
+            return Response(
+                content=audio.data[start:end + 1],
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                media_type=media_type,
+                headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"}
+            )
+    
+    return Response(content=audio.data, media_type=media_type, headers=headers)
 
 
 @router.get(
@@ -201,14 +683,17 @@ async def health_check() -> HealthResponse:
     
     检查项:
     - 服务是否运行
-    - DashScope API 是否可用
+    - 各提供方的熔断状态 (任一打开时为 degraded，由其余提供方承接；全部打开时只能返回已缓存的音频)
+    - 没有提供方带熔断器时 (如测试用 fake 提供方) 熔断状态报告为 unknown，服务视为 healthy
     """
-    # 简单检查 API Key 是否配置
-    dashscope_connected = bool(config.OPENAI_API_KEY)
+    providers = tts_service.circuit_states()
+    dashscope_connected = bool(config.OPENAI_API_KEY) and providers.get("dashscope") not in (None, "open")
     
     return HealthResponse(
-        status="healthy" if dashscope_connected else "degraded",
+        status="healthy" if "open" not in providers.values() else "degraded",
         service="opus-tts",
         version="1.0.0",
-        dashscope_connected=dashscope_connected
+        dashscope_connected=dashscope_connected,
+        circuit_state=next(iter(providers.values()), "unknown"),
+        providers=providers
     )
@@ -2,119 +2,392 @@
 WebSocket TTS 流式播放接口
 
 基于 DashScope qwen3-tts-flash 模型实现实时音频流式输出
+
+两种输出协议 (连接建立时协商，见 negotiate_protocol):
+- json (默认，兼容旧客户端): 音频分片为文本帧 {"type": "audio", "data": "<base64 PCM>", ...}
+- binary: 音频分片为二进制帧 = 2 字节头长度 (大端) + JSON 头 (requestId / seq / sample_rate / format) + 裸 PCM，
+  省去 base64 的 33% 体积与两端的编解码；done / error / pong 等控制消息仍为 JSON 文本帧
+
+缓存与 HTTP 接口共用 (Key 为 generate_audio_hash，语言名规范为语言代码):
+命中时从缓存读出 PCM 分片发送 (首秒音频立即发出，其后按 WS_CACHE_PACE 倍实时速度)，不调用提供方；
+未命中与 POST /tts/stream 共用合成 (services/synthesis.py 的 stream_synthesis: 同一 Flight、准入名额与缓存写入)，
+之后 /tts/generate 与前端同样命中
+
+长文本与 /tts/generate 相同按句分段 (每段单独缓存)，发送当前段时后续段已在合成 (WS_PIPELINE_DEPTH)
 """
 import asyncio
-import queue
 import time
 import base64
-import hashlib
-import wave
-import re
-from pathlib import Path
-from typing import Optional
+import json
+import struct
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 import structlog
-import dashscope
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
+from core.cache import cache_manager
 from core.config import config
+from core.hash import generate_audio_hash
+from core.stream_metrics import ws_latency
+from core.text_split import split_sentences
+from services.dashscope import LANGUAGE_CODES, PCM_SAMPLE_RATE, PCM_SAMPLE_WIDTH, wav_to_pcm
+from services.synthesis import stream_synthesis
 
 logger = structlog.get_logger()
 
 # 创建 WebSocket 路由器
 ws_router = APIRouter()
 
+# Sec-WebSocket-Protocol 子协议名
+SUBPROTOCOL_BINARY = "tts.binary.v1"
+SUBPROTOCOL_JSON = "tts.json.v1"
+
+# 二进制帧中头长度字段
+_HEADER_LENGTH = struct.Struct(">H")
 
-def split_text(text: str, max_length: int = 500) -> list:
+
+def negotiate_protocol(websocket: WebSocket) -> Tuple[str, Optional[str]]:
     """
-    智能文本分块，按句子分割，保持语义完整
-    
-    Args:
-        text: 要分割的文本
-        max_length: 每块最大字符数
-        
-    Returns:
-        文本块列表
+    协商输出协议，返回 (协议, 回应的子协议)
+
+    优先按客户端提供的子协议 (Sec-WebSocket-Protocol) 选择；
+    无法设置子协议的客户端可用查询参数 ?protocol=binary；都没有时为 json
     """
-    chunks = []
-    current_chunk = ""
-    
-    # 按句子分割
-    sentences = text.replace('。', '。\n').replace('！', '！\n').replace('？', '？\n').split('\n')
-    
-    for sentence in sentences:
-        sentence = sentence.strip()
-        if not sentence:
-            continue
-            
-        if len(current_chunk) + len(sentence) <= max_length:
-            current_chunk += sentence
-        else:
-            if current_chunk:
-                chunks.append(current_chunk)
-            current_chunk = sentence
+    offered = websocket.scope.get("subprotocols") or []
+    if SUBPROTOCOL_BINARY in offered:
+        return "binary", SUBPROTOCOL_BINARY
+    if SUBPROTOCOL_JSON in offered:
+        return "json", SUBPROTOCOL_JSON
+    if websocket.query_params.get("protocol") == "binary":
+        return "binary", None
+    return "json", None
+
+
+def encode_audio_frame(header: dict, audio: bytes) -> bytes:
+    """二进制音频帧: 头长度 + JSON 头 + 音频字节"""
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return _HEADER_LENGTH.pack(len(encoded)) + encoded + audio
+
+
+def decode_audio_frame(frame: bytes) -> Tuple[dict, bytes]:
+    """encode_audio_frame 的逆操作 (供客户端 / 测试参考)"""
+    (length,) = _HEADER_LENGTH.unpack_from(frame)
+    end = _HEADER_LENGTH.size + length
+    return json.loads(frame[_HEADER_LENGTH.size:end].decode("utf-8")), frame[end:]
+
+
+class WSConnection:
+    """
+    单个 WebSocket 连接的发送端与进行中的请求
+
+    多个请求的任务共用一个连接: 发送经 FIFO 锁串行化 (每次一帧)，各请求的分片按到达顺序轮流发出
+    """
+
+    def __init__(self, websocket: WebSocket, protocol: str):
+        self.websocket = websocket
+        self.protocol = protocol
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._lock = asyncio.Lock()
+
+    async def send_json(self, msg: dict) -> None:
+        async with self._lock:
+            await self.websocket.send_json(msg)
+
+    async def send_audio(self, msg: dict, request_id: str, seq: int) -> None:
+        """
+        按协商的协议发送一个音频分片
+
+        msg 为 {"type": "audio", "sample_rate": ...} 加 "data" (base64) 或 "pcm" (字节，来自缓存或合成)，
+        只在协议需要时转换编码
+        """
+        pcm = msg.pop("pcm", None) if "pcm" in msg else None
+        if self.protocol == "binary":
+            header = {
+                "requestId": request_id,
+                "seq": seq,
+                "segment": msg.get("segment", 0),
+                "sample_rate": msg["sample_rate"],
+                "format": "pcm_s16le"
+            }
+            frame = encode_audio_frame(header, pcm if pcm is not None else base64.b64decode(msg["data"]))
+            async with self._lock:
+                await self.websocket.send_bytes(frame)
+            return
+        if pcm is not None:
+            msg["data"] = base64.b64encode(pcm).decode("ascii")
+        msg = {**msg, "seq": seq}
+        if request_id:
+            msg["requestId"] = request_id
+        await self.send_json(msg)
+
+    def cancel(self, request_id: str) -> bool:
+        """取消进行中的请求 (上游流随任务取消而关闭)；不存在时返回 False"""
+        task = self.tasks.get(request_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    async def aclose(self) -> None:
+        """连接断开: 取消所有进行中的请求"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _cached_messages(pcm: bytes) -> List[dict]:
+    """缓存命中: 按 WS_CACHE_CHUNK_MS 切分 PCM (发送节奏由 _Pacer 控制)"""
+    chunk_bytes = max(PCM_SAMPLE_RATE * config.WS_CACHE_CHUNK_MS // 1000, 1) * PCM_SAMPLE_WIDTH
+    return [
+        {"type": "audio", "pcm": pcm[offset:offset + chunk_bytes], "sample_rate": PCM_SAMPLE_RATE, "cached": True}
+        for offset in range(0, len(pcm), chunk_bytes)
+    ]
+
+
+def _pcm_offset(head: bytes) -> Optional[int]:
+    """WAV 字节流中 PCM 数据的起始位置 (逐个跳过 data 之前的块)；头还不完整时返回 None"""
+    offset = 12
+    while offset + 8 <= len(head):
+        chunk_id, size = struct.unpack_from("<4sI", head, offset)
+        if chunk_id == b"data":
+            return offset + 8
+        offset += 8 + size + (size & 1)
+    return None
+
+
+async def _pcm_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """stream_synthesis 的 WAV 字节流 → 按采样对齐的 PCM 分片"""
+    buffer = b""
+    in_header = True
+    async for chunk in chunks:
+        buffer += chunk
+        if in_header:
+            offset = _pcm_offset(buffer)
+            if offset is None:
+                continue
+            buffer, in_header = buffer[offset:], False
+        aligned = len(buffer) - len(buffer) % PCM_SAMPLE_WIDTH
+        if aligned:
+            yield buffer[:aligned]
+            buffer = buffer[aligned:]
+
+
+def _audio_seconds(msg: dict) -> float:
+    """音频分片的时长 (base64 按编码长度估算，不解码)"""
+    if "pcm" in msg:
+        size = len(msg["pcm"])
+    else:
+        data = msg["data"]
+        size = len(data) * 3 // 4 - (len(data) - len(data.rstrip("=")))
+    return size / (PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH)
+
+
+class _Pacer:
+    """
+    缓存命中分片的发送节奏 (按本请求已发送的音频时长)
+
+    前 WS_CACHE_PREBUFFER_MS 的音频立即发送 (客户端尽快起播)，其后按 WS_CACHE_PACE 倍实时速度，
+    避免长音频一次性占满连接而挡住同一连接上其他请求的分片；WS_CACHE_PACE=0 时不限速。
+    实时合成的分片由提供方的速度决定，只计入已发送时长
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.sent = 0.0
+
+    async def wait(self) -> None:
+        if config.WS_CACHE_PACE <= 0:
+            return
+        ahead = self.sent - config.WS_CACHE_PREBUFFER_MS / 1000
+        delay = self.started + max(ahead, 0) / config.WS_CACHE_PACE - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def advance(self, seconds: float) -> None:
+        self.sent += seconds
+
+
+async def _segment_messages(segment: str, voice: str, language: str) -> AsyncIterator[dict]:
+    """
+    一段文本的音频消息
+
+    缓存命中直接切分缓存的音频；未命中与 POST /tts/stream 共用 stream_synthesis
+    (同一 Flight Key、准入名额、独立的合成任务与缓存写入)，HTTP 与 WebSocket 的相同请求只调用一次提供方。
+    请求取消 / 连接断开只让本请求停止接收；没有其他订阅者时中止本请求发起的合成
+
+    Raises (迭代时):
+        DashScopeError / AdmissionRejected: 与 HTTP 接口相同
+    """
+    audio_hash = generate_audio_hash(segment, voice, language, 1.0)
     
-    if current_chunk:
-        chunks.append(current_chunk)
+    # 缓存命中: 直接发送缓存的音频，不调用提供方
+    cached = None
+    if await cache_manager.alookup(audio_hash, voice=voice, language=language) is not None:
+        # 查到之后恰好被淘汰时按未命中处理
+        cached = await cache_manager.aread_audio(audio_hash)
+    if cached is not None:
+        for msg in _cached_messages(wav_to_pcm(cached.data)):
+            yield msg
+        return
     
-    # 如果没有分块成功，直接截断
-    return chunks if chunks else [text[:max_length]]
+    metadata = {
+        "text": segment,
+        "voice": voice,
+        "language": language,
+        "speed": 1.0,
+        "cache_type": "temporary"
+    }
+    chunks = stream_synthesis(
+        audio_hash, segment, voice, language, 1.0, metadata, priority="interactive", abort_when_unused=True
+    )
+    try:
+        async for pcm in _pcm_stream(chunks):
+            yield {"type": "audio", "pcm": pcm, "sample_rate": PCM_SAMPLE_RATE}
+    finally:
+        await chunks.aclose()
+
+
+_SEGMENT_END = None
+
+
+async def _produce_segment(segment: str, voice: str, language: str, queue: asyncio.Queue) -> None:
+    """预取任务: 一段的消息放入队列，以 _SEGMENT_END 结束 (出错时先放入 error 消息)"""
+    try:
+        async for msg in _segment_messages(segment, voice, language):
+            queue.put_nowait(msg)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error("ws_tts_api_error", error=str(e))
+        queue.put_nowait({"type": "error", "message": f"TTS 服务错误: {str(e)}"})
+    queue.put_nowait(_SEGMENT_END)
 
 
-async def save_audio_file(pcm_data: bytearray, text: str, voice: str, language: str):
+async def _stream_request(conn: WSConnection, data: dict) -> None:
     """
-    将音频数据保存为 WAV 文件 (Stream-and-Save 策略)
+    处理一个合成请求: 按段依次发送音频，最后发送 done (或 error + done)
+
+    文本超过 MAX_TEXT_LENGTH 时按句切分 (与 /tts/generate 的长文本相同，各段缓存共用)；
+    当前段发送时后续 WS_PIPELINE_DEPTH - 1 段已在合成，段与段之间不留空档
+    """
+    t_request_received = time.time()
+    text = data.get('text', '')
+    voice = data.get('voice', 'Cherry')
+    language = data.get('language', 'English')
+    language = LANGUAGE_CODES.get(language, language)
+    request_id = data.get('requestId', '')
     
-    注意: DashScope 返回的 base64 chunk 解码后可能已经是完整 WAV 数据(带 RIFF 头)。
-    如果直接用 wave.open 再包装一次，会产生双重 RIFF 头，
-    导致第二个 RIFF 头字节被当做 PCM 采样播放，出现开头"哔"声杂音。
+    # 不另做清洗: 与 HTTP 接口一样由 generate_audio_hash 的 sanitize_for_tts 统一，两者的缓存 Key 相同
+    text = text.strip()
+    
+    if not text:
+        await conn.send_json({
+            "type": "error",
+            "message": "文本不能为空",
+            "requestId": request_id
+        })
+        return
+    
+    if len(text) > config.MAX_LONG_TEXT_LENGTH:
+        await conn.send_json({
+            "type": "error",
+            "message": f"文本过长 (上限 {config.MAX_LONG_TEXT_LENGTH} 字符)",
+            "requestId": request_id
+        })
+        return
+    
+    # 文本分段
+    segments = [text] if len(text) <= config.MAX_TEXT_LENGTH else split_sentences(text, config.MAX_TEXT_LENGTH)
+    
+    logger.info(
+        "ws_tts_request",
+        request_id=request_id,
+        text_length=len(text),
+        segments=len(segments),
+        voice=voice
+    )
+    
+    timer = ws_latency.start()
+    pacer = _Pacer()
+    queues = [asyncio.Queue() for _ in segments]
+    producers: List[asyncio.Task] = []
+    
+    def prefetch(index: int) -> None:
+        """启动第 index 段起的 WS_PIPELINE_DEPTH 段的合成 (已启动的跳过)"""
+        while len(producers) < min(len(segments), index + config.WS_PIPELINE_DEPTH):
+            n = len(producers)
+            producers.append(asyncio.create_task(_produce_segment(segments[n], voice, language, queues[n])))
+    
+    async def send_segment(index: int) -> bool:
+        """发送第 index 段的消息；出错时返回 False (不再发送后续段)"""
+        first = True
+        while True:
+            msg = await queues[index].get()
+            if msg is _SEGMENT_END:
+                return True
+            if msg.get('type') != 'audio':
+                await conn.send_json({**msg, "requestId": request_id})
+                if msg.get('type') == 'error':
+                    return False
+                continue
+            if msg.pop("cached", False):
+                await pacer.wait()
+            pacer.advance(_audio_seconds(msg))
+            await conn.send_audio({**msg, "segment": index}, request_id, timer.chunks)
+            timer.chunk(new_segment=first)
+            first = False
     
-    参数:
-        pcm_data: 音频数据 (可能是裸 PCM 或已带 WAV 头)
-        text: 原始文本
-        voice: 音色
-        language: 语言
-    """
     try:
-        # 生成哈希 (与前端保持一致)
-        hash_input = f"{text}_{voice}_{language}_1.0"
-        audio_hash = hashlib.md5(hash_input.encode()).hexdigest()
-        
-        # 文件路径
-        audio_dir = config.CACHE_DIR
-        audio_dir.mkdir(parents=True, exist_ok=True)
-        
-        file_name = f"{audio_hash}.wav"
-        file_path = audio_dir / file_name
-        
-        # 检查文件是否已存在
-        if file_path.exists():
-            logger.info("ws_audio_cache_exists", hash=audio_hash)
-            return
-        
-        # 检测数据是否已经带有 WAV (RIFF) 头
-        if bytes(pcm_data[:4]) == b'RIFF' and bytes(pcm_data[8:12]) == b'WAVE':
-            # 数据已是完整 WAV，直接写入，避免双重头
-            with open(str(file_path), 'wb') as f:
-                f.write(bytes(pcm_data))
-            logger.info("ws_audio_saved", hash=audio_hash, size=len(pcm_data), format="wav_passthrough")
-        else:
-            # 裸 PCM 数据，需要包装 WAV 头
-            with wave.open(str(file_path), 'wb') as wav_file:
-                wav_file.setnchannels(1)       # 单声道
-                wav_file.setsampwidth(2)       # 16-bit
-                wav_file.setframerate(24000)   # 阿里云 TTS 采样率
-                wav_file.writeframes(bytes(pcm_data))
-            logger.info("ws_audio_saved", hash=audio_hash, size=len(pcm_data), format="pcm_wrapped")
-            
+        for index in range(len(segments)):
+            prefetch(index)
+            if not await send_segment(index):
+                break
+    finally:
+        for task in producers:
+            task.cancel()
+    
+    # 发送完成信号
+    await conn.send_json({
+        "type": "done",
+        "requestId": request_id,
+        "segments": len(segments),
+        "chunks": timer.chunks
+    })
+    
+    logger.info(
+        "ws_tts_complete",
+        request_id=request_id,
+        duration_ms=int((time.time() - t_request_received) * 1000),
+        **timer.summary()
+    )
+
+
+async def _run_request(conn: WSConnection, data: dict) -> None:
+    """请求任务: 取消 / 断开时静默结束，其他错误回报给客户端"""
+    request_id = data.get('requestId', '')
+    try:
+        await _stream_request(conn, data)
+    except asyncio.CancelledError:
+        logger.info("ws_tts_cancelled", request_id=request_id)
+        raise
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        logger.error("ws_audio_save_failed", error=str(e))
+        logger.error("ws_request_error", request_id=request_id, error=str(e))
+        try:
+            await conn.send_json({"type": "error", "message": str(e), "requestId": request_id})
+        except Exception:
+            pass
+    finally:
+        if conn.tasks.get(request_id) is asyncio.current_task():
+            del conn.tasks[request_id]
 
 
 @ws_router.websocket("/ws/tts")
 async def websocket_tts(websocket: WebSocket):
     """
-    WebSocket TTS 流式播放接口 (支持连接复用)
+    WebSocket TTS 流式播放接口 (支持连接复用与多路并发)
     
     接收 JSON 格式:
     {
@@ -127,163 +400,80 @@ async def websocket_tts(websocket: WebSocket):
     或心跳消息:
     { "type": "ping" }
     
+    或取消进行中的请求 (立即停止上游合成):
+    { "type": "cancel", "requestId": "..." }
+    
     发送 JSON 格式:
-    { "type": "audio", "data": "base64_pcm_data", "sample_rate": 24000, "requestId": "..." }
-    { "type": "done", "requestId": "..." }
+    { "type": "audio", "data": "base64_pcm_data", "sample_rate": 24000, "seq": 0, "segment": 0, "requestId": "..." }
+      (binary 协议下为二进制帧，见模块说明)
+    { "type": "done", "requestId": "...", "segments": 1, "chunks": 12 }
+    { "type": "cancelled", "requestId": "..." }
     { "type": "error", "message": "...", "requestId": "..." }
     { "type": "pong" }  // 心跳响应
+    
+    同一连接上最多 WS_MAX_IN_FLIGHT 个请求同时进行，各自的分片交错发出 (按 requestId 区分)；
+    超出上限或 requestId 重复的请求直接返回 error
     """
-    await websocket.accept()
-    logger.info("ws_connected")
+    protocol, subprotocol = negotiate_protocol(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    conn = WSConnection(websocket, protocol)
+    logger.info("ws_connected", protocol=protocol)
     
     try:
-        # 循环处理多个请求,保持连接活跃
+        # 循环接收请求,保持连接活跃；合成在各自的任务中进行
         while True:
             try:
-                # 接收客户端请求
                 data = await websocket.receive_json()
-                t_request_received = time.time()
-                
+                msg_type = data.get('type')
+                request_id = data.get('requestId', '')
+            
                 # 处理心跳消息
-                if data.get('type') == 'ping':
-                    await websocket.send_json({"type": "pong"})
+                if msg_type == 'ping':
+                    await conn.send_json({"type": "pong"})
                     continue
-                
-                text = data.get('text', '')
-                voice = data.get('voice', 'Cherry')
-                language = data.get('language', 'English')
-                request_id = data.get('requestId', '')
-                
-                if not text:
-                    await websocket.send_json({
+            
+                if msg_type == 'cancel':
+                    if conn.cancel(request_id):
+                        await conn.send_json({"type": "cancelled", "requestId": request_id})
+                    continue
+            
+                if not data.get('text', ''):
+                    await conn.send_json({
                         "type": "error",
                         "message": "文本不能为空",
                         "requestId": request_id
                     })
                     continue
-                
-                # 清理文本
-                text = text.replace('*', '').replace('#', '').strip()
-                text = re.sub(r'(?m)^\s*(?:Title|标题)[:：]\s*', '', text)
-                text = re.sub(r'(?m)^\s*[-]{3,}\s*$', '', text)
-                text = text.strip()
-                
-                # 文本分块
-                chunks = split_text(text, max_length=500)
-                text_to_process = chunks[0]
-                
-                logger.info(
-                    "ws_tts_request",
-                    request_id=request_id,
-                    text_length=len(text_to_process),
-                    voice=voice
-                )
-                
-                # 获取事件循环
-                loop = asyncio.get_event_loop()
-                
-                # 缓存策略: 仅对短文本缓存
-                should_cache = len(chunks) == 1
-                pcm_buffer = bytearray() if should_cache else None
-                
-                # 使用队列在线程间传递数据
-                audio_queue = queue.Queue()
-                
-                def call_tts():
-                    """在线程池中调用 TTS API"""
-                    try:
-                        response = dashscope.MultiModalConversation.call(
-                            model='qwen3-tts-flash',
-                            text=text_to_process,
-                            voice=voice,
-                            language_type=language,
-                            stream=True
-                        )
-                        
-                        for chunk in response:
-                            if hasattr(chunk, 'output') and chunk.output:
-                                audio_data = chunk.output.get('audio')
-                                if audio_data and 'data' in audio_data:
-                                    audio_queue.put({
-                                        "type": "audio",
-                                        "data": audio_data['data'],
-                                        "sample_rate": 24000
-                                    })
-                        
-                        audio_queue.put(None)  # 完成信号
-                        
-                    except Exception as e:
-                        logger.error("ws_tts_api_error", error=str(e))
-                        audio_queue.put({
-                            "type": "error",
-                            "message": f"TTS 服务错误: {str(e)}"
-                        })
-                        audio_queue.put(None)
-                
-                # 在线程池中执行 TTS 调用
-                loop.run_in_executor(None, call_tts)
-                
-                # 从队列读取并发送给客户端
-                while True:
-                    try:
-                        msg = await asyncio.get_event_loop().run_in_executor(
-                            None, 
-                            lambda: audio_queue.get(timeout=0.1)
-                        )
-                        
-                        if msg is None:
-                            break
-                        
-                        # 缓存 PCM 数据
-                        if should_cache and msg.get('type') == 'audio' and 'data' in msg:
-                            try:
-                                pcm_bytes = base64.b64decode(msg['data'])
-                                pcm_buffer.extend(pcm_bytes)
-                            except Exception:
-                                pass
-                        
-                        # 添加 requestId
-                        if isinstance(msg, dict) and request_id:
-                            msg['requestId'] = request_id
-                        await websocket.send_json(msg)
-                        
-                    except queue.Empty:
-                        await asyncio.sleep(0.01)
-                        continue
-                
-                # 发送完成信号
-                await websocket.send_json({
-                    "type": "done",
-                    "requestId": request_id
-                })
-                
-                # 后台保存音频
-                if should_cache and pcm_buffer and len(pcm_buffer) > 0:
-                    asyncio.create_task(save_audio_file(pcm_buffer, text, voice, language))
-                
-                logger.info(
-                    "ws_tts_complete",
-                    request_id=request_id,
-                    duration_ms=int((time.time() - t_request_received) * 1000)
-                )
-                
+            
+                if request_id in conn.tasks:
+                    await conn.send_json({
+                        "type": "error",
+                        "message": "requestId 已在进行中",
+                        "requestId": request_id
+                    })
+                    continue
+            
+                if len(conn.tasks) >= config.WS_MAX_IN_FLIGHT:
+                    logger.warning("ws_in_flight_limit", request_id=request_id, limit=config.WS_MAX_IN_FLIGHT)
+                    await conn.send_json({
+                        "type": "error",
+                        "message": f"进行中的请求过多 (上限 {config.WS_MAX_IN_FLIGHT})",
+                        "requestId": request_id
+                    })
+                    continue
+            
+                conn.tasks[request_id] = asyncio.create_task(_run_request(conn, data))
             except WebSocketDisconnect:
-                logger.info("ws_client_disconnected")
-                break
+                raise
             except Exception as e:
+                # 无法解析的消息: 回报错误，连接保持
                 logger.error("ws_request_error", error=str(e))
-                try:
-                    await websocket.send_json({
-                        "type": "error",
-                        "message": str(e),
-                        "requestId": data.get('requestId', '') if 'data' in locals() else ''
-                    })
-                except:
-                    pass
+                await conn.send_json({"type": "error", "message": str(e), "requestId": ""})
                     
     except WebSocketDisconnect:
         logger.info("ws_disconnected")
     except Exception as e:
         logger.error("ws_error", error=str(e))
     finally:
+        await conn.aclose()
         logger.info("ws_cleanup")
@@ -0,0 +1,158 @@
+"""
+DashScope 客户端并发基准 (sync SDK vs async httpx)
+==================================================
+
+功能:
+    在本机启动一个模拟 DashScope 流式接口的 SSE 桩服务 (每次合成返回若干音频分片，分片间有延迟)，
+    分别用 TTS_CLIENT=sync (官方 SDK + 默认线程池) 与 TTS_CLIENT=async (httpx 连接池) 发起 N 个并发合成，
+    报告线程数峰值与延迟分位数。不访问真实 DashScope，不产生费用。
+
+使用方法:
+    cd python_tts_service
+    python bench_tts_client.py
+    python bench_tts_client.py --concurrency 200 --chunks 10 --chunk-delay 0.03
+
+注意:
+    1. sync 模式的并发上限是默认线程池大小 (min(32, CPU + 4))，超出的合成在线程池里排队，
+       体现为 p99 随并发线性增长
+    2. 结果只反映客户端开销，真实延迟以 DashScope 首包时间为主
+"""
+import os
+import time
+import json
+import base64
+import socket
+import asyncio
+import argparse
+import threading
+import multiprocessing
+from typing import Dict, List
+
+os.environ.setdefault("TTS_API_KEY", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import dashscope
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from core.config import config
+
+
+def create_stub_app(chunks: int, chunk_delay: float, chunk_bytes: int) -> FastAPI:
+    """模拟 DashScope multimodal-generation 的 SSE 响应"""
+    app = FastAPI()
+    payload = base64.b64encode(b"\x00" * chunk_bytes).decode()
+
+    @app.post("/api/v1/services/aigc/multimodal-generation/generation")
+    async def generation():
+        async def events():
+            for i in range(chunks):
+                await asyncio.sleep(chunk_delay)
+                data = {
+                    "output": {"audio": {"data": payload}, "finish_reason": "null"},
+                    "usage": {"characters": 10},
+                    "request_id": "bench",
+                }
+                yield f"id:{i + 1}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(data)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def _serve_stub(port: int, chunks: int, chunk_delay: float, chunk_bytes: int) -> None:
+    uvicorn.run(create_stub_app(chunks, chunk_delay, chunk_bytes), host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_stub_server(chunks: int, chunk_delay: float, chunk_bytes: int) -> str:
+    """在独立进程启动桩服务 (不与被测客户端争抢 GIL)，返回 base URL"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    multiprocessing.Process(
+        target=_serve_stub, args=(port, chunks, chunk_delay, chunk_bytes), daemon=True
+    ).start()
+    deadline = time.monotonic() + 15
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+    return f"http://127.0.0.1:{port}/api/v1"
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def run_mode(service, concurrency: int, rounds: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    peak_threads = threading.active_count()
+    done = asyncio.Event()
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while not done.is_set():
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    async def one(i: int):
+        started = time.perf_counter()
+        await service.asynthesize(f"bench sentence {i}", "Cherry", "en-US")
+        latencies.append(time.perf_counter() - started)
+
+    sampler = asyncio.create_task(sample_threads())
+    threads_before = threading.active_count()
+    started = time.perf_counter()
+    for r in range(rounds):
+        await asyncio.gather(*(one(r * concurrency + i) for i in range(concurrency)))
+    wall = time.perf_counter() - started
+    done.set()
+    await sampler
+    await service.aclose()
+
+    return {
+        "threads_before": threads_before,
+        "peak_threads": peak_threads,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "wall_s": wall,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Opus TTS DashScope client benchmark")
+    parser.add_argument("--concurrency", type=int, default=200, help="同时进行的合成数。")
+    parser.add_argument("--rounds", type=int, default=2, help="重复轮数 (第二轮起复用连接)。")
+    parser.add_argument("--chunks", type=int, default=10, help="每次合成返回的音频分片数。")
+    parser.add_argument("--chunk-delay", type=float, default=0.03, help="分片间隔 (秒)。")
+    parser.add_argument("--chunk-bytes", type=int, default=4800, help="每个分片的 PCM 字节数。")
+    args = parser.parse_args()
+
+    # 基准期间不输出每次合成的日志
+    import logging
+    import structlog
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+    base_url = start_stub_server(args.chunks, args.chunk_delay, args.chunk_bytes)
+    dashscope.base_http_api_url = base_url
+    config.DASHSCOPE_HTTP_URL = base_url
+
+    from services.dashscope import AsyncDashScopeTTSService, DashScopeTTSService
+
+    ideal_ms = args.chunks * args.chunk_delay * 1000
+    print(f"concurrency={args.concurrency} rounds={args.rounds} ideal latency≈{ideal_ms:.0f}ms")
+    print(f"{'client':<8}{'threads(before→peak)':>22}{'p50 ms':>10}{'p99 ms':>10}{'wall s':>9}")
+    for name, service in (("sync", DashScopeTTSService()), ("async", AsyncDashScopeTTSService())):
+        result = asyncio.run(run_mode(service, args.concurrency, args.rounds))
+        threads = f"{result['threads_before']}→{result['peak_threads']}"
+        print(
+            f"{name:<8}{threads:>22}{result['p50_ms']:>10.0f}"
+            f"{result['p99_ms']:>10.0f}{result['wall_s']:>9.2f}"
+        )
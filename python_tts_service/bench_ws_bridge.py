@@ -0,0 +1,127 @@
+"""
+WebSocket 线程桥基准 (队列轮询 vs call_soon_threadsafe)
+======================================================
+
+功能:
+    模拟 sync SDK 的阻塞流式读取 (生产者线程每隔 --chunk-delay 秒产出一个分片)，N 个流同时进行，
+    分别用旧的 queue.Queue 轮询 (run_in_executor(queue.get(timeout=0.1)) + sleep(0.01)) 与
+    core/thread_bridge.py 的 iterate_in_thread 把分片交给事件循环，报告:
+    - 进程 CPU 时间 (user + sys)
+    - 线程数峰值
+    - 分片投递延迟 (生产者产出 → 事件循环拿到) 的 p50 / p99
+
+使用方法:
+    cd python_tts_service
+    python bench_ws_bridge.py
+    python bench_ws_bridge.py --concurrency 200 --chunks 20 --chunk-delay 0.05
+
+注意:
+    1. 只测线程到事件循环的转交开销，不经过 WebSocket 与网络 (套接字发送两种模式相同)
+    2. 两种模式使用同样大小的默认线程池 (2 × 并发)，避免旧模式因线程池排队而失真
+"""
+import os
+import time
+import queue
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List
+
+os.environ.setdefault("TTS_API_KEY", "bench")
+
+from core.thread_bridge import iterate_in_thread
+
+
+def blocking_stream(chunks: int, chunk_delay: float) -> Iterator[float]:
+    """模拟 SDK 流式响应: 阻塞等待后产出分片 (内容为产出时刻)"""
+    for _ in range(chunks):
+        time.sleep(chunk_delay)
+        yield time.perf_counter()
+
+
+async def polling_bridge(chunks: int, chunk_delay: float) -> AsyncIterator[float]:
+    """旧实现: 生产者写 queue.Queue，消费者在线程池中带超时轮询"""
+    loop = asyncio.get_running_loop()
+    items: queue.Queue = queue.Queue()
+
+    def produce():
+        for item in blocking_stream(chunks, chunk_delay):
+            items.put(item)
+        items.put(None)
+
+    loop.run_in_executor(None, produce)
+    while True:
+        try:
+            item = await loop.run_in_executor(None, lambda: items.get(timeout=0.1))
+        except queue.Empty:
+            await asyncio.sleep(0.01)
+            continue
+        if item is None:
+            break
+        yield item
+
+
+def threadsafe_bridge(chunks: int, chunk_delay: float) -> AsyncIterator[float]:
+    return iterate_in_thread(lambda: blocking_stream(chunks, chunk_delay))
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def run_mode(bridge, concurrency: int, chunks: int, chunk_delay: float) -> Dict[str, float]:
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency * 2)
+    loop.set_default_executor(executor)
+
+    delays: List[float] = []
+    peak_threads = threading.active_count()
+    done = asyncio.Event()
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while not done.is_set():
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    async def one():
+        async for produced in bridge(chunks, chunk_delay):
+            delays.append(time.perf_counter() - produced)
+
+    sampler = asyncio.create_task(sample_threads())
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    done.set()
+    await sampler
+    executor.shutdown(wait=True)
+
+    return {
+        "cpu_s": cpu,
+        "peak_threads": peak_threads,
+        "p50_ms": percentile(delays, 0.50) * 1000,
+        "p99_ms": percentile(delays, 0.99) * 1000,
+        "wall_s": wall,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Opus TTS WebSocket thread bridge benchmark")
+    parser.add_argument("--concurrency", type=int, default=200, help="同时进行的流数。")
+    parser.add_argument("--chunks", type=int, default=20, help="每个流的分片数。")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="分片间隔 (秒)。")
+    args = parser.parse_args()
+
+    ideal_s = args.chunks * args.chunk_delay
+    print(f"concurrency={args.concurrency} chunks={args.chunks} ideal duration≈{ideal_s:.2f}s")
+    print(f"{'bridge':<12}{'cpu s':>8}{'peak threads':>14}{'p50 ms':>10}{'p99 ms':>10}{'wall s':>9}")
+    for name, bridge in (("polling", polling_bridge), ("threadsafe", threadsafe_bridge)):
+        result = asyncio.run(run_mode(bridge, args.concurrency, args.chunks, args.chunk_delay))
+        print(
+            f"{name:<12}{result['cpu_s']:>8.2f}{result['peak_threads']:>14}"
+            f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['wall_s']:>9.2f}"
+        )
@@ -0,0 +1,156 @@
+"""
+自适应合成并发上限 (AIMD)
+
+DashScope 能承受的并发随时段与账号配额变化: 固定的 MAX_CONCURRENT_REQUESTS 在对方空闲时偏低，
+被限流时又偏高。按每次合成的结果调整准入队列 (core/admission.py) 的总并发:
+
+- 成功且延迟正常: 名额用满 (或有人排队) 时加性增长，约每 limit 次成功 +1
+- 延迟超过基线 × ADAPTIVE_LATENCY_TOLERANCE: 乘性减小 (× ADAPTIVE_LATENCY_BACKOFF)
+- 429 / 5xx / 超时: 乘性减小 (× ADAPTIVE_THROTTLE_BACKOFF)；其他错误 (如 400) 不作为信号
+- 一次拥塞只减一次: 在上次减小之前就已开始的合成，其结果不再触发减小
+- 基线为近期最小延迟，高于基线的样本使其缓慢上浮，跟随服务端的长期变化
+
+延迟优先取首个音频分片的到达时间 (与文本长度基本无关)，不支持流式的客户端取整体耗时。
+"""
+import time
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import structlog
+
+from .config import config
+
+logger = structlog.get_logger()
+
+# 合成结果
+OK = "ok"
+THROTTLED = "throttled"
+IGNORED = "ignored"
+
+# 上限变化原因
+REASONS = ("increase", "latency", "throttled")
+
+# 高于基线的样本每次把基线拉近的比例
+_BASELINE_DRIFT = 0.02
+
+
+def classify_error(error: BaseException) -> str:
+    """合成异常 → 结果: 429 / 5xx / 超时为限流信号，其余 (参数错误、客户端取消) 忽略"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return THROTTLED
+    status_code = getattr(error, "status_code", None)
+    if status_code == 429 or (status_code is not None and status_code >= 500):
+        return THROTTLED
+    return IGNORED
+
+
+class AdaptiveLimit:
+    """AIMD 并发上限，按合成样本调整 (须在事件循环线程使用)"""
+
+    def __init__(
+        self,
+        initial: int = None,
+        min_limit: int = None,
+        max_limit: int = None,
+        latency_tolerance: float = None,
+        latency_backoff: float = None,
+        throttle_backoff: float = None
+    ):
+        self.min_limit = max(min_limit or config.ADAPTIVE_MIN_LIMIT, 1)
+        self.max_limit = max(max_limit or config.ADAPTIVE_MAX_LIMIT, self.min_limit)
+        initial = initial or config.MAX_CONCURRENT_REQUESTS
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance or config.ADAPTIVE_LATENCY_TOLERANCE
+        self.latency_backoff = latency_backoff or config.ADAPTIVE_LATENCY_BACKOFF
+        self.throttle_backoff = throttle_backoff or config.ADAPTIVE_THROTTLE_BACKOFF
+
+        self.baseline: Optional[float] = None
+        self._last_decrease = float("-inf")
+        self.changes = {reason: 0 for reason in REASONS}
+        self.samples = {OK: 0, THROTTLED: 0, IGNORED: 0}
+        self.last_change: Optional[Dict[str, Any]] = None
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_sample(self, latency: float, started: float, outcome: str, saturated: bool) -> Optional[str]:
+        """
+        记录一次合成
+
+        Args:
+            latency: 首个分片 (或整体) 耗时，秒
+            started: 合成开始时刻 (time.monotonic)
+            saturated: 名额是否用满或有人排队 (只在需求超过上限时增长)
+        Returns:
+            整数上限发生变化时返回原因，否则 None
+        """
+        self.samples[outcome] += 1
+        if outcome == IGNORED:
+            return None
+        if outcome == THROTTLED:
+            return self._decrease(started, self.throttle_backoff, "throttled")
+
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += (latency - self.baseline) * _BASELINE_DRIFT
+        if latency > self.baseline * self.latency_tolerance:
+            return self._decrease(started, self.latency_backoff, "latency")
+        if saturated:
+            return self._set(self._limit + 1 / self._limit, "increase")
+        return None
+
+    def _decrease(self, started: float, factor: float, reason: str) -> Optional[str]:
+        if started < self._last_decrease:
+            # 与上次减小属于同一次拥塞
+            return None
+        self._last_decrease = time.monotonic()
+        return self._set(self._limit * factor, reason)
+
+    def _set(self, value: float, reason: str) -> Optional[str]:
+        previous = self.limit
+        self._limit = min(max(value, self.min_limit), self.max_limit)
+        if self.limit == previous:
+            return None
+        self.changes[reason] += 1
+        self.last_change = {"reason": reason, "from": previous, "to": self.limit, "at": time.time()}
+        logger.info("admission_limit_changed", reason=reason, previous=previous, limit=self.limit)
+        return reason
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "baseline_latency_seconds": round(self.baseline, 4) if self.baseline is not None else None,
+            "samples": dict(self.samples),
+            "changes": dict(self.changes),
+            "last_change": self.last_change,
+        }
+
+    def metric_lines(self) -> List[str]:
+        """Prometheus 文本格式的指标"""
+        lines = [
+            "# HELP tts_adaptive_limit Adaptive synthesis concurrency limit.",
+            "# TYPE tts_adaptive_limit gauge",
+            f"tts_adaptive_limit {self.limit}",
+            "# HELP tts_adaptive_limit_changes_total Adaptive limit changes by reason.",
+            "# TYPE tts_adaptive_limit_changes_total counter",
+        ]
+        lines += [
+            f'tts_adaptive_limit_changes_total{{reason="{reason}"}} {count}'
+            for reason, count in self.changes.items()
+        ]
+        lines += [
+            "# HELP tts_adaptive_samples_total Synthesis results observed by the adaptive limit.",
+            "# TYPE tts_adaptive_samples_total counter",
+        ]
+        lines += [f'tts_adaptive_samples_total{{outcome="{o}"}} {n}' for o, n in self.samples.items()]
+        if self.baseline is not None:
+            lines += [
+                "# HELP tts_adaptive_baseline_latency_seconds Baseline provider latency.",
+                "# TYPE tts_adaptive_baseline_latency_seconds gauge",
+                f"tts_adaptive_baseline_latency_seconds {self.baseline:.6f}",
+            ]
+        return lines
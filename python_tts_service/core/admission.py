@@ -0,0 +1,332 @@
+"""
+合成准入控制 (Admission Control)
+
+缓存命中几乎没有成本，不再经过并发限制；只有需要调用 DashScope 的未命中进入准入队列:
+
+- 总并发 MAX_CONCURRENT_REQUESTS，按优先级分三类: interactive (用户点击) > prefetch (预加载) > bulk (批量脚本)
+- 每类可预留并发 (ADMISSION_RESERVED，默认 interactive=1)，预留名额其他类别不能占用，
+  预加载突发再多也不会饿死用户点击
+- 名额释放时按优先级从高到低唤醒等待者，同类先到先得
+- 每类队列有最大深度 (ADMISSION_MAX_QUEUE)，超出立即拒绝 (429)；
+  排队超过 ADMISSION_QUEUE_TIMEOUT 秒拒绝 (503)，两者都带 Retry-After
+- 排队中的合成被更高优先级的请求合并时 (用户点击了正在预加载的句子)，提升到对应优先级
+- ADAPTIVE_CONCURRENCY 开启时总并发不再固定，由 core/adaptive_limit.py 按 DashScope 的延迟与限流调整
+"""
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import structlog
+
+from .adaptive_limit import OK, AdaptiveLimit, classify_error
+from .config import config
+
+logger = structlog.get_logger()
+
+# 优先级从高到低
+PRIORITIES = ("interactive", "prefetch", "bulk")
+
+# 排队等待时间直方图分桶 (秒)
+WAIT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 预留名额 / 共享名额
+_RESERVED = "reserved"
+_SHARED = "shared"
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入 (队列已满 / 排队超时)"""
+
+    def __init__(self, reason: str, status_code: int, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Permit:
+    """准入名额内的一次合成，记录首个音频分片的到达时间 (自适应并发的延迟样本)"""
+    __slots__ = ("started", "first_byte_at")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_byte_at: Optional[float] = None
+
+    def mark_first_byte(self) -> None:
+        if self.first_byte_at is None:
+            self.first_byte_at = time.monotonic()
+
+    @property
+    def latency(self) -> float:
+        return (self.first_byte_at or time.monotonic()) - self.started
+
+
+class _Waiter:
+    __slots__ = ("priority", "key", "future", "enqueued_at")
+
+    def __init__(self, priority: str, key: Optional[str]):
+        self.priority = priority
+        self.key = key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """带优先级与预留名额的并发准入队列 (须在事件循环线程使用)"""
+
+    def __init__(
+        self,
+        capacity: int = None,
+        reserved: Dict[str, int] = None,
+        max_queue: Dict[str, int] = None,
+        queue_timeout: Dict[str, float] = None,
+        adaptive: Optional[AdaptiveLimit] = None
+    ):
+        self.adaptive = adaptive
+        self._reserved_config = config.ADMISSION_RESERVED if reserved is None else reserved
+        max_queue = config.ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        queue_timeout = config.ADMISSION_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+
+        self._partition(adaptive.limit if adaptive else capacity or config.MAX_CONCURRENT_REQUESTS)
+        self.max_queue = {p: max_queue.get(p, max_queue.get("default", 50)) for p in PRIORITIES}
+        self.queue_timeout = {
+            p: queue_timeout.get(p, queue_timeout.get("default", 15.0)) for p in PRIORITIES
+        }
+
+        self._queues: Dict[str, Deque[_Waiter]] = {p: deque() for p in PRIORITIES}
+        self._reserved_in_use = {p: 0 for p in PRIORITIES}
+        self._in_use = {p: 0 for p in PRIORITIES}
+        self._shared_in_use = 0
+        # 单次合成耗时的滑动平均，用于估算 Retry-After
+        self._service_time = 2.0
+
+        self.admitted = {p: 0 for p in PRIORITIES}
+        self.promoted = 0
+        self.rejected: Dict[str, Dict[str, int]] = {
+            p: {"queue_full": 0, "queue_timeout": 0} for p in PRIORITIES
+        }
+        self.wait_sum = {p: 0.0 for p in PRIORITIES}
+        self.wait_buckets = {p: [0] * len(WAIT_BUCKETS) for p in PRIORITIES}
+
+    def _partition(self, capacity: int) -> None:
+        """
+        按总并发划分预留 / 共享名额
+
+        至少保留 1 个共享名额 (预留名额之和不超过总并发 - 1)，
+        否则没有预留的类别 (prefetch / bulk) 永远无法准入，只能排队到超时
+        """
+        self.capacity = capacity
+        self.reserved: Dict[str, int] = {}
+        remaining = max(capacity - 1, 0)
+        for priority in PRIORITIES:
+            self.reserved[priority] = min(self._reserved_config.get(priority, 0), remaining)
+            remaining -= self.reserved[priority]
+        self.shared_capacity = capacity - sum(self.reserved.values())
+
+    def _observe(self, permit: Permit, outcome: str) -> None:
+        """自适应并发: 记录一次合成结果，上限变化时重新划分名额 (已占用的名额用完归还，不强制收回)"""
+        saturated = sum(self._in_use.values()) >= self.capacity or any(self._queues.values())
+        if self.adaptive.on_sample(permit.latency, permit.started, outcome, saturated):
+            self._partition(self.adaptive.limit)
+
+    def _take(self, priority: str) -> Optional[str]:
+        """占用一个名额: 优先用本类预留，其次共享；无名额返回 None"""
+        if self._reserved_in_use[priority] < self.reserved[priority]:
+            self._reserved_in_use[priority] += 1
+            kind = _RESERVED
+        elif self._shared_in_use < self.shared_capacity:
+            self._shared_in_use += 1
+            kind = _SHARED
+        else:
+            return None
+        self._in_use[priority] += 1
+        return kind
+
+    def _release(self, priority: str, kind: str, held: float = None) -> None:
+        if kind == _RESERVED:
+            self._reserved_in_use[priority] -= 1
+        else:
+            self._shared_in_use -= 1
+        self._in_use[priority] -= 1
+        if held is not None:
+            self._service_time = 0.8 * self._service_time + 0.2 * held
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """按优先级从高到低唤醒能拿到名额的等待者"""
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue:
+                kind = self._take(priority)
+                if kind is None:
+                    break
+                waiter = queue.popleft()
+                self._record_admit(priority, time.monotonic() - waiter.enqueued_at)
+                waiter.future.set_result(kind)
+
+    def _record_admit(self, priority: str, waited: float) -> None:
+        self.admitted[priority] += 1
+        self.wait_sum[priority] += waited
+        buckets = self.wait_buckets[priority]
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if waited <= bound:
+                buckets[i] += 1
+
+    def retry_after(self) -> int:
+        """按当前排队长度与平均合成耗时估算的重试等待秒数"""
+        queued = sum(len(queue) for queue in self._queues.values())
+        estimate = self._service_time * (queued + 1) / max(self.capacity, 1)
+        return min(max(math.ceil(estimate), 1), 60)
+
+    def _reject(self, priority: str, reason: str, status_code: int) -> AdmissionRejected:
+        self.rejected[priority][reason] += 1
+        retry_after = self.retry_after()
+        logger.warning(
+            "admission_rejected",
+            priority=priority,
+            reason=reason,
+            queue_depth=len(self._queues[priority]),
+            retry_after=retry_after
+        )
+        return AdmissionRejected(reason, status_code, retry_after)
+
+    async def acquire(self, priority: str, key: Optional[str] = None) -> Tuple[str, str]:
+        """
+        获取一个名额，返回 (最终优先级, 名额类型)，用完交给 release
+
+        排队期间可能被 promote 提升优先级，名额按最终优先级归还
+
+        Raises:
+            AdmissionRejected: 队列已满 (429) 或排队超时 (503)
+        """
+        queue = self._queues[priority]
+        if not queue:
+            kind = self._take(priority)
+            if kind is not None:
+                self._record_admit(priority, 0.0)
+                return priority, kind
+        if len(queue) >= self.max_queue[priority]:
+            raise self._reject(priority, "queue_full", 429)
+
+        waiter = _Waiter(priority, key)
+        queue.append(waiter)
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.queue_timeout[priority])
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if not waiter.future.done():
+            self._abandon(waiter)
+            raise self._reject(waiter.priority, "queue_timeout", 503)
+        return waiter.priority, waiter.future.result()
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """等待者离开队列；名额已分配但未被取走时归还"""
+        if waiter.future.done():
+            if not waiter.future.cancelled():
+                self._release(waiter.priority, waiter.future.result())
+            return
+        waiter.future.cancel()
+        self._queues[waiter.priority].remove(waiter)
+
+    def release(self, slot: Tuple[str, str], held: float = None) -> None:
+        self._release(*slot, held)
+
+    @asynccontextmanager
+    async def slot(self, priority: str, key: Optional[str] = None) -> AsyncIterator[Permit]:
+        """
+        async with admission.slot("interactive") as permit: 在名额内执行合成
+
+        流式合成收到首个音频分片时调用 permit.mark_first_byte()，作为自适应并发的延迟样本
+        """
+        acquired = await self.acquire(priority, key)
+        permit = Permit()
+        outcome = OK
+        try:
+            yield permit
+        except BaseException as e:
+            outcome = classify_error(e)
+            raise
+        finally:
+            if self.adaptive is not None:
+                self._observe(permit, outcome)
+            self.release(acquired, time.monotonic() - permit.started)
+
+    def promote(self, key: str, priority: str) -> bool:
+        """将排队中 Key 对应的等待者提升到更高优先级，返回是否发生提升"""
+        rank = PRIORITIES.index(priority)
+        for lower in PRIORITIES[rank + 1:]:
+            for waiter in self._queues[lower]:
+                if waiter.key == key:
+                    self._queues[lower].remove(waiter)
+                    waiter.priority = priority
+                    self._queues[priority].append(waiter)
+                    self.promoted += 1
+                    logger.info("admission_promoted", key=key, from_priority=lower, to_priority=priority)
+                    self._dispatch()
+                    return True
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "in_use": sum(self._in_use.values()),
+            "promoted": self.promoted,
+            "adaptive": self.adaptive.get_stats() if self.adaptive else None,
+            "classes": {
+                p: {
+                    "reserved": self.reserved[p],
+                    "in_use": self._in_use[p],
+                    "queue_depth": len(self._queues[p]),
+                    "max_queue": self.max_queue[p],
+                    "admitted": self.admitted[p],
+                    "rejected": dict(self.rejected[p]),
+                    "avg_wait_seconds": round(self.wait_sum[p] / self.admitted[p], 4) if self.admitted[p] else 0.0,
+                }
+                for p in PRIORITIES
+            },
+        }
+
+    def metric_lines(self) -> List[str]:
+        """Prometheus 文本格式的指标"""
+        lines = [
+            "# HELP tts_admission_capacity Concurrent synthesis slots.",
+            "# TYPE tts_admission_capacity gauge",
+            f"tts_admission_capacity {self.capacity}",
+            "# HELP tts_admission_in_use Synthesis slots in use.",
+            "# TYPE tts_admission_in_use gauge",
+        ]
+        lines += [f'tts_admission_in_use{{priority="{p}"}} {self._in_use[p]}' for p in PRIORITIES]
+        lines += [
+            "# HELP tts_admission_queue_depth Requests waiting for a synthesis slot.",
+            "# TYPE tts_admission_queue_depth gauge",
+        ]
+        lines += [f'tts_admission_queue_depth{{priority="{p}"}} {len(self._queues[p])}' for p in PRIORITIES]
+        lines += [
+            "# HELP tts_admission_rejected_total Requests rejected by admission control.",
+            "# TYPE tts_admission_rejected_total counter",
+        ]
+        lines += [
+            f'tts_admission_rejected_total{{priority="{p}",reason="{reason}"}} {count}'
+            for p in PRIORITIES for reason, count in self.rejected[p].items()
+        ]
+        lines += [
+            "# HELP tts_admission_wait_seconds Time spent waiting for a synthesis slot.",
+            "# TYPE tts_admission_wait_seconds histogram",
+        ]
+        for p in PRIORITIES:
+            for bound, count in zip(WAIT_BUCKETS, self.wait_buckets[p]):
+                lines.append(f'tts_admission_wait_seconds_bucket{{priority="{p}",le="{bound}"}} {count}')
+            lines.append(f'tts_admission_wait_seconds_bucket{{priority="{p}",le="+Inf"}} {self.admitted[p]}')
+            lines.append(f'tts_admission_wait_seconds_sum{{priority="{p}"}} {self.wait_sum[p]:.6f}')
+            lines.append(f'tts_admission_wait_seconds_count{{priority="{p}"}} {self.admitted[p]}')
+        if self.adaptive is not None:
+            lines += self.adaptive.metric_lines()
+        return lines
+
+
+# 全局准入控制实例
+admission = AdmissionController(adaptive=AdaptiveLimit() if config.ADAPTIVE_CONCURRENCY else None)
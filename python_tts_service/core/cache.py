@@ -1,35 +1,415 @@
 """
 缓存管理模块
 """
-import json
+import os
+import time
+import asyncio
+import tempfile
+import functools
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, List, NamedTuple, Tuple
 from datetime import datetime
 
 import structlog
 
 from .config import config
+from .cache_layout import CacheLayout, CacheLayoutMigrator
+from .cache_index import CacheIndex
+from .cache_eviction import CacheEvictor
+from .cache_stats import CacheStats
+from .cache_dedup import content_digest, file_digest, link_into_place
+from .hot_cache import HotAudio, HotAudioCache
+from .transcode import AUDIO_VARIANTS, Transcoder
+from .metadata_store import DEFAULT_CACHE_TYPE, MetadataStore, create_metadata_store
 
 logger = structlog.get_logger()
 
+# 缓存文件权限 (临时文件经 mkstemp 创建时为 0600，提交前放开读权限供 nginx 直接读取)
+CACHE_FILE_MODE = 0o644
+
+
+class CachedAudio(NamedTuple):
+    """命中的缓存文件"""
+    path: Path
+    size: int
+
+
+class AudioStreamWriter:
+    """
+    流式写入缓存的临时文件 (tee-to-cache)
+
+    与最终文件位于同一目录，提交时 os.replace 原子就位；中途失败 abort 删除，
+    读方不会看到半截文件。方法均为阻塞调用，经 CacheManager.run_io 执行。
+    """
+
+    def __init__(self, hash_key: str, path: Path):
+        self.hash_key = hash_key
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{hash_key}.", suffix=".part")
+        os.fchmod(fd, CACHE_FILE_MODE)
+        self.temp_path = Path(temp_name)
+        self._file = os.fdopen(fd, "wb")
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+        self.size += len(data)
+
+    def finish(self, head: Optional[bytes] = None) -> None:
+        """关闭文件；head 不为空时覆盖文件开头 (如补写 WAV 头中的长度)"""
+        if head:
+            self._file.seek(0)
+            self._file.write(head)
+        self._file.close()
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            self.temp_path.unlink()
+        except FileNotFoundError:
+            pass
+
 
 class CacheManager:
     """音频文件缓存管理器"""
     
-    def __init__(self, cache_dir: Path = None):
+    def __init__(
+        self,
+        cache_dir: Path = None,
+        shard_depth: int = None,
+        shard_width: int = None,
+        metadata_store: MetadataStore = None
+    ):
         self.cache_dir = cache_dir or config.CACHE_DIR
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        self.metadata_file = self.cache_dir / "metadata.json"
-        self._metadata_cache: Optional[Dict] = None
+        self.layout = CacheLayout(
+            self.cache_dir,
+            depth=config.CACHE_SHARD_DEPTH if shard_depth is None else shard_depth,
+            width=shard_width or config.CACHE_SHARD_WIDTH
+        )
+        self.metadata_store = metadata_store or create_metadata_store(
+            config.METADATA_BACKEND, self.cache_dir
+        )
+        self.index = CacheIndex(
+            self.layout,
+            config.AUDIO_FORMAT,
+            mode=config.CACHE_INDEX_MODE,
+            bloom_capacity=config.CACHE_INDEX_BLOOM_CAPACITY
+        )
+        self.evictor = CacheEvictor(
+            self,
+            budget_bytes=config.CACHE_MAX_BYTES,
+            policy=config.CACHE_EVICT_POLICY,
+            batch_size=config.CACHE_EVICT_BATCH,
+            low_watermark=config.CACHE_EVICT_LOW_WATERMARK,
+            min_idle_seconds=config.CACHE_EVICT_MIN_IDLE,
+            protected_types=config.CACHE_PERMANENT_TYPES
+        )
+        self.stats = CacheStats(self.metadata_store)
+        self.hot_cache = HotAudioCache(
+            max_bytes=config.HOT_CACHE_MAX_BYTES,
+            max_item_bytes=config.HOT_CACHE_MAX_ITEM_BYTES
+        )
+        # 命中访问记录缓冲: hash → [最近访问时间, 访问次数, 需提升到的 cache_type]
+        self._access_log: Dict[str, list] = {}
+        # 命中记录来自 I/O 线程池与事件循环，落库在后台线程: 记录与交换缓冲共用此锁
+        self._access_lock = threading.Lock()
+        self._background_tasks: List[asyncio.Task] = []
+        # 写入时预生成变体的任务 (持有引用，避免被回收)
+        self._variant_tasks = set()
+        self.transcoder = Transcoder()
+        # 请求路径专用的磁盘 I/O 线程池: 慢盘 (NAS) 写入只占用该池，不阻塞事件循环；
+        # 与后台对账 / 审计使用的默认线程池隔离，长任务不会挤占请求 I/O
+        self._io_executor = ThreadPoolExecutor(
+            max_workers=config.CACHE_IO_THREADS,
+            thread_name_prefix="cache-io"
+        )
+    
+    async def start(self):
+        """
+        服务启动: 加载存在性索引 (快照优先)，启动后台对账与布局迁移
+        """
+        loop = asyncio.get_running_loop()
+        if config.CACHE_INDEX_ENABLED:
+            await loop.run_in_executor(None, self.index.load)
+            if config.CACHE_INDEX_RECONCILE_INTERVAL > 0:
+                self._background_tasks.append(asyncio.create_task(self._reconcile_loop()))
+        
+        if self.evictor.enabled:
+            self._background_tasks.append(asyncio.create_task(self._eviction_loop()))
+        
+        # 统计计数器: 首次启动没有基线时后台审计一次，此后只做增量累加
+        self._background_tasks.append(asyncio.create_task(self._flush_loop()))
+        if not await loop.run_in_executor(None, lambda: self.stats.initialized):
+            self._background_tasks.append(asyncio.create_task(self._initial_audit()))
+        
+        # 扁平 → 分片在线迁移 (后台分批执行，不阻塞启动)
+        if config.CACHE_MIGRATE_ON_STARTUP and self.layout.sharded:
+            migrator = CacheLayoutMigrator(self.layout, on_move=self.index.relocate)
+            self._background_tasks.append(asyncio.create_task(migrator.arun()))
+            logger.info("cache_migration_scheduled", shard_depth=self.layout.depth)
+    
+    async def stop(self):
+        """服务关闭: 停止后台任务，落库访问记录与统计计数，保存索引快照"""
+        for task in self._background_tasks:
+            task.cancel()
+        self._background_tasks.clear()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.flush_access_log)
+        await loop.run_in_executor(None, self.stats.flush)
+        if self.index.loaded:
+            await loop.run_in_executor(None, self.index.save_snapshot)
+    
+    async def _reconcile_loop(self):
+        """周期性对账: 全量扫描修正索引偏差 (外部删除 / 其他进程写入)"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(config.CACHE_INDEX_RECONCILE_INTERVAL)
+            try:
+                await loop.run_in_executor(None, self.index.build)
+            except Exception as e:
+                logger.error("cache_index_reconcile_failed", error=str(e))
     
     def get_audio_path(self, hash_key: str) -> Path:
-        """获取音频文件路径"""
-        return self.cache_dir / f"{hash_key}.{config.AUDIO_FORMAT}"
+        """获取音频文件写入路径 (当前分片布局)"""
+        return self.layout.path_for(hash_key, config.AUDIO_FORMAT)
+    
+    async def _eviction_loop(self):
+        """周期性淘汰: 每轮磁盘 I/O 受 CACHE_EVICT_BATCH 限制"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(config.CACHE_EVICT_INTERVAL)
+            try:
+                await loop.run_in_executor(None, self.evictor.tick)
+            except Exception as e:
+                logger.error("cache_eviction_failed", error=str(e))
+    
+    async def _initial_audit(self):
+        """首次启动建立统计基线 (全量审计在线程池中执行)"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.stats.audit, self.cache_dir)
+        except Exception as e:
+            logger.error("cache_stats_audit_failed", error=str(e))
+    
+    async def _flush_loop(self):
+        """周期性落库统计增量与访问记录 (淘汰关闭时访问记录也不会无限堆积)"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(config.CACHE_STATS_FLUSH_INTERVAL)
+            try:
+                await loop.run_in_executor(None, self.stats.flush)
+                await loop.run_in_executor(None, self.flush_access_log)
+            except Exception as e:
+                logger.error("cache_stats_flush_failed", error=str(e))
+    
+    def _record_access(self, hash_key: str, cache_type: Optional[str] = None):
+        """记录一次命中 (仅写内存，由淘汰任务批量落库)"""
+        promote = cache_type if cache_type and cache_type != DEFAULT_CACHE_TYPE else None
+        with self._access_lock:
+            entry = self._access_log.get(hash_key)
+            if entry is None:
+                self._access_log[hash_key] = [time.time(), 1, promote]
+            else:
+                entry[0] = time.time()
+                entry[1] += 1
+                entry[2] = promote or entry[2]
+    
+    def touch(self, hash_key: str, cache_type: Optional[str] = None):
+        """记录一次不经 lookup 的访问 (如合并请求的 follower)"""
+        self._record_access(hash_key, cache_type)
+    
+    def flush_access_log(self):
+        """将缓冲的访问记录批量写入元数据后端"""
+        with self._access_lock:
+            access_log, self._access_log = self._access_log, {}
+            records = {hash_key: tuple(entry) for hash_key, entry in access_log.items()}
+        if records:
+            self.metadata_store.record_access(records)
+    
+    def _find_on_disk(self, hash_key: str, ext: str = None) -> Optional[CachedAudio]:
+        """
+        在磁盘上查找缓存文件 (ext 默认为主格式)
+
+        迁移过渡期同时兼容分片与扁平两种布局，不存在或为空文件时返回 None
+        """
+        for candidate in self.layout.candidates(hash_key, ext or config.AUDIO_FORMAT):
+            try:
+                size = candidate.stat().st_size
+            except FileNotFoundError:
+                continue
+            if size > 0:
+                return CachedAudio(candidate, size)
+        return None
+    
+    def lookup(
+        self,
+        hash_key: str,
+        cache_type: Optional[str] = None,
+        voice: Optional[str] = None,
+        language: Optional[str] = None
+    ) -> Optional[CachedAudio]:
+        """
+        命中判断
+
+        索引已加载时命中不产生 syscall；未命中按索引模式决定是否 stat 确认。
+        命中会记录访问时间 (淘汰依据)，cache_type 为永久类型时顺带提升条目类型。
+        voice / language 仅用于命中率分维度统计，调用方已知时传入。
+        """
+        found = self._lookup(hash_key)
+        labels = {"voice": voice, "language": language, "format": config.AUDIO_FORMAT}
+        if found is not None:
+            self._record_access(hash_key, cache_type)
+            self.stats.incr("hits", **labels)
+        else:
+            self.stats.incr("misses", **labels)
+        return found
+    
+    def _lookup(self, hash_key: str) -> Optional[CachedAudio]:
+        if self.index.loaded:
+            entry = self.index.get(hash_key)
+            if entry is not None:
+                return CachedAudio(self.index.path_for(hash_key, entry), entry.size)
+            
+            if self.index.mode == "bloom":
+                if not self.index.might_contain(hash_key):
+                    return None
+            elif not config.CACHE_INDEX_VERIFY_MISSES:
+                return None
+        
+        found = self._find_on_disk(hash_key)
+        if found is not None and self.index.loaded and self.index.mode == "map":
+            # 其他进程写入的文件，补进索引
+            self.index.add(
+                hash_key,
+                found.size,
+                time.time(),
+                flat=found.path.parent == self.cache_dir and self.layout.sharded
+            )
+        return found
+    
+    def _resolved_by_index(self, hash_key: str) -> bool:
+        """索引能否不经磁盘直接给出命中结果 (命中 / 确定未命中)"""
+        if not self.index.loaded:
+            return False
+        if self.index.get(hash_key) is not None:
+            return True
+        if self.index.mode == "bloom":
+            return not self.index.might_contain(hash_key)
+        return not config.CACHE_INDEX_VERIFY_MISSES
+    
+    def _check_index(self, hash_keys: Iterable[str]) -> Tuple[Dict[str, Optional[Tuple[str, int]]], List[str]]:
+        """批量检查的索引部分: 返回 (索引已判定的结果, 需要查磁盘的 Hash)"""
+        ext = config.AUDIO_FORMAT
+        results: Dict[str, Optional[Tuple[str, int]]] = {}
+        unresolved = []
+        for hash_key in dict.fromkeys(hash_keys):
+            if not self._resolved_by_index(hash_key):
+                unresolved.append(hash_key)
+                continue
+            entry = self.index.get(hash_key)
+            if entry is None:
+                results[hash_key] = None
+            else:
+                relative = f"{hash_key}.{ext}" if entry.flat else self.layout.relative_path(hash_key, ext)
+                results[hash_key] = (f"{config.AUDIO_URL_PREFIX}/{relative}", entry.size)
+        return results, unresolved
+    
+    def _check_on_disk(self, hash_keys: List[str]) -> Dict[str, Optional[Tuple[str, int]]]:
+        """
+        批量检查的磁盘部分: 按所在目录分组一次处理
+
+        同一目录待查的 Hash 较多时 scandir 一次代替逐个 stat (扁平布局 / 大分片目录)，
+        较少时逐个 stat。路径全程使用字符串 (千级 Hash 时 Path 对象的构造开销远大于 stat)。
+        找到的文件补进索引，与 _lookup 一致。
+        """
+        ext = config.AUDIO_FORMAT
+        root = str(self.cache_dir)
+        # 目录 → [(Hash, 相对路径)]；分片布局同时查分片目录与旧版扁平目录
+        groups: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        for hash_key in hash_keys:
+            parts = self.layout.shard_parts(hash_key)
+            if parts:
+                groups[os.path.join(root, *parts)].append((hash_key, "/".join(parts)))
+            groups[root].append((hash_key, ""))
+        
+        found: Dict[str, Tuple[str, int]] = {}
+        flat_found = []
+        for directory, keys in groups.items():
+            pending = [(hash_key, prefix) for hash_key, prefix in keys if hash_key not in found]
+            sizes: Dict[str, int] = {}
+            if len(pending) >= config.CACHE_CHECK_SCANDIR_MIN:
+                wanted = {f"{hash_key}.{ext}" for hash_key, _ in pending}
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if entry.name in wanted:
+                                try:
+                                    sizes[entry.name] = entry.stat().st_size
+                                except FileNotFoundError:
+                                    continue
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+            else:
+                for hash_key, _ in pending:
+                    name = f"{hash_key}.{ext}"
+                    try:
+                        sizes[name] = os.stat(os.path.join(directory, name)).st_size
+                    except FileNotFoundError:
+                        continue
+            for hash_key, prefix in pending:
+                name = f"{hash_key}.{ext}"
+                size = sizes.get(name, 0)
+                if size > 0:
+                    relative = f"{prefix}/{name}" if prefix else name
+                    found[hash_key] = (f"{config.AUDIO_URL_PREFIX}/{relative}", size)
+                    if not prefix:
+                        flat_found.append(hash_key)
+        
+        if found and self.index.loaded and self.index.mode == "map":
+            now = time.time()
+            flat_found = set(flat_found)
+            for hash_key, (_, size) in found.items():
+                self.index.add(hash_key, size, now, flat=hash_key in flat_found and self.layout.sharded)
+        return {hash_key: found.get(hash_key) for hash_key in hash_keys}
+    
+    def check_many(self, hash_keys: Iterable[str]) -> Dict[str, Optional[Tuple[str, int]]]:
+        """
+        批量存在性检查: Hash → (音频 URL, 文件大小) / None
+
+        只判断存在，不记录访问时间与命中统计 (页面批量探测不代表音频被使用)。
+        """
+        results, unresolved = self._check_index(hash_keys)
+        if unresolved:
+            results.update(self._check_on_disk(unresolved))
+        return results
+    
+    def _find_duplicate(self, digest: str, size: int, exclude: str) -> Optional[Path]:
+        """查找内容相同的已有缓存文件 (去重写入的链接源)"""
+        for hash_key in self.metadata_store.find_by_digest(digest):
+            if hash_key == exclude:
+                continue
+            found = self._find_on_disk(hash_key)
+            if found is not None and found.size == size:
+                return found.path
+        return None
+    
+    def find_audio_path(self, hash_key: str) -> Optional[Path]:
+        """查找已缓存的音频文件路径"""
+        found = self._lookup(hash_key)
+        return found.path if found else None
+    
+    def get_audio_url(self, hash_key: str, audio_path: Optional[Path] = None) -> str:
+        """获取音频对外 URL，与文件实际所在布局保持一致"""
+        return self.layout.url_for_path(audio_path or self.get_audio_path(hash_key))
     
     def exists(self, hash_key: str) -> bool:
         """检查缓存是否存在"""
-        audio_path = self.get_audio_path(hash_key)
-        exists = audio_path.exists() and audio_path.stat().st_size > 0
+        exists = self.lookup(hash_key) is not None
         
         if exists:
             logger.info("cache_hit", hash=hash_key)
@@ -38,107 +418,384 @@ class CacheManager:
         
         return exists
     
-    def save_audio(
+    # ------------------------------------------------------------------
+    # 异步接口 (供 async 路由 / WebSocket 使用，磁盘 I/O 在专用线程池执行)
+    # ------------------------------------------------------------------
+    
+    async def run_io(self, func, *args, **kwargs):
+        """在缓存 I/O 线程池中执行阻塞调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io_executor, functools.partial(func, *args, **kwargs))
+    
+    async def alookup(
+        self,
+        hash_key: str,
+        cache_type: Optional[str] = None,
+        voice: Optional[str] = None,
+        language: Optional[str] = None
+    ) -> Optional[CachedAudio]:
+        """lookup 的异步版本；索引可直接判定时不切换线程"""
+        if self._resolved_by_index(hash_key):
+            return self.lookup(hash_key, cache_type, voice, language)
+        return await self.run_io(self.lookup, hash_key, cache_type, voice, language)
+    
+    async def acheck_many(self, hash_keys: Iterable[str]) -> Dict[str, Optional[Tuple[str, int]]]:
+        """check_many 的异步版本；只有索引无法判定的部分进入 I/O 线程池"""
+        results, unresolved = self._check_index(hash_keys)
+        if unresolved:
+            results.update(await self.run_io(self._check_on_disk, unresolved))
+        return results
+    
+    async def aexists(self, hash_key: str) -> bool:
+        """exists 的异步版本"""
+        exists = await self.alookup(hash_key) is not None
+        logger.info("cache_hit" if exists else "cache_miss", hash=hash_key)
+        return exists
+    
+    async def aread_audio(self, hash_key: str, fmt: Optional[str] = None) -> Optional[HotAudio]:
+        """
+        读取音频内容 (供 /tts/audio 直接返回字节)
+
+        热点内存缓存命中时不读磁盘；否则在 I/O 线程池读取文件并装入内存缓存。
+        fmt 为压缩变体时按需转码生成，无法生成时返回 None
+        """
+        ext = AUDIO_VARIANTS[fmt].ext if fmt else config.AUDIO_FORMAT
+        key = self._hot_key(hash_key, ext)
+        item = self.hot_cache.get(key)
+        if item is None:
+            if ext != config.AUDIO_FORMAT and await self.aensure_variant(hash_key, fmt) is None:
+                return None
+            item = await self.run_io(self._read_audio, hash_key, ext)
+            if item is None:
+                return None
+            self.hot_cache.put(key, item)
+        self._record_access(hash_key)
+        return item
+    
+    @staticmethod
+    def _hot_key(hash_key: str, ext: str) -> str:
+        return hash_key if ext == config.AUDIO_FORMAT else f"{hash_key}.{ext}"
+    
+    def _read_audio(self, hash_key: str, ext: str) -> Optional[HotAudio]:
+        if ext == config.AUDIO_FORMAT:
+            found = self._lookup(hash_key)
+        else:
+            found = self._find_on_disk(hash_key, ext)
+        if found is None:
+            return None
+        try:
+            with open(found.path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                data = f.read()
+        except FileNotFoundError:
+            # 查到之后恰好被淘汰
+            return None
+        # 与 nginx 相同的 ETag 构造: 大小 + 修改时间，无需计算摘要
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        return HotAudio(data, etag, found.path.suffix[1:])
+    
+    async def asave_audio(
         self,
         hash_key: str,
         audio_data: bytes,
         metadata: Optional[Dict[str, Any]] = None
     ) -> Path:
         """
-        保存音频文件到缓存 (原子写入)
-        
-        使用临时文件 + os.replace() 策略防止并发写入导致的文件损坏
+        save_audio 的异步版本 (文件写入与元数据 upsert 均在 I/O 线程池执行)
+
+        配置了 AUDIO_VARIANTS_ON_WRITE 时，在后台预生成压缩变体
+        """
+        audio_path = await self.run_io(self.save_audio, hash_key, audio_data, metadata)
+        self._schedule_variants(hash_key, CachedAudio(audio_path, len(audio_data)))
+        return audio_path
+    
+    async def aopen_stream(self, hash_key: str) -> AudioStreamWriter:
+        """打开一个流式写入的临时文件，写完后交给 acommit_stream"""
+        return await self.run_io(AudioStreamWriter, hash_key, self.get_audio_path(hash_key))
+    
+    async def acommit_stream(
+        self,
+        writer: AudioStreamWriter,
+        metadata: Optional[Dict[str, Any]] = None,
+        head: Optional[bytes] = None
+    ) -> CachedAudio:
+        """
+        流式写入完成: 临时文件原子替换为缓存文件 (去重 / 索引 / 统计 / 元数据与 save_audio 相同)
+
+        Args:
+            head: 覆盖文件开头的字节 (流式 WAV 头在结束后才知道数据长度)
+        """
+        def commit() -> Path:
+            writer.finish(head)
+            return self._place_audio(
+                writer.hash_key,
+                writer.size,
+                file_digest(writer.temp_path) if config.CACHE_DEDUP_ENABLED else None,
+                lambda path: os.replace(writer.temp_path, path),
+                metadata
+            )
         
+        try:
+            audio_path = await self.run_io(commit)
+        except BaseException:
+            await self.run_io(writer.abort)
+            raise
+        if writer.temp_path.exists():
+            # 已硬链接到相同内容的文件，临时文件不再需要
+            await self.run_io(writer.abort)
+        cached = CachedAudio(audio_path, writer.size)
+        self._schedule_variants(writer.hash_key, cached)
+        return cached
+    
+    def _schedule_variants(self, hash_key: str, source: CachedAudio) -> None:
+        """配置了 AUDIO_VARIANTS_ON_WRITE 时，在后台预生成压缩变体"""
+        if config.AUDIO_VARIANTS_ON_WRITE and self.transcoder.available:
+            for fmt in config.AUDIO_VARIANTS_ON_WRITE:
+                task = asyncio.create_task(self.aensure_variant(hash_key, fmt, source))
+                self._variant_tasks.add(task)
+                task.add_done_callback(self._variant_tasks.discard)
+    
+    async def aensure_variant(
+        self,
+        hash_key: str,
+        fmt: str,
+        source: Optional[CachedAudio] = None
+    ) -> Optional[CachedAudio]:
+        """
+        获取指定格式的缓存文件，压缩变体不存在时从主文件转码生成
+
         Args:
-            hash_key: 音频 Hash
-            audio_data: 音频二进制数据
-            metadata: 可选的元数据
-            
+            source: 已知的主文件 (省去一次查找)
         Returns:
-            Path: 保存的文件路径
+            变体文件；主文件不存在、ffmpeg 不可用或转码失败时返回 None
         """
-        import os
+        variant = AUDIO_VARIANTS[fmt]
+        if variant.ext == config.AUDIO_FORMAT:
+            return source or await self.run_io(self._lookup, hash_key)
         
-        audio_path = self.get_audio_path(hash_key)
-        temp_path = audio_path.with_suffix('.tmp')
+        existing = await self.run_io(self._find_on_disk, hash_key, variant.ext)
+        if existing is not None:
+            return existing
+        if not self.transcoder.available:
+            return None
         
-        # 原子写入: 先写临时文件，再重命名
+        source = source or await self.run_io(self._lookup, hash_key)
+        if source is None:
+            return None
+        try:
+            wav_data = await self.run_io(source.path.read_bytes)
+            data = await self.transcoder.transcode(wav_data, fmt)
+        except Exception as e:
+            logger.error("audio_transcode_failed", hash=hash_key, format=fmt, error=str(e))
+            return None
+        path = await self.run_io(self._save_variant, hash_key, variant.ext, data)
+        logger.info(
+            "audio_variant_cached",
+            hash=hash_key,
+            format=fmt,
+            size_bytes=len(data),
+            source_bytes=source.size
+        )
+        return CachedAudio(path, len(data))
+    
+    def _save_variant(self, hash_key: str, ext: str, data: bytes) -> Path:
+        path = self.layout.path_for(hash_key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._atomic_write(path, data)
+        self.stats.incr("writes", format=ext)
+        self.stats.incr("files", format=ext)
+        self.stats.incr("bytes", len(data), format=ext)
+        return path
+    
+    def _remove_variants(self, hash_key: str) -> int:
+        """删除主文件对应的全部压缩变体 (淘汰 / 覆盖写入时调用)，返回删除的字节数"""
+        removed = 0
+        for variant in AUDIO_VARIANTS.values():
+            if variant.ext == config.AUDIO_FORMAT:
+                continue
+            self.hot_cache.discard(self._hot_key(hash_key, variant.ext))
+            for candidate in set(self.layout.candidates(hash_key, variant.ext)):
+                try:
+                    size = candidate.stat().st_size
+                    candidate.unlink()
+                except FileNotFoundError:
+                    continue
+                removed += size
+                self.stats.incr("files", -1, format=variant.ext)
+                self.stats.incr("bytes", -size, format=variant.ext)
+        return removed
+    
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes) -> None:
+        """
+        临时文件 + os.replace() 原子写入，防止并发写入导致的文件损坏
+
+        临时文件名唯一 (与 AudioStreamWriter 相同用 mkstemp)：同一 Hash 的主文件与各压缩变体
+        (<hash>.wav / .opus / .mp3 / .aac) 以及同一文件的并发写入互不覆盖
+        """
+        fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        temp_path = Path(temp_name)
         try:
-            with open(temp_path, 'wb') as f:
-                f.write(audio_data)
+            # mkstemp 创建的文件为 0600，nginx 需要能直接读取
+            os.fchmod(fd, CACHE_FILE_MODE)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
             
             # os.replace 是原子操作，要么成功要么失败
-            os.replace(temp_path, audio_path)
+            os.replace(temp_path, path)
         except Exception as e:
             # 清理临时文件
             if temp_path.exists():
                 temp_path.unlink()
             raise e
+    
+    async def aget_metadata(self, hash_key: str) -> Optional[Dict[str, Any]]:
+        return await self.run_io(self.get_metadata, hash_key)
+    
+    async def aquery_metadata(self, **filters) -> List[Dict[str, Any]]:
+        return await self.run_io(self.query_metadata, **filters)
+    
+    async def aget_cache_stats(self, recompute: bool = False) -> Dict[str, Any]:
+        """统计读取查询元数据后端；全量审计耗时较长，放到默认线程池以免占用请求 I/O"""
+        loop = asyncio.get_running_loop()
+        if recompute:
+            return await loop.run_in_executor(None, self.get_cache_stats, True)
+        return await self.run_io(self.get_cache_stats)
+    
+    def save_audio(
+        self,
+        hash_key: str,
+        audio_data: bytes,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Path:
+        """
+        保存音频文件到缓存 (原子写入)
         
-        # 保存元数据（可选）
-        if metadata:
-            self._save_metadata(hash_key, metadata)
+        使用临时文件 + os.replace() 策略防止并发写入导致的文件损坏。
+        已有内容相同的文件时改为硬链接到该文件 (见 core/cache_dedup.py)。
         
-        file_size = audio_path.stat().st_size
+        Args:
+            hash_key: 音频 Hash
+            audio_data: 音频二进制数据
+            metadata: 可选的元数据
+            
+        Returns:
+            Path: 保存的文件路径
+        """
+        file_size = len(audio_data)
+        digest = content_digest(audio_data) if config.CACHE_DEDUP_ENABLED else None
+        return self._place_audio(
+            hash_key,
+            file_size,
+            digest,
+            lambda path: self._atomic_write(path, audio_data),
+            metadata
+        )
+    
+    def _place_audio(
+        self,
+        hash_key: str,
+        file_size: int,
+        digest: Optional[str],
+        write,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Path:
+        """
+        音频就位并登记 (save_audio / 流式写入共用)
+
+        已有相同内容时硬链接，否则调用 write(path) 原子写入；随后更新索引、统计与元数据
+        """
+        audio_path = self.get_audio_path(hash_key)
+        audio_path.parent.mkdir(parents=True, exist_ok=True)
+        # 覆盖写入时按差值更新字节数，文件数不变
+        try:
+            previous_size = audio_path.stat().st_size
+        except FileNotFoundError:
+            previous_size = None
+        duplicate = digest and self._find_duplicate(digest, file_size, hash_key)
+        shared = bool(duplicate) and link_into_place(duplicate, audio_path)
+        
+        if not shared:
+            write(audio_path)
+        
+        self.index.add(hash_key, file_size, time.time(), shared=shared)
+        self.hot_cache.discard(hash_key)
+        if previous_size is not None:
+            # 主文件内容已变化，旧的压缩变体作废
+            self._remove_variants(hash_key)
+        
+        metadata = metadata or {}
+        labels = {
+            "voice": metadata.get("voice"),
+            "language": metadata.get("language"),
+            "format": config.AUDIO_FORMAT
+        }
+        self.stats.incr("writes", **labels)
+        self.stats.incr("bytes", file_size - (previous_size or 0), **labels)
+        if previous_size is None:
+            self.stats.incr("files", **labels)
+        if shared:
+            self.stats.incr("deduped", **labels)
+            self.stats.incr("deduped_bytes", file_size, **labels)
+        
+        # 保存元数据 (始终记录 size / cache_type，淘汰依赖这两项)
+        self._save_metadata(hash_key, {**metadata, "size": file_size, "digest": digest})
         logger.info(
             "audio_cached",
             hash=hash_key,
             size_bytes=file_size,
+            deduplicated=shared,
             path=str(audio_path)
         )
         
         return audio_path
     
     def get_metadata(self, hash_key: str) -> Optional[Dict[str, Any]]:
-        """获取音频元数据"""
-        metadata = self._load_metadata()
-        return metadata.get(hash_key)
+        """获取音频元数据 (按 Hash 单条查询，不在进程内缓存全量历史)"""
+        return self.metadata_store.get(hash_key)
     
-    def _load_metadata(self) -> Dict:
-        """加载元数据文件"""
-        if self._metadata_cache is not None:
-            return self._metadata_cache
-        
-        if not self.metadata_file.exists():
-            self._metadata_cache = {}
-            return self._metadata_cache
-        
-        try:
-            with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                self._metadata_cache = json.load(f)
-        except json.JSONDecodeError:
-            logger.warning("metadata_corrupted", path=str(self.metadata_file))
-            self._metadata_cache = {}
-        
-        return self._metadata_cache
+    def query_metadata(self, **filters) -> List[Dict[str, Any]]:
+        """按 voice / language / created_at 范围查询元数据"""
+        return self.metadata_store.query(**filters)
     
     def _save_metadata(self, hash_key: str, metadata: Dict[str, Any]):
-        """保存元数据"""
-        all_metadata = self._load_metadata()
-        
+        """保存元数据 (单条 upsert)"""
         # 添加时间戳
         metadata['created_at'] = datetime.utcnow().isoformat()
         metadata['hash'] = hash_key
+        metadata.setdefault('cache_type', DEFAULT_CACHE_TYPE)
         
-        all_metadata[hash_key] = metadata
-        
-        # 写入文件
-        with open(self.metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(all_metadata, f, indent=2, ensure_ascii=False)
-        
-        # 更新缓存
-        self._metadata_cache = all_metadata
+        self.metadata_store.upsert(hash_key, metadata)
     
-    def get_cache_stats(self) -> Dict[str, Any]:
-        """获取缓存统计信息"""
-        audio_files = list(self.cache_dir.glob(f"*.{config.AUDIO_FORMAT}"))
-        total_size = sum(f.stat().st_size for f in audio_files)
+    def close(self):
+        """释放 I/O 线程池、转码进程池与元数据后端等资源 (服务关闭时调用)"""
+        self.transcoder.shutdown()
+        self._io_executor.shutdown(wait=True)
+        self.metadata_store.close()
+    
+    def get_cache_stats(self, recompute: bool = False) -> Dict[str, Any]:
+        """
+        获取缓存统计信息 (读取增量计数器，不遍历目录)
+
+        Args:
+            recompute: 先全量审计目录重算 files / bytes，再返回结果
+        """
+        if recompute:
+            self.stats.audit(self.cache_dir)
+        counters = self.stats.snapshot()
+        total_size = counters["bytes"]
         
         return {
-            "total_files": len(audio_files),
+            "total_files": counters["files"],
             "total_size_bytes": total_size,
             "total_size_mb": round(total_size / (1024 * 1024), 2),
-            "cache_dir": str(self.cache_dir)
+            "cache_dir": str(self.cache_dir),
+            "shard_depth": self.layout.depth,
+            # 实际磁盘占用 (硬链接去重后的数据只计一次)，索引未加载时为 None
+            "disk_bytes": self.index.unique_bytes if self.index.loaded else None,
+            **counters,
+            "eviction": self.evictor.get_stats(),
+            "hot_cache": self.hot_cache.get_stats()
         }
 
 
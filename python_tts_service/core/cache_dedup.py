@@ -0,0 +1,149 @@
+"""
+内容寻址去重 (Content-Addressed Deduplication)
+
+不同的缓存 Hash 经常对应字节完全相同的音频:
+DashScope 忽略的 speed 参数、清洗后相同的文本、重复生成的条目……
+
+- 写入时计算内容摘要 (sha256)，元数据中已有相同摘要的文件时，
+  新 Hash 直接硬链接到已有数据，不再占用新的磁盘空间
+- 硬链接的引用计数由文件系统维护 (st_nlink)：淘汰某个 Hash 只删除一个链接，
+  最后一个链接删除时数据才真正释放，淘汰任务据此计算实际释放的字节数
+- 文件系统不支持硬链接 (部分 NAS / 跨设备) 时回退为普通写入
+- CacheDeduplicator: 对已有 CACHE_DIR 的一次性去重，报告回收的空间
+"""
+import os
+import hashlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List
+
+import structlog
+
+from .cache_layout import HASH_FILE_PATTERN
+
+logger = structlog.get_logger()
+
+_READ_CHUNK = 1024 * 1024
+
+
+def content_digest(data: bytes) -> str:
+    """音频内容摘要"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_READ_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_into_place(source: Path, target: Path) -> bool:
+    """
+    将 target 原子替换为 source 的硬链接
+
+    先链接到临时名再 os.replace，读方不会看到缺失的 target。
+    文件系统不支持硬链接或 source 已被删除时返回 False，由调用方回退为普通写入。
+    """
+    temp_path = target.with_name(f"{target.name}.link")
+    try:
+        os.link(source, temp_path)
+    except FileExistsError:
+        temp_path.unlink()
+        return link_into_place(source, target)
+    except OSError as e:
+        logger.debug("cache_dedup_link_unavailable", source=str(source), error=str(e))
+        return False
+    try:
+        os.replace(temp_path, target)
+    except OSError:
+        temp_path.unlink()
+        raise
+    return True
+
+
+class CacheDeduplicator:
+    """
+    对已有缓存目录做一次性去重
+
+    1. 遍历所有 <hash>.<ext> 文件，按 (设备, 大小) 分组 (大小不同的文件不可能相同)
+    2. 每个 inode 只读一次计算摘要，组内摘要相同者改为硬链接到同一份数据
+    3. 全部文件的摘要回填到元数据后端，此后的新写入可以与它们去重
+    """
+
+    def __init__(self, cache_dir: Path, store=None, dry_run: bool = False, batch_size: int = 500):
+        self.cache_dir = cache_dir
+        self.store = store
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+
+    def _iter_files(self):
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                match = HASH_FILE_PATTERN.match(name)
+                if not match:
+                    continue
+                path = Path(root) / name
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if stat.st_size > 0:
+                    yield match.group(1), path, stat
+
+    def run(self) -> Dict[str, Any]:
+        """执行去重，返回报告 (dry_run 时只统计可回收空间，不修改文件)"""
+        # (st_dev, size) → inode → [(hash, path)]
+        groups: Dict[tuple, Dict[int, List[tuple]]] = defaultdict(lambda: defaultdict(list))
+        nlinks: Dict[tuple, int] = {}
+        entries = []
+        for hash_key, path, stat in self._iter_files():
+            groups[(stat.st_dev, stat.st_size)][stat.st_ino].append((hash_key, path))
+            nlinks[(stat.st_dev, stat.st_ino)] = stat.st_nlink
+            entries.append((hash_key, stat.st_size, stat.st_mtime))
+
+        linked, reclaimed, digests = 0, 0, []
+        for (dev, size), inodes in groups.items():
+            by_digest: Dict[str, List[int]] = defaultdict(list)
+            for inode, files in inodes.items():
+                try:
+                    digest = file_digest(files[0][1])
+                except FileNotFoundError:
+                    continue
+                by_digest[digest].append(inode)
+                digests.extend((hash_key, digest) for hash_key, _ in files)
+
+            for digest, same in by_digest.items():
+                if len(same) < 2:
+                    continue
+                # 链接数最多的 inode 作为保留数据，移动的链接最少
+                same.sort(key=lambda inode: nlinks[(dev, inode)], reverse=True)
+                keeper_path = inodes[same[0]][0][1]
+                for inode in same[1:]:
+                    files = inodes[inode]
+                    relinked = 0
+                    for _, path in files:
+                        if self.dry_run or link_into_place(keeper_path, path):
+                            relinked += 1
+                    linked += relinked
+                    # 该 inode 的全部链接都已改指向保留数据，空间才真正释放
+                    if relinked == len(files) and nlinks[(dev, inode)] == len(files):
+                        reclaimed += size
+
+        if self.store is not None and not self.dry_run:
+            # 没有元数据的文件先补记录，摘要才有处可写
+            for start in range(0, len(entries), self.batch_size):
+                self.store.ensure_entries(entries[start:start + self.batch_size])
+            for start in range(0, len(digests), self.batch_size):
+                self.store.set_digests(digests[start:start + self.batch_size])
+
+        report = {
+            "scanned_files": len(entries),
+            "linked_files": linked,
+            "reclaimed_bytes": reclaimed,
+            "dry_run": self.dry_run,
+        }
+        logger.info("cache_dedup_done", **report)
+        return report
+
@@ -0,0 +1,164 @@
+"""
+缓存容量淘汰 (Byte Budget Eviction)
+
+CACHE_DIR 超过 CACHE_MAX_GB 时，后台任务按 LRU / LFU 删除 temporary 条目，
+直到回落到预算 × 低水位线。
+
+- 永久类型 (CACHE_PERMANENT_TYPES，默认 vocab / phrase，与 Prisma TTSCache.cacheType 一致) 永不淘汰
+- 每轮最多处理 CACHE_EVICT_BATCH 个候选，磁盘 I/O 有上界
+- 去重后多个 Hash 可能硬链接同一数据 (st_nlink > 1)，删除这类链接不释放空间，
+  预算按索引的 unique_bytes (实际磁盘占用) 计算
+- 音频多由 nginx 直接读取，服务看不到这些访问；删除前检查文件 atime 做"二次机会"，
+  atime 比记录的最近访问更新时刷新记录并跳过
+"""
+import time
+from typing import Any, Dict, Sequence
+
+import structlog
+
+logger = structlog.get_logger()
+
+EVICTION_POLICIES = ("lru", "lfu")
+
+
+class CacheEvictor:
+    """按字节预算淘汰缓存文件"""
+
+    def __init__(
+        self,
+        manager,
+        budget_bytes: int,
+        policy: str = "lru",
+        batch_size: int = 200,
+        low_watermark: float = 0.9,
+        min_idle_seconds: float = 0,
+        protected_types: Sequence[str] = ("vocab", "phrase")
+    ):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.manager = manager
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.min_idle_seconds = min_idle_seconds
+        self.protected_types = tuple(protected_types)
+
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.second_chances = 0
+        self.last_tick_at: float = 0
+        self._seeded = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0 and self.manager.metadata_store.supports_eviction
+
+    def _seed(self) -> None:
+        """首次运行时为没有元数据的旧文件补记录 (last_access 取 mtime)"""
+        index = self.manager.index
+        added = self.manager.metadata_store.ensure_entries(
+            (hash_key, entry.size, entry.mtime) for hash_key, entry in list(index.entries.items())
+        )
+        self._seeded = True
+        logger.info("cache_eviction_seeded", added=added)
+
+    def tick(self) -> int:
+        """执行一轮淘汰 (同步，在线程池中调用)，返回本轮删除的文件数"""
+        self.last_tick_at = time.time()
+        self.manager.flush_access_log()
+
+        if not self.enabled or not self.manager.index.loaded:
+            return 0
+        if not self._seeded:
+            self._seed()
+
+        used = self.manager.index.unique_bytes
+        if used <= self.budget_bytes:
+            return 0
+
+        target = int(self.budget_bytes * self.low_watermark)
+        store = self.manager.metadata_store
+        candidates = store.eviction_candidates(self.policy, self.protected_types, self.batch_size)
+        if not candidates:
+            logger.warning(
+                "cache_budget_exceeded_no_candidates",
+                used_bytes=used,
+                budget_bytes=self.budget_bytes
+            )
+            return 0
+
+        now = time.time()
+        evicted, removed = 0, []
+        for hash_key, size, last_access, voice, language in candidates:
+            if used <= target:
+                break
+
+            found = self.manager._find_on_disk(hash_key)
+            if found is None:
+                # 文件已被外部删除，清理残留记录
+                removed.append(hash_key)
+                self.manager.index.discard(hash_key)
+                self.manager.hot_cache.discard(hash_key)
+                labels = {"voice": voice, "language": language, "format": self.manager.index.ext}
+                self.manager.stats.incr("files", -1, **labels)
+                self.manager.stats.incr("bytes", -size, **labels)
+                continue
+
+            try:
+                stat = found.path.stat()
+            except FileNotFoundError:
+                continue
+            atime = stat.st_atime
+            if atime > last_access + 1:
+                # nginx 直读过，记录过期: 刷新后跳过本轮
+                store.record_access({hash_key: (atime, 0, None)})
+                self.second_chances += 1
+                continue
+            if now - max(atime, last_access) < self.min_idle_seconds:
+                continue
+
+            try:
+                found.path.unlink()
+            except FileNotFoundError:
+                pass
+            self.manager.index.discard(hash_key)
+            self.manager.hot_cache.discard(hash_key)
+            # 压缩变体随主文件一起删除 (变体不计入索引预算)
+            self.manager._remove_variants(hash_key)
+            removed.append(hash_key)
+            size = size or found.size
+            if stat.st_nlink > 1:
+                # 数据仍被其他 Hash 引用，只删除了一个链接
+                self.manager.index.unshare(size)
+            else:
+                used -= size
+                self.evicted_bytes += size
+            evicted += 1
+            self.evictions += 1
+            labels = {"voice": voice, "language": language, "format": found.path.suffix[1:]}
+            self.manager.stats.incr("evictions", **labels)
+            self.manager.stats.incr("files", -1, **labels)
+            self.manager.stats.incr("bytes", -size, **labels)
+
+        store.delete(removed)
+        if evicted:
+            logger.info(
+                "cache_evicted",
+                files=evicted,
+                policy=self.policy,
+                used_bytes=used,
+                budget_bytes=self.budget_bytes
+            )
+        return evicted
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "policy": self.policy,
+            "budget_bytes": self.budget_bytes,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "second_chances": self.second_chances,
+            "last_tick_at": self.last_tick_at or None,
+        }
@@ -0,0 +1,360 @@
+"""
+进程内缓存存在性索引 (Presence Index)
+
+每次 /tts/generate、/tts/check 都要 stat 一次磁盘才能判断命中。
+索引在启动时加载一次，此后命中判断不再产生系统调用:
+
+- map 模式 (默认): Hash → (size, mtime) 字典，命中零 syscall；
+  未命中默认再 stat 一次确认 (其他 worker / batch_edge_tts 写入的文件)
+- bloom 模式: 只保留 Bloom Filter (约 1.2 字节/条)，未命中零 syscall，
+  可能命中时 stat 确认，适合百万级条目 + 内存受限的 NAS
+
+启动时优先加载紧凑的磁盘快照 (.index.snapshot)，避免百万级目录重扫；
+后台周期性对账 (reconcile) 修正与磁盘的偏差并刷新快照。
+
+内容去重后多个 Hash 可能硬链接到同一份数据 (见 core/cache_dedup.py)，
+shared_bytes 记录这些共享链接的字节数，unique_bytes 才是实际占用的磁盘空间。
+"""
+import os
+import math
+import time
+import struct
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional, Set, Tuple
+
+import structlog
+
+from .cache_layout import CacheLayout
+
+logger = structlog.get_logger()
+
+SNAPSHOT_MAGIC = b"OPIX"
+SNAPSHOT_VERSION = 2
+# magic, version, count, created_at
+_HEADER_V1 = struct.Struct("<4sHId")
+# v2: + shared_bytes
+_HEADER = struct.Struct("<4sHIdQ")
+# md5 raw 16 bytes, size, mtime (秒), flags
+_RECORD = struct.Struct("<16sIIB")
+_FLAG_FLAT = 0x01
+
+
+class IndexEntry(NamedTuple):
+    size: int
+    mtime: int
+    flat: bool = False
+
+
+class BloomFilter:
+    """定长位数组 Bloom Filter (double hashing)"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1024)
+        self.num_bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: str) -> Iterator[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str) -> None:
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+def _encode_key(hash_key: str) -> Optional[bytes]:
+    """md5 hex → 16 字节；非 md5 命名的 Key 不进入快照 (由对账补回)"""
+    if len(hash_key) != 32:
+        return None
+    try:
+        return bytes.fromhex(hash_key)
+    except ValueError:
+        return None
+
+
+class CacheIndex:
+    """缓存存在性索引"""
+
+    def __init__(
+        self,
+        layout: CacheLayout,
+        ext: str,
+        mode: str = "map",
+        bloom_capacity: int = 1_000_000
+    ):
+        if mode not in ("map", "bloom"):
+            raise ValueError(f"Unknown cache index mode: {mode}")
+        self.layout = layout
+        self.ext = ext
+        self.mode = mode
+        self.bloom_capacity = bloom_capacity
+        self.snapshot_path = layout.cache_dir / ".index.snapshot"
+        self.loaded = False
+        # 对账扫描期间的新写入 / 删除，扫描结束后合并，避免被旧视图覆盖
+        self._pending: Optional[Dict[str, IndexEntry]] = None
+        self._discarded: Optional[Set[str]] = None
+        # 保护更新与重建时的合并 / 替换 (写入、淘汰与对账在不同线程)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.entries: Dict[str, IndexEntry] = {}
+        self.bloom = BloomFilter(self.bloom_capacity) if self.mode == "bloom" else None
+        self.count = 0
+        self.total_bytes = 0
+        self.shared_bytes = 0
+
+    # ------------------------------------------------------------------
+    # 查询与更新
+    # ------------------------------------------------------------------
+
+    def get(self, hash_key: str) -> Optional[IndexEntry]:
+        """map 模式: 返回条目；bloom 模式不保存条目，始终返回 None"""
+        return self.entries.get(hash_key)
+
+    def might_contain(self, hash_key: str) -> bool:
+        """False 表示 (本进程视角下) 一定不存在"""
+        if self.bloom is not None:
+            return hash_key in self.bloom
+        return hash_key in self.entries
+
+    @property
+    def unique_bytes(self) -> int:
+        """实际占用的磁盘字节数 (硬链接共享的数据只计一次)"""
+        return max(0, self.total_bytes - self.shared_bytes)
+
+    def add(
+        self,
+        hash_key: str,
+        size: int,
+        mtime: float,
+        flat: bool = False,
+        shared: bool = False
+    ) -> None:
+        """shared=True 表示该文件是已有数据的硬链接，不占用新的磁盘空间"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending[hash_key] = IndexEntry(size, int(mtime), flat)
+                self._discarded.discard(hash_key)
+            if shared:
+                self.shared_bytes += size
+            if self.bloom is not None:
+                # 已存在的 Key (覆盖写入) 不重复计数
+                if hash_key not in self.bloom:
+                    self.bloom.add(hash_key)
+                    self.count += 1
+                    self.total_bytes += size
+                return
+            previous = self.entries.get(hash_key)
+            if previous is None:
+                self.count += 1
+            else:
+                self.total_bytes -= previous.size
+            self.entries[hash_key] = IndexEntry(size, int(mtime), flat)
+            self.total_bytes += size
+
+    def discard(self, hash_key: str) -> None:
+        """移除条目 (bloom 模式无法删除，仅在下次对账时生效)"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.pop(hash_key, None)
+                self._discarded.add(hash_key)
+            entry = self.entries.pop(hash_key, None)
+            if entry is not None:
+                self.count -= 1
+                self.total_bytes -= entry.size
+
+    def unshare(self, size: int) -> None:
+        """删除的是共享链接 (数据仍被其他 Hash 引用)，不释放磁盘空间"""
+        self.shared_bytes = max(0, self.shared_bytes - size)
+
+    def relocate(self, hash_key: str, ext: str) -> None:
+        """迁移器回调: 扁平文件已移动到分片目录"""
+        entry = self.entries.get(hash_key)
+        if entry is not None and ext == self.ext:
+            self.entries[hash_key] = entry._replace(flat=False)
+
+    def path_for(self, hash_key: str, entry: IndexEntry) -> Path:
+        if entry.flat:
+            return self.layout.flat_path(hash_key, self.ext)
+        return self.layout.path_for(hash_key, self.ext)
+
+    # ------------------------------------------------------------------
+    # 目录扫描
+    # ------------------------------------------------------------------
+
+    def scan(self) -> Iterator[Tuple[str, IndexEntry, Optional[tuple]]]:
+        """
+        遍历磁盘上的缓存文件 (扁平根目录 + 分片目录)
+
+        产出 (hash, entry, link_key)；文件存在多个硬链接时 link_key 为 (st_dev, st_ino)
+        """
+        suffix = f".{self.ext}"
+        yield from self._scan_dir(self.layout.cache_dir, suffix, flat=True)
+        if self.layout.sharded:
+            yield from self._scan_shards(self.layout.cache_dir, self.layout.depth, suffix)
+
+    def _scan_shards(self, directory: Path, depth: int, suffix: str):
+        try:
+            with os.scandir(directory) as it:
+                subdirs = [
+                    entry.path for entry in it
+                    if entry.is_dir(follow_symlinks=False) and self._is_shard_name(entry.name)
+                ]
+        except FileNotFoundError:
+            return
+        for subdir in subdirs:
+            if depth == 1:
+                yield from self._scan_dir(Path(subdir), suffix, flat=False)
+            else:
+                yield from self._scan_shards(Path(subdir), depth - 1, suffix)
+
+    def _is_shard_name(self, name: str) -> bool:
+        return len(name) == self.layout.width and all(c in "0123456789abcdef" for c in name)
+
+    @staticmethod
+    def _scan_dir(directory: Path, suffix: str, flat: bool):
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(suffix) or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    if stat.st_size > 0:
+                        link_key = (stat.st_dev, stat.st_ino) if stat.st_nlink > 1 else None
+                        yield (
+                            entry.name[:-len(suffix)],
+                            IndexEntry(stat.st_size, int(stat.st_mtime), flat),
+                            link_key
+                        )
+        except FileNotFoundError:
+            return
+
+    def build(self) -> int:
+        """全量扫描目录重建索引 (冷启动或对账时使用)，返回条目数"""
+        started = time.monotonic()
+        fresh = CacheIndex(self.layout, self.ext, self.mode, self.bloom_capacity)
+        records = []
+        linked = set()
+        with self._lock:
+            self._pending, self._discarded = {}, set()
+        try:
+            for hash_key, entry, link_key in self.scan():
+                # 同一 inode 第二次出现起记为共享链接
+                shared = link_key is not None and link_key in linked
+                if link_key is not None:
+                    linked.add(link_key)
+                fresh.add(hash_key, entry.size, entry.mtime, entry.flat, shared=shared)
+                records.append((hash_key, entry))
+        except BaseException:
+            with self._lock:
+                self._pending, self._discarded = None, None
+            raise
+
+        # 合并扫描期间的写入 / 删除并替换引用，整个过程持锁，期间的更新不会丢失
+        with self._lock:
+            for hash_key, entry in self._pending.items():
+                fresh.add(hash_key, entry.size, entry.mtime, entry.flat)
+            for hash_key in self._discarded:
+                fresh.discard(hash_key)
+            discarded = self._discarded
+            self._pending, self._discarded = None, None
+
+            drift = fresh.count - self.count
+            # 原子替换引用，读方不会看到半成品
+            self.entries, self.bloom = fresh.entries, fresh.bloom
+            self.count, self.total_bytes = fresh.count, fresh.total_bytes
+            self.shared_bytes = fresh.shared_bytes
+            self.loaded = True
+
+        if discarded:
+            records = [(hash_key, entry) for hash_key, entry in records if hash_key not in discarded]
+
+        self._write_snapshot(records)
+        logger.info(
+            "cache_index_built",
+            entries=self.count,
+            drift=drift,
+            duration_ms=int((time.monotonic() - started) * 1000)
+        )
+        return self.count
+
+    # ------------------------------------------------------------------
+    # 磁盘快照
+    # ------------------------------------------------------------------
+
+    def save_snapshot(self) -> bool:
+        """保存快照 (bloom 模式无条目可写，由 build 在扫描时写入)"""
+        if self.mode != "map" or not self.loaded:
+            return False
+        self._write_snapshot(list(self.entries.items()))
+        return True
+
+    def _write_snapshot(self, records) -> None:
+        temp_path = self.snapshot_path.with_suffix(".tmp")
+        payload = bytearray()
+        written = 0
+        for hash_key, entry in records:
+            raw_key = _encode_key(hash_key)
+            if raw_key is None:
+                continue
+            payload += _RECORD.pack(
+                raw_key,
+                min(entry.size, 0xFFFFFFFF),
+                entry.mtime & 0xFFFFFFFF,
+                _FLAG_FLAT if entry.flat else 0
+            )
+            written += 1
+        with open(temp_path, "wb") as f:
+            f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, written, time.time(), self.shared_bytes))
+            f.write(payload)
+        os.replace(temp_path, self.snapshot_path)
+        logger.info("cache_index_snapshot_saved", entries=written, size_bytes=len(payload) + _HEADER.size)
+
+    def load_snapshot(self) -> bool:
+        """从快照加载索引，快照不存在或损坏时返回 False"""
+        try:
+            data = self.snapshot_path.read_bytes()
+        except FileNotFoundError:
+            return False
+
+        try:
+            magic, version, count, created_at = _HEADER_V1.unpack_from(data, 0)
+            if magic != SNAPSHOT_MAGIC or version not in (1, SNAPSHOT_VERSION):
+                raise ValueError("bad snapshot header")
+            # v1 快照没有 shared_bytes，按 0 处理，下次对账修正
+            header = _HEADER if version == SNAPSHOT_VERSION else _HEADER_V1
+            shared_bytes = header.unpack_from(data, 0)[4] if version == SNAPSHOT_VERSION else 0
+            if len(data) != header.size + count * _RECORD.size:
+                raise ValueError("truncated snapshot")
+        except (struct.error, ValueError) as e:
+            logger.warning("cache_index_snapshot_invalid", error=str(e))
+            return False
+
+        self._reset()
+        for raw_key, size, mtime, flags in _RECORD.iter_unpack(memoryview(data)[header.size:]):
+            self.add(raw_key.hex(), size, mtime, bool(flags & _FLAG_FLAT))
+        self.shared_bytes = shared_bytes
+        self.loaded = True
+        logger.info(
+            "cache_index_snapshot_loaded",
+            entries=self.count,
+            age_seconds=int(time.time() - created_at)
+        )
+        return True
+
+    def load(self) -> int:
+        """启动加载: 快照优先，没有快照时才全量扫描"""
+        if not self.load_snapshot():
+            self.build()
+        return self.count
+
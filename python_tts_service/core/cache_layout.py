@@ -0,0 +1,166 @@
+"""
+缓存目录布局 (分片 Fan-out) 与在线迁移
+
+扁平布局 (depth=0):  CACHE_DIR/abcd1234....wav
+分片布局 (depth=2):  CACHE_DIR/ab/cd/abcd1234....wav
+
+单目录下文件数达到数十万后，stat / glob / nginx 查找都会明显变慢。
+分片后每个目录的文件数被压到 CACHE_DIR 总数 / 16^(width*depth) 级别。
+
+对外 URL 与磁盘相对路径一一对应: /audio/ab/cd/<hash>.wav，
+任何静态文件服务器 (nginx alias / Next.js public) 都能直接解析。
+迁移过渡期的旧扁平 URL 由 nginx try_files 与 Next.js fallback rewrite 兜底。
+"""
+import os
+import re
+import time
+import asyncio
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+import structlog
+
+from .config import config
+
+logger = structlog.get_logger()
+
+# 只迁移 md5 命名的音频文件，避免误动 uk/ 等人工维护的子目录
+# 扩展名集合须与 nginx/nginx.conf 及 next.config.mjs 的扁平 URL 回退规则一致
+# (AAC 变体落盘为 .m4a，不会产生 .aac 文件)
+HASH_FILE_EXTENSIONS = ("wav", "mp3", "opus", "ogg", "m4a")
+HASH_FILE_PATTERN = re.compile(rf'^([0-9a-f]{{32}})\.({"|".join(HASH_FILE_EXTENSIONS)})$')
+
+
+class CacheLayout:
+    """根据 Hash 计算音频文件的分片路径"""
+
+    def __init__(self, cache_dir: Path, depth: int = 0, width: int = 2):
+        if depth < 0 or width < 1:
+            raise ValueError("shard depth must be >= 0 and width >= 1")
+        self.cache_dir = cache_dir
+        self.depth = depth
+        self.width = width
+
+    @property
+    def sharded(self) -> bool:
+        return self.depth > 0
+
+    def shard_parts(self, hash_key: str) -> List[str]:
+        """Hash 前缀拆出的目录名列表，如 ['ab', 'cd']"""
+        if not self.sharded or len(hash_key) < self.depth * self.width:
+            return []
+        return [
+            hash_key[i * self.width:(i + 1) * self.width]
+            for i in range(self.depth)
+        ]
+
+    def relative_path(self, hash_key: str, ext: str) -> str:
+        """相对 CACHE_DIR 的路径 (始终使用 / 分隔，可直接拼 URL)"""
+        return "/".join(self.shard_parts(hash_key) + [f"{hash_key}.{ext}"])
+
+    def path_for(self, hash_key: str, ext: str) -> Path:
+        """当前布局下的写入路径"""
+        return self.cache_dir.joinpath(*self.shard_parts(hash_key), f"{hash_key}.{ext}")
+
+    def flat_path(self, hash_key: str, ext: str) -> Path:
+        """旧版扁平布局路径"""
+        return self.cache_dir / f"{hash_key}.{ext}"
+
+    def candidates(self, hash_key: str, ext: str) -> List[Path]:
+        """
+        读路径候选 (按顺序尝试)
+
+        分片路径 → 扁平路径 → 再次分片路径。
+        最后一次重试覆盖迁移器恰好在两次 stat 之间移动文件的竞态。
+        """
+        primary = self.path_for(hash_key, ext)
+        if not self.sharded:
+            return [primary]
+        return [primary, self.flat_path(hash_key, ext), primary]
+
+    def url_for_path(self, path: Path) -> str:
+        """磁盘路径 → 对外 URL"""
+        relative = path.relative_to(self.cache_dir).as_posix()
+        return f"{config.AUDIO_URL_PREFIX}/{relative}"
+
+
+class CacheLayoutMigrator:
+    """
+    扁平布局 → 分片布局的在线迁移器
+
+    每批最多移动 batch_size 个文件，批间休眠 pause 秒，服务无需停机:
+    - os.replace 在同一文件系统内是原子 rename，读方要么看到旧路径要么看到新路径
+    - 读路径 (CacheLayout.candidates) 同时兼容两种布局
+    """
+
+    def __init__(
+        self,
+        layout: CacheLayout,
+        batch_size: int = None,
+        pause: float = None,
+        on_move: Optional[Callable[[str, str], None]] = None
+    ):
+        if not layout.sharded:
+            raise ValueError("Target layout is flat; nothing to migrate")
+        self.layout = layout
+        self.batch_size = batch_size or config.CACHE_MIGRATE_BATCH_SIZE
+        self.pause = config.CACHE_MIGRATE_PAUSE if pause is None else pause
+        # 文件移动后的回调 (hash, ext)，用于同步进程内索引
+        self.on_move = on_move
+        self.moved = 0
+        self.skipped = 0
+
+    def iter_flat_files(self) -> Iterator[os.DirEntry]:
+        """扫描根目录下仍处于扁平布局的音频文件 (不递归)"""
+        with os.scandir(self.layout.cache_dir) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False) and HASH_FILE_PATTERN.match(entry.name):
+                    yield entry
+
+    def migrate_batch(self) -> int:
+        """迁移一批文件，返回本批处理数量 (0 表示已完成)"""
+        processed = 0
+        for entry in self.iter_flat_files():
+            if processed >= self.batch_size:
+                break
+            hash_key, ext = HASH_FILE_PATTERN.match(entry.name).groups()
+            src = Path(entry.path)
+            dst = self.layout.path_for(hash_key, ext)
+            try:
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                if dst.exists():
+                    # 切换布局后新写入的文件优先，扁平副本已过期
+                    src.unlink()
+                    self.skipped += 1
+                else:
+                    os.replace(src, dst)
+                    self.moved += 1
+                if self.on_move:
+                    self.on_move(hash_key, ext)
+            except FileNotFoundError:
+                # 并发迁移器或清理任务已经处理过
+                pass
+            processed += 1
+        return processed
+
+    def run(self, max_batches: Optional[int] = None) -> int:
+        """同步执行迁移 (CLI 使用)，返回移动的文件总数"""
+        batches = 0
+        while self.migrate_batch():
+            batches += 1
+            logger.info("cache_migrate_progress", moved=self.moved, skipped=self.skipped)
+            if max_batches is not None and batches >= max_batches:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        logger.info("cache_migrate_done", moved=self.moved, skipped=self.skipped)
+        return self.moved
+
+    async def arun(self) -> int:
+        """异步执行迁移 (服务内后台任务)，每批在线程池中执行，不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        while await loop.run_in_executor(None, self.migrate_batch):
+            logger.info("cache_migrate_progress", moved=self.moved, skipped=self.skipped)
+            await asyncio.sleep(self.pause)
+        logger.info("cache_migrate_done", moved=self.moved, skipped=self.skipped)
+        return self.moved
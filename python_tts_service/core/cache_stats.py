@@ -0,0 +1,131 @@
+"""
+缓存增量统计 (Running Counters)
+
+/tts/stats 原先每次调用都 glob + stat 全部文件，仪表盘轮询时对磁盘压力很大。
+改为在写入 / 命中 / 淘汰路径上维护计数器，读取只需查询一张小表:
+
+- 计数器: files / bytes / hits / misses / writes / evictions
+- 分维度: 计数名后缀 ":<维度>:<取值>"，如 "hits:voice:Cherry"、"bytes:format:wav"
+- 增量先累加在内存中，由后台任务定期合并进元数据后端 (多 worker 各自累加，互不覆盖)
+- 计数与磁盘出现偏差 (外部删除 / 离线脚本写入) 时，可通过 /tts/stats?recompute=true 全量审计校正
+"""
+import os
+import time
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import structlog
+
+from .cache_layout import HASH_FILE_PATTERN
+
+logger = structlog.get_logger()
+
+# bytes 为逻辑字节数 (各 Hash 文件大小之和)；deduped / deduped_bytes 为去重写入的累计值
+COUNTERS = ("files", "bytes", "hits", "misses", "writes", "evictions", "deduped", "deduped_bytes")
+DIMENSIONS = ("voice", "language", "format")
+
+# 由审计重新计算的计数 (其余为历史累计值，审计时保留)
+AUDITED_COUNTERS = ("files", "bytes")
+
+
+class CacheStats:
+    """持久化的缓存统计计数器"""
+
+    def __init__(self, store):
+        self.store = store
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self.last_audit_at: Optional[float] = None
+
+    def incr(self, name: str, value: int = 1, **labels: Optional[str]) -> None:
+        """累加计数 (仅写内存)；labels 为维度取值，如 voice="Cherry"，空值忽略"""
+        with self._lock:
+            self._pending[name] += value
+            for dimension, label in labels.items():
+                if label:
+                    self._pending[f"{name}:{dimension}:{label}"] += value
+
+    def flush(self) -> None:
+        """将内存增量合并进元数据后端"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+        deltas = {name: value for name, value in pending.items() if value}
+        if deltas:
+            self.store.add_counters(deltas)
+
+    @property
+    def initialized(self) -> bool:
+        """后端中是否已有计数 (首次启动需要一次全量审计建立基线)"""
+        return "files" in self.store.load_counters()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前统计 (持久化值 + 尚未落库的本进程增量)"""
+        values = defaultdict(int, self.store.load_counters())
+        with self._lock:
+            for name, value in self._pending.items():
+                values[name] += value
+
+        result: Dict[str, Any] = {name: values[name] for name in COUNTERS}
+        for dimension in DIMENSIONS:
+            result[f"by_{dimension}"] = {}
+        for key, value in values.items():
+            name, _, rest = key.partition(":")
+            dimension, _, label = rest.partition(":")
+            if name in COUNTERS and dimension in DIMENSIONS and label:
+                result[f"by_{dimension}"].setdefault(label, {})[name] = value
+
+        lookups = result["hits"] + result["misses"]
+        result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else None
+        result["last_audit_at"] = self.last_audit_at
+        return result
+
+    def audit(self, cache_dir: Path) -> Dict[str, int]:
+        """
+        全量审计: 遍历缓存目录重算 files / bytes (含各维度)，覆盖持久化值
+
+        voice / language 维度取自元数据，没有元数据的文件只计入 format 维度。
+        审计期间的并发写入可能造成个位数偏差，下次审计自动修正。
+        """
+        started = time.monotonic()
+        # 先落库本进程增量，避免审计后被重复叠加
+        self.flush()
+
+        # hash → [(size, ext), ...] (同一 Hash 可能有多种格式)
+        files: Dict[str, list] = defaultdict(list)
+        for root, _, names in os.walk(cache_dir):
+            for name in names:
+                match = HASH_FILE_PATTERN.match(name)
+                if not match:
+                    continue
+                try:
+                    size = os.stat(os.path.join(root, name)).st_size
+                except FileNotFoundError:
+                    continue
+                if size > 0:
+                    files[match.group(1)].append((size, match.group(2)))
+
+        values: Dict[str, int] = defaultdict(int, {name: 0 for name in AUDITED_COUNTERS})
+        for variants in files.values():
+            for size, ext in variants:
+                values["files"] += 1
+                values["bytes"] += size
+                values[f"files:format:{ext}"] += 1
+                values[f"bytes:format:{ext}"] += size
+        for hash_key, voice, language in self.store.iter_labels():
+            for size, _ in files.get(hash_key, ()):
+                for dimension, label in (("voice", voice), ("language", language)):
+                    if label:
+                        values[f"files:{dimension}:{label}"] += 1
+                        values[f"bytes:{dimension}:{label}"] += size
+
+        self.store.replace_counters(dict(values), AUDITED_COUNTERS)
+        self.last_audit_at = time.time()
+        logger.info(
+            "cache_stats_audited",
+            files=values["files"],
+            bytes=values["bytes"],
+            duration_ms=int((time.monotonic() - started) * 1000)
+        )
+        return {name: values[name] for name in AUDITED_COUNTERS}
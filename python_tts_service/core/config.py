@@ -21,17 +21,53 @@ class Config:
     # TTS 模型配置
     # 允许通过环境变量覆盖
     TTS_MODEL: str = os.getenv("TTS_MODEL", "qwen3-tts-flash")
+    
+    # DashScope 客户端: async (httpx 连接池 + SSE，不占线程) | sync (官方 SDK，线程池中阻塞调用)
+    TTS_CLIENT: str = os.getenv("TTS_CLIENT", "async")
+    # 原生 HTTP 接口地址 (与 OPENAI_BASE_URL 的 compatible-mode 不同)
+    DASHSCOPE_HTTP_URL: str = os.getenv("DASHSCOPE_HTTP_URL", "https://dashscope.aliyuncs.com/api/v1")
+    # async 客户端连接池: 最大连接数 / 保持的空闲连接数 / 空闲连接保留秒数
+    TTS_HTTP_MAX_CONNECTIONS: int = int(os.getenv("TTS_HTTP_MAX_CONNECTIONS", "200"))
+    TTS_HTTP_MAX_KEEPALIVE: int = int(os.getenv("TTS_HTTP_MAX_KEEPALIVE", "50"))
+    TTS_HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("TTS_HTTP_KEEPALIVE_EXPIRY", "60"))
+    # 上游容错 (core/resilience.py): 429 / 5xx / 超时的最多尝试次数与 full jitter 退避 (秒)
+    TTS_RETRY_ATTEMPTS: int = int(os.getenv("TTS_RETRY_ATTEMPTS", "3"))
+    TTS_RETRY_BASE_DELAY: float = float(os.getenv("TTS_RETRY_BASE_DELAY", "0.2"))
+    TTS_RETRY_MAX_DELAY: float = float(os.getenv("TTS_RETRY_MAX_DELAY", "2.0"))
+    # 熔断: 连续失败次数阈值 / 打开后的冷却秒数
+    TTS_BREAKER_FAILURES: int = int(os.getenv("TTS_BREAKER_FAILURES", "5"))
+    TTS_BREAKER_COOLDOWN: float = float(os.getenv("TTS_BREAKER_COOLDOWN", "30"))
+    # 对冲请求 (多一次计费，默认关闭): 首包超过近期该分位延迟 (不低于最小延迟) 时再发一次
+    TTS_HEDGE: bool = os.getenv("TTS_HEDGE", "false").lower() == "true"
+    TTS_HEDGE_QUANTILE: float = float(os.getenv("TTS_HEDGE_QUANTILE", "0.95"))
+    TTS_HEDGE_MIN_DELAY: float = float(os.getenv("TTS_HEDGE_MIN_DELAY", "0.3"))
+    # 提供方路由 (services/router.py): 启用的提供方 (按优先级) / 每字符成本 / 选择策略
+    # 缓存 Key 不含提供方，备用提供方 (音色不同) 需显式启用，如 "dashscope,edge"
+    TTS_PROVIDERS: str = os.getenv("TTS_PROVIDERS", "dashscope")
+    TTS_PROVIDER_COSTS: str = os.getenv("TTS_PROVIDER_COSTS", "dashscope=0.00008,edge=0,fake=0")
+    # priority | cost | latency | balanced
+    TTS_ROUTING_POLICY: str = os.getenv("TTS_ROUTING_POLICY", "priority")
+    # balanced 策略中成本相对延迟的权重 (每单位成本折合的秒数)
+    TTS_ROUTING_COST_WEIGHT: float = float(os.getenv("TTS_ROUTING_COST_WEIGHT", "100"))
+    # 假提供方的首包延迟 (秒)
+    FAKE_TTS_LATENCY: float = float(os.getenv("FAKE_TTS_LATENCY", "0.05"))
     DEFAULT_VOICE: str = os.getenv("TTS_DEFAULT_VOICE", "Cherry")
     DEFAULT_LANGUAGE: str = "English"
     DEFAULT_SPEED: float = float(os.getenv("TTS_DEFAULT_SPEED", "1.0"))
     
     # 文本限制
     MAX_TEXT_LENGTH: int = int(os.getenv("MAX_TEXT_LENGTH", "500"))
+    # 长文本: 超过 MAX_TEXT_LENGTH 时按句切分、并行合成后拼接 (每句单独缓存)
+    # 请求文本上限 / 单个长文本同时进行的分句合成数
+    MAX_LONG_TEXT_LENGTH: int = int(os.getenv("MAX_LONG_TEXT_LENGTH", "5000"))
+    LONG_TEXT_MAX_CONCURRENCY: int = int(os.getenv("LONG_TEXT_MAX_CONCURRENCY", "8"))
     MIN_TEXT_LENGTH: int = 1
     
     # 速度限制
     MIN_SPEED: float = 0.5
     MAX_SPEED: float = 2.0
+    # 非 1.0 语速由缓存的 1.0× 主文件本地变速生成 (ffmpeg atempo，不调用提供方)；ffmpeg 不可用时交给提供方
+    SPEED_VARIANTS_LOCAL: bool = os.getenv("SPEED_VARIANTS_LOCAL", "true").lower() == "true"
     
     # 缓存配置
     # 获取项目根目录 (假设 core/config.py 在 python_tts_service/core/)
@@ -46,13 +82,120 @@ class Config:
         CACHE_DIR: Path = Path("/app/audio") if Path("/app").exists() else _PROJECT_ROOT / "public" / "audio"
         
     ENABLE_CACHE: bool = True
-    
+
+    # 缓存目录分片: depth=2, width=2 → ab/cd/<hash>.wav
+    # depth=0 为旧版扁平布局；开启后读路径仍兼容扁平文件
+    CACHE_SHARD_DEPTH: int = int(os.getenv("CACHE_SHARD_DEPTH", "0"))
+    CACHE_SHARD_WIDTH: int = int(os.getenv("CACHE_SHARD_WIDTH", "2"))
+
+    # 扁平 → 分片在线迁移 (每批文件数 / 批间休眠秒数)
+    CACHE_MIGRATE_ON_STARTUP: bool = os.getenv("CACHE_MIGRATE_ON_STARTUP", "false").lower() == "true"
+    CACHE_MIGRATE_BATCH_SIZE: int = int(os.getenv("CACHE_MIGRATE_BATCH_SIZE", "500"))
+    CACHE_MIGRATE_PAUSE: float = float(os.getenv("CACHE_MIGRATE_PAUSE", "0.5"))
+
+    # 缓存元数据后端: sqlite (默认，WAL 模式) | json (旧版 metadata.json)
+    METADATA_BACKEND: str = os.getenv("METADATA_BACKEND", "sqlite")
+
+    # 进程内缓存存在性索引 (命中判断零 syscall)
+    # map: Hash → size/mtime 字典；bloom: 仅 Bloom Filter，省内存，未命中零 syscall
+    CACHE_INDEX_ENABLED: bool = os.getenv("CACHE_INDEX_ENABLED", "true").lower() == "true"
+    CACHE_INDEX_MODE: str = os.getenv("CACHE_INDEX_MODE", "map")
+    CACHE_INDEX_BLOOM_CAPACITY: int = int(os.getenv("CACHE_INDEX_BLOOM_CAPACITY", "2000000"))
+    # map 模式下索引未命中时是否再 stat 确认 (多 worker / 离线脚本写入的文件)
+    CACHE_INDEX_VERIFY_MISSES: bool = os.getenv("CACHE_INDEX_VERIFY_MISSES", "true").lower() == "true"
+    # 后台对账间隔 (秒)，0 表示关闭
+    CACHE_INDEX_RECONCILE_INTERVAL: int = int(os.getenv("CACHE_INDEX_RECONCILE_INTERVAL", "3600"))
+
+    # 批量存在性检查: 同一目录待查 Hash 达到该数量时 scandir 一次代替逐个 stat
+    CACHE_CHECK_SCANDIR_MIN: int = int(os.getenv("CACHE_CHECK_SCANDIR_MIN", "32"))
+
+    # 容量预算与淘汰: 超过 CACHE_MAX_GB 后按 LRU / LFU 删除 temporary 条目，0 表示不限
+    CACHE_MAX_BYTES: int = int(float(os.getenv("CACHE_MAX_GB", "0")) * 1024 ** 3)
+    CACHE_EVICT_POLICY: str = os.getenv("CACHE_EVICT_POLICY", "lru")  # lru | lfu
+    CACHE_EVICT_INTERVAL: int = int(os.getenv("CACHE_EVICT_INTERVAL", "60"))  # 秒
+    CACHE_EVICT_BATCH: int = int(os.getenv("CACHE_EVICT_BATCH", "200"))  # 每轮最多处理条数
+    CACHE_EVICT_LOW_WATERMARK: float = float(os.getenv("CACHE_EVICT_LOW_WATERMARK", "0.9"))
+    # 最短空闲时间 (秒，默认 1 天)，可与 Next.js cleanupTemporaryCacheCore 的 90 天窗口对齐；
+    # nginx 直读的访问只能靠 atime 发现 (noatime / relatime 挂载不可靠)，不宜设为 0
+    CACHE_EVICT_MIN_IDLE: int = int(os.getenv("CACHE_EVICT_MIN_IDLE", "86400"))
+    # 永不淘汰的缓存类型 (Prisma TTSCache.cacheType: vocab / phrase 永久保留)
+    CACHE_PERMANENT_TYPES: tuple = tuple(
+        t.strip() for t in os.getenv("CACHE_PERMANENT_TYPES", "vocab,phrase").split(",") if t.strip()
+    )
+
+    # 内容去重: 字节相同的音频只存一份，其余 Hash 硬链接到同一数据
+    CACHE_DEDUP_ENABLED: bool = os.getenv("CACHE_DEDUP_ENABLED", "true").lower() == "true"
+
+    # 请求路径缓存 I/O 线程数 (文件读写 / 元数据查询)
+    CACHE_IO_THREADS: int = int(os.getenv("CACHE_IO_THREADS", "8"))
+
+    # 热点音频内存缓存 (每个 worker 一份)，0 表示关闭
+    HOT_CACHE_MAX_BYTES: int = int(float(os.getenv("HOT_CACHE_MAX_MB", "64")) * 1024 ** 2)
+    HOT_CACHE_MAX_ITEM_BYTES: int = int(os.getenv("HOT_CACHE_MAX_ITEM_KB", "2048")) * 1024
+    # /tts/audio 响应的 Cache-Control max-age (秒)；同一 Hash 的内容不变，默认一年
+    AUDIO_HTTP_MAX_AGE: int = int(os.getenv("AUDIO_HTTP_MAX_AGE", "31536000"))
+
+    # 统计计数器落库间隔 (秒)
+    CACHE_STATS_FLUSH_INTERVAL: int = int(os.getenv("CACHE_STATS_FLUSH_INTERVAL", "10"))
+
+    # 音频对外 URL 前缀 (nginx alias / Next.js public 目录)
+    AUDIO_URL_PREFIX: str = "/audio"
+
     # 音频格式
     AUDIO_FORMAT: str = "wav"  # wav 或 mp3
     AUDIO_SAMPLE_RATE: int = 24000  # 24kHz
+
+    # 压缩变体 (opus / mp3 / aac)，转码进程数，0 表示关闭转码
+    TRANSCODE_WORKERS: int = int(os.getenv("TRANSCODE_WORKERS", "2"))
+    # 写入时预生成的变体，如 "opus,mp3"；默认为空，即首次请求时生成
+    AUDIO_VARIANTS_ON_WRITE: tuple = tuple(
+        f.strip() for f in os.getenv("AUDIO_VARIANTS_ON_WRITE", "").split(",") if f.strip()
+    )
+    
+    # 并发控制: 同时进行的 DashScope 合成数 (缓存命中不占用)；开启自适应时为初始值
+    MAX_CONCURRENT_REQUESTS: int = int(os.getenv("MAX_CONCURRENT_REQUESTS", "3"))
+    # 自适应并发 (AIMD): 按 DashScope 延迟与 429 / 5xx / 超时在上下限之间调整并发
+    ADAPTIVE_CONCURRENCY: bool = os.getenv("ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+    ADAPTIVE_MIN_LIMIT: int = int(os.getenv("ADAPTIVE_MIN_LIMIT", "2"))
+    ADAPTIVE_MAX_LIMIT: int = int(os.getenv("ADAPTIVE_MAX_LIMIT", "32"))
+    # 延迟超过基线的倍数视为拥塞
+    ADAPTIVE_LATENCY_TOLERANCE: float = float(os.getenv("ADAPTIVE_LATENCY_TOLERANCE", "2.0"))
+    # 延迟拥塞 / 限流时并发的乘性减小系数
+    ADAPTIVE_LATENCY_BACKOFF: float = float(os.getenv("ADAPTIVE_LATENCY_BACKOFF", "0.9"))
+    ADAPTIVE_THROTTLE_BACKOFF: float = float(os.getenv("ADAPTIVE_THROTTLE_BACKOFF", "0.5"))
+    # 合成准入队列 (优先级 interactive > prefetch > bulk)，格式 "类别=值,..."，default 为未列出类别的取值
+    # 预留并发: 只有该类别能使用的名额
+    ADMISSION_RESERVED: dict = {
+        k.strip(): int(v) for k, v in (
+            item.split("=") for item in os.getenv("ADMISSION_RESERVED", "interactive=1").split(",") if item.strip()
+        )
+    }
+    # 每类最大排队数，超出返回 429
+    ADMISSION_MAX_QUEUE: dict = {
+        k.strip(): int(v) for k, v in (
+            item.split("=") for item in os.getenv("ADMISSION_MAX_QUEUE", "default=50").split(",") if item.strip()
+        )
+    }
+    # 每类最长排队秒数，超时返回 503
+    ADMISSION_QUEUE_TIMEOUT: dict = {
+        k.strip(): float(v) for k, v in (
+            item.split("=") for item in os.getenv(
+                "ADMISSION_QUEUE_TIMEOUT", "interactive=10,prefetch=30,bulk=120"
+            ).split(",") if item.strip()
+        )
+    }
     
-    # 并发控制
-    MAX_CONCURRENT_REQUESTS: int = 3
+    # 批量生成: 单个批次同时进行的合成数 (其余条目在批次内等待，不占用准入队列)
+    BATCH_MAX_CONCURRENCY: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+    
+    # WebSocket: 单个连接上同时进行的请求数 (超出的请求直接返回 error)
+    WS_MAX_IN_FLIGHT: int = int(os.getenv("WS_MAX_IN_FLIGHT", "4"))
+    # WebSocket 缓存命中的发送: 分片时长 / 立即发送的音频时长 (毫秒) / 其后的速度 (实时倍数，0 为不限速)
+    WS_CACHE_CHUNK_MS: int = int(os.getenv("WS_CACHE_CHUNK_MS", "200"))
+    WS_CACHE_PREBUFFER_MS: int = int(os.getenv("WS_CACHE_PREBUFFER_MS", "1000"))
+    WS_CACHE_PACE: float = float(os.getenv("WS_CACHE_PACE", "4.0"))
+    # WebSocket 长文本: 同时在合成的分段数 (当前发送的一段 + 预取的后续段)
+    WS_PIPELINE_DEPTH: int = max(int(os.getenv("WS_PIPELINE_DEPTH", "2")), 1)
     
     # 超时设置
     TTS_API_TIMEOUT: int = 30  # 秒
@@ -63,6 +206,23 @@ class Config:
         if not cls.OPENAI_API_KEY:
             raise ValueError("TTS_API_KEY environment variable is required")
         
+        # 准入队列: 预留名额之外至少要有 1 个共享名额，否则 prefetch / bulk 永远无法准入
+        min_capacity = cls.ADAPTIVE_MIN_LIMIT if cls.ADAPTIVE_CONCURRENCY else cls.MAX_CONCURRENT_REQUESTS
+        if min_capacity < 1:
+            raise ValueError("MAX_CONCURRENT_REQUESTS / ADAPTIVE_MIN_LIMIT must be at least 1")
+        if cls.ADAPTIVE_CONCURRENCY and cls.ADAPTIVE_MAX_LIMIT < cls.ADAPTIVE_MIN_LIMIT:
+            raise ValueError("ADAPTIVE_MAX_LIMIT must not be less than ADAPTIVE_MIN_LIMIT")
+        unknown = set(cls.ADMISSION_RESERVED) - {"interactive", "prefetch", "bulk"}
+        if unknown:
+            raise ValueError(f"Unknown ADMISSION_RESERVED priority: {', '.join(sorted(unknown))}")
+        if any(v < 0 for v in cls.ADMISSION_RESERVED.values()):
+            raise ValueError("ADMISSION_RESERVED values must not be negative")
+        if sum(cls.ADMISSION_RESERVED.values()) >= min_capacity:
+            raise ValueError(
+                f"ADMISSION_RESERVED ({sum(cls.ADMISSION_RESERVED.values())}) must leave at least one shared slot "
+                f"below the minimum concurrency ({min_capacity})"
+            )
+        
         # 确保缓存目录存在
         cls.CACHE_DIR.mkdir(parents=True, exist_ok=True)
         
@@ -0,0 +1,83 @@
+"""
+热点音频内存缓存 (Hot Tier)
+
+少量词汇与界面句子贡献了绝大多数音频读取。
+在 CacheManager 前放一层按字节数限容的进程内 LRU，命中时直接从内存返回，不读磁盘:
+
+- 总容量 HOT_CACHE_MAX_MB，单条超过 HOT_CACHE_MAX_ITEM_KB 的音频不进入内存
+- 读取时才装入 (read-through)；写入 / 淘汰时失效对应条目
+- 每个 worker 各自一份，互不共享
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+class HotAudio(NamedTuple):
+    """内存中的音频"""
+    data: bytes
+    etag: str
+    ext: str
+
+
+class HotAudioCache:
+    """按字节数限容的 LRU"""
+
+    def __init__(self, max_bytes: int, max_item_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._items: "OrderedDict[str, HotAudio]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, hash_key: str) -> Optional[HotAudio]:
+        with self._lock:
+            item = self._items.get(hash_key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(hash_key)
+            self.hits += 1
+            return item
+
+    def put(self, hash_key: str, item: HotAudio) -> bool:
+        """装入条目，超出容量时从最久未用的一端淘汰；返回是否已装入"""
+        size = len(item.data)
+        if not self.enabled or size > self.max_item_bytes or size > self.max_bytes:
+            return False
+        with self._lock:
+            previous = self._items.pop(hash_key, None)
+            if previous is not None:
+                self.used_bytes -= len(previous.data)
+            self._items[hash_key] = item
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.used_bytes -= len(evicted.data)
+        return True
+
+    def discard(self, hash_key: str) -> None:
+        with self._lock:
+            item = self._items.pop(hash_key, None)
+            if item is not None:
+                self.used_bytes -= len(item.data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "items": len(self._items),
+            "used_bytes": self.used_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,530 @@
+"""
+缓存元数据存储后端
+
+- sqlite (默认): 嵌入式 SQLite + WAL，O(1) upsert / 按 Hash 查询，
+  voice / language / created_at 建索引，多个 uvicorn worker 并发写入不会互相覆盖
+- json: 旧版 metadata.json 整文件读写，仅保留用于对比与回滚
+
+切换方式: 环境变量 METADATA_BACKEND=sqlite|json
+"""
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import structlog
+
+logger = structlog.get_logger()
+
+# 独立列存储的字段，其余字段序列化进 extra
+_COLUMNS = ("hash", "text", "voice", "language", "speed", "created_at", "cache_type", "size", "digest")
+# 由访问记录维护的字段 (只读返回，不接受 upsert 写入)
+_ACCESS_COLUMNS = ("last_access", "access_count")
+
+# 缓存类型，与 Prisma TTSCache.cacheType 对应: vocab / phrase / temporary
+DEFAULT_CACHE_TYPE = "temporary"
+
+
+class MetadataStore(ABC):
+    """元数据存储接口"""
+
+    @abstractmethod
+    def upsert(self, hash_key: str, metadata: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def upsert_many(self, items: Iterable[Dict[str, Any]]) -> int:
+        """批量写入 (每项需包含 hash 字段)，返回写入条数"""
+        count = 0
+        for item in items:
+            self.upsert(item["hash"], item)
+            count += 1
+        return count
+
+    @abstractmethod
+    def get(self, hash_key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def query(
+        self,
+        voice: Optional[str] = None,
+        language: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self) -> int:
+        raise NotImplementedError
+
+    # ------------------------------------------------------------------
+    # 淘汰支持 (不支持的后端返回空结果，淘汰任务自动空转)
+    # ------------------------------------------------------------------
+
+    supports_eviction = False
+
+    def record_access(self, accesses: Dict[str, Tuple[float, int, Optional[str]]]) -> None:
+        """批量写入访问记录: hash → (最近访问时间, 新增访问次数, 需提升到的 cache_type)"""
+
+    def ensure_entries(self, rows: Iterable[Tuple[str, int, float]]) -> int:
+        """为没有元数据的文件补记录: (hash, size, mtime)，返回新增条数"""
+        return 0
+
+    def eviction_candidates(
+        self,
+        policy: str,
+        protected_types: Sequence[str],
+        limit: int
+    ) -> List[Tuple[str, int, float, Optional[str], Optional[str]]]:
+        """按策略返回可淘汰条目: (hash, size, last_access, voice, language)"""
+        return []
+
+    def delete(self, hash_keys: Sequence[str]) -> None:
+        pass
+
+    # ------------------------------------------------------------------
+    # 内容去重支持 (见 core/cache_dedup.py)
+    # ------------------------------------------------------------------
+
+    def find_by_digest(self, digest: str, limit: int = 8) -> List[str]:
+        """返回内容摘要相同的条目 Hash (不支持的后端返回空列表，即不去重)"""
+        return []
+
+    def set_digests(self, rows: Iterable[Tuple[str, str]]) -> None:
+        """批量回填内容摘要: (hash, digest)"""
+
+    # ------------------------------------------------------------------
+    # 统计计数器 (见 core/cache_stats.py)
+    # ------------------------------------------------------------------
+
+    @abstractmethod
+    def iter_labels(self) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+        """遍历全部条目的统计维度: (hash, voice, language)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_counters(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_counters(self, deltas: Dict[str, int]) -> None:
+        """累加计数 (多进程并发累加不会互相覆盖)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def replace_counters(self, values: Dict[str, int], names: Sequence[str]) -> None:
+        """覆盖 names 及其所有维度计数 (审计结果)，其余计数不变"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+def _counter_family(key: str) -> str:
+    """计数名去掉维度后缀: hits:voice:Cherry → hits"""
+    return key.partition(":")[0]
+
+
+class JsonMetadataStore(MetadataStore):
+    """旧版 metadata.json 后端 (每次写入重写整个文件)"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            logger.warning("metadata_corrupted", path=str(self.path))
+            return {}
+
+    def upsert(self, hash_key: str, metadata: Dict[str, Any]) -> None:
+        with self._lock:
+            all_metadata = self._load()
+            all_metadata[hash_key] = {**all_metadata.get(hash_key, {}), **metadata, "hash": hash_key}
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(all_metadata, f, indent=2, ensure_ascii=False)
+
+    def get(self, hash_key: str) -> Optional[Dict[str, Any]]:
+        return self._load().get(hash_key)
+
+    def query(self, voice=None, language=None, since=None, until=None, limit=100):
+        results = []
+        for item in self._load().values():
+            created_at = item.get("created_at") or ""
+            if voice and item.get("voice") != voice:
+                continue
+            if language and item.get("language") != language:
+                continue
+            if since and created_at < since:
+                continue
+            if until and created_at >= until:
+                continue
+            results.append(item)
+        results.sort(key=lambda item: item.get("created_at") or "", reverse=True)
+        return results[:limit]
+
+    def count(self) -> int:
+        return len(self._load())
+
+    def iter_labels(self):
+        for hash_key, item in self._load().items():
+            yield hash_key, item.get("voice"), item.get("language")
+
+    @property
+    def _counters_path(self) -> Path:
+        return self.path.with_name("stats.json")
+
+    def load_counters(self) -> Dict[str, int]:
+        try:
+            with open(self._counters_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_counters(self, counters: Dict[str, int]) -> None:
+        with open(self._counters_path, 'w', encoding='utf-8') as f:
+            json.dump(counters, f, indent=2, ensure_ascii=False)
+
+    def add_counters(self, deltas: Dict[str, int]) -> None:
+        with self._lock:
+            counters = self.load_counters()
+            for key, value in deltas.items():
+                counters[key] = counters.get(key, 0) + value
+            self._write_counters(counters)
+
+    def replace_counters(self, values: Dict[str, int], names: Sequence[str]) -> None:
+        with self._lock:
+            counters = {
+                key: value for key, value in self.load_counters().items()
+                if _counter_family(key) not in names
+            }
+            counters.update(values)
+            self._write_counters(counters)
+
+
+class SQLiteMetadataStore(MetadataStore):
+    """
+    SQLite 元数据后端
+
+    - WAL 模式: 读写互不阻塞，多进程写入由 SQLite 文件锁串行化
+    - 单连接 + 线程锁: 同一进程内的线程池共享连接
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            hash        TEXT PRIMARY KEY,
+            text        TEXT,
+            voice       TEXT,
+            language    TEXT,
+            speed       REAL,
+            created_at  TEXT,
+            extra       TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_entries_voice ON entries(voice);
+        CREATE INDEX IF NOT EXISTS idx_entries_language ON entries(language);
+        CREATE INDEX IF NOT EXISTS idx_entries_created_at ON entries(created_at);
+        CREATE TABLE IF NOT EXISTS counters (
+            name        TEXT PRIMARY KEY,
+            value       INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    # 增量加列 (已有数据库自动升级)
+    COLUMN_MIGRATIONS = (
+        ("cache_type", f"TEXT DEFAULT '{DEFAULT_CACHE_TYPE}'"),
+        ("size", "INTEGER"),
+        ("last_access", "REAL"),
+        ("access_count", "INTEGER DEFAULT 0"),
+        ("digest", "TEXT"),
+    )
+    INDEX_MIGRATIONS = """
+        CREATE INDEX IF NOT EXISTS idx_entries_lru ON entries(cache_type, last_access);
+        CREATE INDEX IF NOT EXISTS idx_entries_lfu ON entries(cache_type, access_count, last_access);
+        CREATE INDEX IF NOT EXISTS idx_entries_digest ON entries(digest);
+    """
+
+    supports_eviction = True
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+            self._migrate()
+
+    def _migrate(self) -> None:
+        existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(entries)")}
+        for column, ddl in self.COLUMN_MIGRATIONS:
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE entries ADD COLUMN {column} {ddl}")
+        self._conn.executescript(self.INDEX_MIGRATIONS)
+
+    @staticmethod
+    def _to_row(hash_key: str, metadata: Dict[str, Any]) -> tuple:
+        extra = {
+            k: v for k, v in metadata.items()
+            if k not in _COLUMNS and k not in _ACCESS_COLUMNS
+        }
+        return (
+            hash_key,
+            metadata.get("text"),
+            metadata.get("voice"),
+            metadata.get("language"),
+            metadata.get("speed"),
+            metadata.get("created_at"),
+            metadata.get("cache_type"),
+            metadata.get("size"),
+            metadata.get("digest"),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    @staticmethod
+    def _from_row(row: sqlite3.Row) -> Dict[str, Any]:
+        item = {key: row[key] for key in _COLUMNS + _ACCESS_COLUMNS}
+        if row["extra"]:
+            item.update(json.loads(row["extra"]))
+        return item
+
+    _UPSERT_SQL = """
+        INSERT INTO entries (
+            hash, text, voice, language, speed, created_at, cache_type, size, digest, extra,
+            last_access, access_count
+        )
+        VALUES (
+            ?, ?, ?, ?, ?, ?, COALESCE(?, 'temporary'), ?, ?, ?,
+            CAST(strftime('%s', 'now') AS REAL), 0
+        )
+        ON CONFLICT(hash) DO UPDATE SET
+            text = excluded.text,
+            voice = excluded.voice,
+            language = excluded.language,
+            speed = excluded.speed,
+            created_at = COALESCE(entries.created_at, excluded.created_at),
+            -- 只升级不降级: vocab / phrase 不会被后续的 temporary 写入覆盖
+            cache_type = CASE
+                WHEN excluded.cache_type = 'temporary' THEN COALESCE(entries.cache_type, 'temporary')
+                ELSE excluded.cache_type
+            END,
+            size = COALESCE(excluded.size, entries.size),
+            digest = COALESCE(excluded.digest, entries.digest),
+            extra = excluded.extra,
+            last_access = excluded.last_access
+    """
+
+    def upsert(self, hash_key: str, metadata: Dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(self._UPSERT_SQL, self._to_row(hash_key, metadata))
+
+    def upsert_many(self, items: Iterable[Dict[str, Any]]) -> int:
+        rows = [self._to_row(item["hash"], item) for item in items]
+        with self._lock, self._conn:
+            self._conn.executemany(self._UPSERT_SQL, rows)
+        return len(rows)
+
+    def get(self, hash_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM entries WHERE hash = ?", (hash_key,)
+            ).fetchone()
+        return self._from_row(row) if row else None
+
+    def query(
+        self,
+        voice: Optional[str] = None,
+        language: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        if voice:
+            clauses.append("voice = ?")
+            params.append(voice)
+        if language:
+            clauses.append("language = ?")
+            params.append(language)
+        if since:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("created_at < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM entries {where} ORDER BY created_at DESC LIMIT ?", params
+            ).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def record_access(self, accesses: Dict[str, Tuple[float, int, Optional[str]]]) -> None:
+        if not accesses:
+            return
+        rows = [
+            (last_access, hits, cache_type, hash_key)
+            for hash_key, (last_access, hits, cache_type) in accesses.items()
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """
+                UPDATE entries SET
+                    last_access = MAX(COALESCE(last_access, 0), ?),
+                    access_count = COALESCE(access_count, 0) + ?,
+                    cache_type = COALESCE(?, cache_type)
+                WHERE hash = ?
+                """,
+                rows
+            )
+
+    def ensure_entries(self, rows: Iterable[Tuple[str, int, float]]) -> int:
+        rows = list(rows)
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO entries (hash, size, last_access, access_count, cache_type) "
+                f"VALUES (?, ?, ?, 0, '{DEFAULT_CACHE_TYPE}')",
+                rows
+            )
+            return self._conn.total_changes - before
+
+    def eviction_candidates(
+        self,
+        policy: str,
+        protected_types: Sequence[str],
+        limit: int
+    ) -> List[Tuple[str, int, float, Optional[str], Optional[str]]]:
+        order = {
+            "lru": "last_access ASC",
+            "lfu": "access_count ASC, last_access ASC",
+        }[policy]
+        placeholders = ",".join("?" * len(protected_types)) or "''"
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT hash, COALESCE(size, 0) AS size, COALESCE(last_access, 0) AS last_access,
+                       voice, language
+                FROM entries
+                WHERE COALESCE(cache_type, '{DEFAULT_CACHE_TYPE}') NOT IN ({placeholders})
+                ORDER BY {order}
+                LIMIT ?
+                """,
+                (*protected_types, limit)
+            ).fetchall()
+        return [
+            (row["hash"], row["size"], row["last_access"], row["voice"], row["language"])
+            for row in rows
+        ]
+
+    def delete(self, hash_keys: Sequence[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM entries WHERE hash = ?", [(h,) for h in hash_keys])
+
+    def find_by_digest(self, digest: str, limit: int = 8) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT hash FROM entries WHERE digest = ? LIMIT ?", (digest, limit)
+            ).fetchall()
+        return [row["hash"] for row in rows]
+
+    def set_digests(self, rows: Iterable[Tuple[str, str]]) -> None:
+        rows = [(digest, hash_key) for hash_key, digest in rows]
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE entries SET digest = ? WHERE hash = ?", rows)
+
+    def iter_labels(self):
+        # 独立游标分批读取，避免一次性加载百万级条目
+        cursor = self._conn.cursor()
+        with self._lock:
+            cursor.execute("SELECT hash, voice, language FROM entries")
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                yield row["hash"], row["voice"], row["language"]
+
+    def load_counters(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT name, value FROM counters").fetchall()
+        return {row["name"]: row["value"] for row in rows}
+
+    def add_counters(self, deltas: Dict[str, int]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                list(deltas.items())
+            )
+
+    def replace_counters(self, values: Dict[str, int], names: Sequence[str]) -> None:
+        with self._lock, self._conn:
+            for name in names:
+                self._conn.execute(
+                    "DELETE FROM counters WHERE name = ? OR name LIKE ?", (name, f"{name}:%")
+                )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
+                list(values.items())
+            )
+
+    def import_json(self, json_path: Path) -> int:
+        """
+        一次性导入旧版 metadata.json
+
+        已存在的 Hash 以 SQLite 中的记录为准 (INSERT OR IGNORE)，可重复执行
+        """
+        legacy = JsonMetadataStore(json_path)._load()
+        rows = [self._to_row(hash_key, item) for hash_key, item in legacy.items()]
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO entries "
+                "(hash, text, voice, language, speed, created_at, cache_type, size, digest, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, 'temporary'), ?, ?, ?)",
+                rows
+            )
+        imported = cursor.rowcount
+        logger.info("metadata_json_imported", path=str(json_path), entries=imported)
+        return imported
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_metadata_store(backend: str, cache_dir: Path) -> MetadataStore:
+    """按配置创建元数据后端；sqlite 首次启动时自动导入并归档旧 metadata.json"""
+    json_path = cache_dir / "metadata.json"
+
+    if backend == "json":
+        return JsonMetadataStore(json_path)
+    if backend != "sqlite":
+        raise ValueError(f"Unknown metadata backend: {backend}")
+
+    store = SQLiteMetadataStore(cache_dir / "metadata.db")
+    if json_path.exists():
+        store.import_json(json_path)
+        try:
+            json_path.rename(json_path.with_suffix(".json.imported"))
+        except FileNotFoundError:
+            # 其他 worker 已完成归档
+            pass
+    return store
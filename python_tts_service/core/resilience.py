@@ -0,0 +1,303 @@
+"""
+TTS 上游调用的容错层 (重试 / 熔断 / 对冲)
+
+DashScope 抖动时逐请求直接 500 会把偶发错误暴露给用户；真正宕机时无节制的重试又会放大流量。
+包装每个 TTS 提供方 (services/provider.py，由 services/router.py 组合):
+
+- 重试: 429 / 5xx / 超时 (按异常的 status_code 判断) 最多 TTS_RETRY_ATTEMPTS 次尝试，
+  间隔为指数退避的 full jitter；流式合成只在第一个分片之前重试 (已输出的音频无法撤回)
+- 熔断: 连续 TTS_BREAKER_FAILURES 次可重试错误后打开，TTS_BREAKER_COOLDOWN 秒内直接失败
+  (503 + Retry-After，缓存命中不经过上游，服务退化为只读缓存)；冷却后放行一个探测请求，
+  成功则关闭，失败重新打开。熔断打开后不再重试
+- 对冲 (TTS_HEDGE，默认关闭): 首个分片超过近期首包延迟的 p95 仍未到达时再发一次相同请求，
+  先拿到首个分片的一方胜出，另一方取消。对冲请求会多一次 DashScope 计费
+"""
+import math
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import structlog
+
+from .config import config
+
+logger = structlog.get_logger()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """熔断打开，未调用上游"""
+
+    status_code = 503
+
+    def __init__(self, retry_after: int):
+        super().__init__("TTS provider unavailable (circuit open)")
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    """429 / 5xx / 超时可重试；参数错误 (4xx) 与取消不重试"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code == 429 or (status_code is not None and status_code >= 500)
+
+
+class CircuitBreaker:
+    """连续失败计数熔断器 (须在事件循环线程使用)"""
+
+    def __init__(self, failure_threshold: int = None, cooldown: float = None):
+        self.failure_threshold = failure_threshold or config.TTS_BREAKER_FAILURES
+        self.cooldown = config.TTS_BREAKER_COOLDOWN if cooldown is None else cooldown
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def retry_after(self) -> int:
+        if self.state != OPEN:
+            return 1
+        return max(math.ceil(self.cooldown - (time.monotonic() - self._opened_at)), 1)
+
+    def before_call(self) -> bool:
+        """
+        调用上游之前检查，返回本次是否为半开状态的探测请求
+
+        Raises:
+            CircuitOpenError: 熔断打开 (或半开状态已有探测请求进行中)
+        """
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+            self.rejected += 1
+            raise CircuitOpenError(self.retry_after())
+        if self.state == HALF_OPEN:
+            self._probing = True
+            return True
+        return False
+
+    def on_result(self, ok: Optional[bool], probe: bool = False) -> None:
+        """记录调用结果: True 上游正常响应 / False 可重试错误 / None 未得出结论 (取消)"""
+        if probe:
+            self._probing = False
+        if ok is None:
+            return
+        if ok:
+            if self.state != CLOSED:
+                logger.info("tts_circuit_closed")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.state != OPEN and (probe or self.consecutive_failures >= self.failure_threshold):
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self.opened += 1
+            logger.warning(
+                "tts_circuit_opened",
+                consecutive_failures=self.consecutive_failures,
+                cooldown=self.cooldown
+            )
+
+
+class LatencyTracker:
+    """最近若干次首包延迟，用于计算对冲阈值"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """样本不足时返回 None"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+async def anext_or_none(stream: AsyncIterator[Any]) -> Optional[Any]:
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class ResilientTTSService:
+    """为 TTS 客户端的 asynthesize 增加重试与熔断"""
+
+    def __init__(
+        self,
+        inner,
+        attempts: int = None,
+        base_delay: float = None,
+        max_delay: float = None,
+        breaker: CircuitBreaker = None,
+        hedge: bool = None,
+        hedge_quantile: float = None,
+        hedge_min_delay: float = None
+    ):
+        self.inner = inner
+        self.attempts = max(attempts or config.TTS_RETRY_ATTEMPTS, 1)
+        self.base_delay = config.TTS_RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = config.TTS_RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = config.TTS_HEDGE if hedge is None else hedge
+        self.hedge_quantile = hedge_quantile or config.TTS_HEDGE_QUANTILE
+        self.hedge_min_delay = config.TTS_HEDGE_MIN_DELAY if hedge_min_delay is None else hedge_min_delay
+        self.ttfb = LatencyTracker()
+
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    @property
+    def name(self) -> str:
+        return self.inner.name
+
+    async def _call(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """带熔断检查与抖动退避重试地执行一次上游调用"""
+        self.calls += 1
+        for attempt in range(1, self.attempts + 1):
+            probe = self.breaker.before_call()
+            try:
+                result = await factory()
+            except Exception as e:
+                retryable = is_retryable(e)
+                # 非可重试错误说明上游有响应，不计为熔断失败
+                self.breaker.on_result(not retryable, probe)
+                if not retryable or attempt == self.attempts or self.breaker.is_open:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                self.retries += 1
+                logger.warning("tts_retry", attempt=attempt, delay=round(delay, 3), error=str(e))
+                await asyncio.sleep(delay)
+            except BaseException:
+                self.breaker.on_result(None, probe)
+                raise
+            else:
+                self.breaker.on_result(True, probe)
+                return result
+
+    async def asynthesize(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US",
+        speed: float = 1.0
+    ) -> bytes:
+        return await self._call(lambda: self.inner.asynthesize(text, voice, language, speed))
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        p95 = self.ttfb.quantile(0.95)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "ttfb_p95_seconds": round(p95, 4) if p95 is not None else None,
+            "circuit": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.consecutive_failures,
+                "opened": self.breaker.opened,
+                "rejected": self.breaker.rejected,
+            },
+        }
+
+
+class ResilientStreamingTTSService(ResilientTTSService):
+    """流式客户端: astream 在第一个分片之前重试，并可对冲"""
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p95 = self.ttfb.quantile(self.hedge_quantile)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    async def _open_stream(self, text: str, voice: str, language: str) -> Tuple[Optional[str], AsyncIterator[str]]:
+        """打开上游流并等到第一个分片，返回 (第一个分片, 后续分片的迭代器)"""
+        started = time.monotonic()
+        primary = self.inner.astream(text, voice, language)
+        delay = self._hedge_delay()
+        if delay is None:
+            first = await anext_or_none(primary)
+            self.ttfb.add(time.monotonic() - started)
+            return first, primary
+
+        pending: Dict[asyncio.Task, AsyncIterator[str]] = {
+            asyncio.ensure_future(anext_or_none(primary)): primary
+        }
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            secondary = self.inner.astream(text, voice, language)
+            pending[asyncio.ensure_future(anext_or_none(secondary))] = secondary
+            self.hedges += 1
+            logger.info("tts_hedge_started", delay=round(delay, 3))
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stream = pending.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if stream is not primary:
+                        self.hedges_won += 1
+                    self.ttfb.add(time.monotonic() - started)
+                    return task.result(), stream
+            raise error
+        finally:
+            # 败者 (或调用方取消时的全部请求) 立即取消并关闭连接
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for stream in pending.values():
+                await stream.aclose()
+
+    async def astream(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US"
+    ) -> AsyncIterator[str]:
+        first, stream = await self._call(lambda: self._open_stream(text, voice, language))
+        try:
+            if first is not None:
+                yield first
+            async for data in stream:
+                yield data
+        except Exception as e:
+            # 输出开始后的失败不再重试，但仍计入熔断
+            if is_retryable(e):
+                self.breaker.on_result(False)
+            raise
+        finally:
+            await stream.aclose()
+
+
+def with_resilience(inner) -> ResilientTTSService:
+    """按客户端是否支持流式选择包装类"""
+    if hasattr(inner, "astream"):
+        return ResilientStreamingTTSService(inner)
+    return ResilientTTSService(inner)
@@ -0,0 +1,150 @@
+"""
+Single-flight 请求合并
+
+课程页加载时 lib/tts/preload.ts 与多个客户端常常同时请求相同的 (text, voice, language, speed)。
+缓存未命中在任何人写入文件之前就已判定，于是每个调用方都会各自调用一次 DashScope。
+
+按 Hash 维护进行中的合成 (Flight):
+- 第一个请求成为 leader 执行合成，其余请求 (follower) 等待同一结果或同一异常
+- leader 可逐片发布流式数据 (WebSocket)，follower 先回放已发布的分片，再实时接收后续分片
+- do() 中的合成在独立 Task 中运行，leader 断开 (取消) 不会中断 follower 等待的合成
+- Flight 记录订阅者数 (stream / wait)，最后一个订阅者离开时调用 on_idle (如取消只为该连接进行的合成)
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import structlog
+
+logger = structlog.get_logger()
+
+_DONE = object()
+
+
+class Flight:
+    """一次进行中的合成"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.chunks: List[Any] = []
+        self._queues: Set[asyncio.Queue] = set()
+        self.subscribers = 0
+        # 未完成时订阅者归零的回调 (默认 None: 无人等待也继续合成并写入缓存)
+        self.on_idle: Optional[Callable[[], None]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    def publish(self, chunk: Any) -> None:
+        """发布一个流式分片 (须在事件循环线程调用)"""
+        self.chunks.append(chunk)
+        for queue in self._queues:
+            queue.put_nowait(chunk)
+
+    def _settle(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+            # 没有 follower 时避免 "exception was never retrieved" 告警
+            self.future.exception()
+        else:
+            self.future.set_result(result)
+        for queue in self._queues:
+            queue.put_nowait(_DONE)
+
+    def _detach(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self.on_idle is not None:
+            self.on_idle()
+
+    async def wait(self) -> Any:
+        """等待结果 (计为订阅者；等待方被取消不影响合成本身)"""
+        self.subscribers += 1
+        try:
+            return await asyncio.shield(self.future)
+        finally:
+            self._detach()
+
+    async def stream(self) -> AsyncIterator[Any]:
+        """订阅分片: 先回放已发布的分片，结束时如 leader 失败则抛出同一异常"""
+        self.subscribers += 1
+        queue: asyncio.Queue = asyncio.Queue()
+        for chunk in self.chunks:
+            queue.put_nowait(chunk)
+        if self.done:
+            queue.put_nowait(_DONE)
+        else:
+            self._queues.add(queue)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is _DONE:
+                    break
+                yield chunk
+        finally:
+            self._queues.discard(queue)
+            self._detach()
+        error = self.future.exception()
+        if error is not None:
+            raise error
+
+
+class SingleFlight:
+    """按 Key 合并并发的相同请求"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """加入 (或发起) Key 对应的 Flight，返回 (flight, 是否为 leader)"""
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            logger.info("request_coalesced", key=key, chunks_replayed=len(flight.chunks))
+            return flight, False
+        flight = Flight(key)
+        self._flights[key] = flight
+        self.leaders += 1
+        return flight, True
+
+    def finish(
+        self,
+        flight: Flight,
+        result: Any = None,
+        error: Optional[BaseException] = None
+    ) -> None:
+        """leader 结束 Flight: 唤醒全部 follower 并从登记表移除"""
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        flight._settle(result, error)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行 fn 或等待进行中的同 Key 调用
+
+        Returns:
+            (结果, 是否为合并的 follower)；fn 抛出的异常会传递给所有等待者
+        """
+        flight, leader = self.join(key)
+        if leader:
+            task = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda t: self.finish(
+                flight,
+                result=None if t.cancelled() or t.exception() else t.result(),
+                error=RuntimeError("synthesis cancelled") if t.cancelled() else t.exception()
+            ))
+        return await flight.wait(), not leader
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,125 @@
+"""
+流式输出延迟统计
+
+记录每个流的首包延迟 (请求 → 第一个音频分片发出) 与相邻分片的间隔，
+以 Prometheus 直方图输出；间隔的长尾即客户端播放卡顿的来源。
+分段合成的流另外记录段间空档 (上一段最后一个分片 → 下一段第一个分片)，用于检验预取是否足够。
+"""
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def lines(self, name: str) -> List[str]:
+        lines = [f'{name}_bucket{{le="{bound}"}} {count}' for bound, count in zip(self.buckets, self.counts)]
+        lines += [
+            f'{name}_bucket{{le="+Inf"}} {self.count}',
+            f"{name}_sum {self.sum:.6f}",
+            f"{name}_count {self.count}",
+        ]
+        return lines
+
+
+class StreamTimer:
+    """单个流的计时 (start 之后每发出一个分片调用 chunk)"""
+
+    def __init__(self, latency: "StreamLatency"):
+        self._latency = latency
+        self.started = time.monotonic()
+        self._last: Optional[float] = None
+        self.chunks = 0
+        self.first_chunk: Optional[float] = None
+        self.max_gap = 0.0
+        self.max_segment_gap = 0.0
+
+    def chunk(self, new_segment: bool = False) -> None:
+        """new_segment: 该分片是新一段的第一个分片"""
+        now = time.monotonic()
+        if self._last is None:
+            self.first_chunk = now - self.started
+            self._latency.first_chunk.observe(self.first_chunk)
+        else:
+            gap = now - self._last
+            self.max_gap = max(self.max_gap, gap)
+            self._latency.gap.observe(gap)
+            if new_segment:
+                self.max_segment_gap = max(self.max_segment_gap, gap)
+                self._latency.segment_gap.observe(gap)
+        self._last = now
+        self.chunks += 1
+
+    def summary(self) -> Dict[str, Any]:
+        """用于日志: 分片数 / 首包延迟 / 最大间隔 / 最大段间空档 (毫秒)"""
+        return {
+            "chunks": self.chunks,
+            "ttfb_ms": round(self.first_chunk * 1000, 1) if self.first_chunk is not None else None,
+            "max_gap_ms": round(self.max_gap * 1000, 1),
+            "max_segment_gap_ms": round(self.max_segment_gap * 1000, 1),
+        }
+
+
+class StreamLatency:
+    """一类流式输出的首包延迟与分片间隔直方图"""
+
+    def __init__(self, prefix: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.prefix = prefix
+        self.first_chunk = _Histogram(buckets)
+        self.gap = _Histogram(buckets)
+        self.segment_gap = _Histogram(buckets)
+
+    def start(self) -> StreamTimer:
+        return StreamTimer(self)
+
+    def get_stats(self) -> Dict[str, Any]:
+        def summary(histogram: _Histogram) -> Dict[str, Any]:
+            return {
+                "count": histogram.count,
+                "avg_ms": round(histogram.sum / histogram.count * 1000, 2) if histogram.count else 0.0,
+                "max_ms": round(histogram.max * 1000, 2),
+            }
+
+        return {
+            "first_chunk": summary(self.first_chunk),
+            "chunk_gap": summary(self.gap),
+            "segment_gap": summary(self.segment_gap),
+        }
+
+    def metric_lines(self) -> List[str]:
+        """Prometheus 文本格式的指标"""
+        lines = [
+            f"# HELP {self.prefix}_first_chunk_seconds Time from request to the first audio chunk sent.",
+            f"# TYPE {self.prefix}_first_chunk_seconds histogram",
+        ]
+        lines += self.first_chunk.lines(f"{self.prefix}_first_chunk_seconds")
+        lines += [
+            f"# HELP {self.prefix}_chunk_gap_seconds Time between consecutive audio chunks sent.",
+            f"# TYPE {self.prefix}_chunk_gap_seconds histogram",
+        ]
+        lines += self.gap.lines(f"{self.prefix}_chunk_gap_seconds")
+        lines += [
+            f"# HELP {self.prefix}_segment_gap_seconds Time between the last chunk of a text segment and the first chunk of the next.",
+            f"# TYPE {self.prefix}_segment_gap_seconds histogram",
+        ]
+        lines += self.segment_gap.lines(f"{self.prefix}_segment_gap_seconds")
+        return lines
+
+
+# WebSocket 流 (/ws/tts)
+ws_latency = StreamLatency("tts_ws")
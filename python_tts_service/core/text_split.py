@@ -0,0 +1,75 @@
+"""
+长文本分句
+
+长文本按句切分后逐句合成、缓存 (services/synthesis.py)，不同段落中的相同句子复用同一份缓存。
+- 英文句末 . ! ? (后接空白或结尾，可带引号 / 括号)，常见缩写 (Mr. / e.g. 等) 不断句
+- 中文句末 。！？ (无需空白)
+- 超过 max_length 的句子依次在逗号 / 分号 / 冒号、空白处切开，仍超长时硬切
+"""
+import re
+from typing import List
+
+_SENTENCE_END = re.compile(r'[.!?]+["\'”’)\]]*(?=\s|$)|[。！？]+[”’」』）]*')
+_CLAUSE = re.compile(r'.*?(?:[,;:，；：、]+\s*|$)', re.S)
+_WORD = re.compile(r'\S+\s*')
+
+_ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e", "fig",
+}
+
+
+def _is_abbreviation(text: str, end: int) -> bool:
+    """text[end] 是句点时，判断其前面的单词是否为缩写"""
+    word = text[:end].rsplit(None, 1)[-1] if text[:end].strip() else ""
+    return word.lower().lstrip("(\"'") in _ABBREVIATIONS
+
+
+def _pack(parts: List[str], max_length: int) -> List[str]:
+    """把相邻片段 (带原有空白) 合并为不超过 max_length 的块"""
+    chunks: List[str] = []
+    current = ""
+    for part in parts:
+        if current and len((current + part).strip()) > max_length:
+            chunks.append(current.strip())
+            current = ""
+        current += part
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks
+
+
+def _split_long(sentence: str, max_length: int) -> List[str]:
+    if len(sentence) <= max_length:
+        return [sentence]
+    chunks = []
+    for chunk in _pack(_CLAUSE.findall(sentence), max_length):
+        if len(chunk) <= max_length:
+            chunks.append(chunk)
+            continue
+        for piece in _pack(_WORD.findall(chunk), max_length):
+            chunks.extend(piece[i:i + max_length] for i in range(0, len(piece), max_length))
+    return chunks
+
+
+def split_sentences(text: str, max_length: int) -> List[str]:
+    """
+    按句切分文本 (顺序不变，去掉首尾空白)
+
+    Returns:
+        句子列表，每项不超过 max_length 个字符
+    """
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        if text[match.start()] == "." and match.end() - match.start() == 1 and _is_abbreviation(text, match.start()):
+            continue
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    sentences.append(text[start:])
+
+    result = []
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if sentence:
+            result.extend(_split_long(sentence, max_length))
+    return result
@@ -0,0 +1,67 @@
+"""
+阻塞迭代器 → 异步迭代器 (线程到事件循环的桥)
+
+官方 SDK 的流式调用是阻塞迭代器，只能在线程中读取。生产者线程每读到一项即经
+loop.call_soon_threadsafe 放入 asyncio.Queue，消费者直接 await 队列:
+- 无轮询: 分片到达后下一轮事件循环即可发出，不额外占用读取队列的线程
+- 消费者提前结束 (客户端断开 / 取消) 时设置停止标志，生产者在下一项之前退出并关闭迭代器
+"""
+import asyncio
+import threading
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+async def iterate_in_thread(
+    factory: Callable[[], Iterator[T]],
+    executor: Optional[Executor] = None
+) -> AsyncIterator[T]:
+    """
+    在线程池中运行 factory() 返回的阻塞迭代器，逐项异步产出
+
+    Raises (迭代时):
+        迭代器抛出的异常 (原样转交)
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def emit(item, error: Optional[BaseException] = None) -> None:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:
+            # 事件循环已关闭
+            stop.set()
+
+    def produce() -> None:
+        try:
+            iterator = factory()
+            try:
+                for item in iterator:
+                    if stop.is_set():
+                        break
+                    emit(item)
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+        except BaseException as e:
+            emit(_DONE, e)
+        else:
+            emit(_DONE)
+
+    loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
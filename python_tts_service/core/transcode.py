@@ -0,0 +1,182 @@
+"""
+压缩音频变体与格式协商
+
+缓存的主格式是 24kHz 16-bit PCM WAV (约 48 KB/s)，对移动端 (含 ios/ 应用) 过大。
+同一 Hash 可额外保存压缩变体，与主文件放在同一目录:
+
+    ab/cd/<hash>.wav   主文件 (索引 / 淘汰 / 去重以它为准)
+    ab/cd/<hash>.opus  Ogg Opus 32 kbps
+    ab/cd/<hash>.mp3   MP3 64 kbps
+    ab/cd/<hash>.m4a   AAC 64 kbps
+
+- 转码使用 pydub + ffmpeg，在独立进程池中执行，不占用事件循环与 GIL
+- 变体默认在首次请求时生成 (lazy)，AUDIO_VARIANTS_ON_WRITE 可配置写入时预生成
+- 客户端通过 TTSRequest.format 或 Accept 头选择格式；ffmpeg 不可用时回退为 wav
+
+time_stretch: 由 1.0× 主文件本地生成其他语速 (ffmpeg atempo，变速不变调)，见 services/synthesis.py
+"""
+import io
+import wave
+import shutil
+import asyncio
+import subprocess
+import multiprocessing
+from functools import cached_property
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, NamedTuple, Optional
+
+import structlog
+
+from .config import config
+
+logger = structlog.get_logger()
+
+
+class AudioVariant(NamedTuple):
+    """音频格式: 文件扩展名 / Content-Type / pydub export 参数"""
+    ext: str
+    media_type: str
+    export: Optional[Dict[str, Any]] = None
+
+
+AUDIO_VARIANTS: Dict[str, AudioVariant] = {
+    "wav": AudioVariant("wav", "audio/wav"),
+    "opus": AudioVariant("opus", "audio/ogg", {"format": "ogg", "codec": "libopus", "bitrate": "32k"}),
+    "mp3": AudioVariant("mp3", "audio/mpeg", {"format": "mp3", "codec": "libmp3lame", "bitrate": "64k"}),
+    "aac": AudioVariant("m4a", "audio/mp4", {"format": "ipod", "codec": "aac", "bitrate": "64k"}),
+}
+
+# Accept 头中的媒体类型 → 格式
+_MEDIA_TYPE_FORMATS = {
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/mp4": "aac",
+    "audio/aac": "aac",
+    "audio/x-m4a": "aac",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+}
+
+
+def transcoding_available() -> bool:
+    """ffmpeg 是否可用 (Docker 镜像中已安装；本地开发环境可能没有)"""
+    return shutil.which("ffmpeg") is not None
+
+
+def negotiate_format(accept: Optional[str]) -> Optional[str]:
+    """
+    按 Accept 头选择音频格式
+
+    只考虑明确列出的音频类型，按 q 值从高到低取第一个已支持的格式；
+    没有音频类型 (如 application/json、*/*) 时返回 None，由调用方使用默认格式
+    """
+    if not accept:
+        return None
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        fmt = _MEDIA_TYPE_FORMATS.get(media_type.lower())
+        if fmt is None:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            candidates.append((-quality, position, fmt))
+    return min(candidates)[2] if candidates else None
+
+
+def transcode(wav_data: bytes, fmt: str) -> bytes:
+    """WAV → 指定格式 (同步，在进程池中执行)"""
+    # 延迟导入: pydub 导入时会探测 ffmpeg，主进程不需要
+    from pydub import AudioSegment
+
+    variant = AUDIO_VARIANTS[fmt]
+    segment = AudioSegment.from_file(io.BytesIO(wav_data), format="wav")
+    output = io.BytesIO()
+    segment.export(output, **variant.export)
+    return output.getvalue()
+
+
+def decode(data: bytes, fmt: str, sample_rate: int, channels: int, sample_width: int) -> bytes:
+    """压缩音频 → 指定参数的 PCM WAV (同步，在进程池中执行；用于不直接输出 PCM 的提供方)"""
+    from pydub import AudioSegment
+
+    segment = AudioSegment.from_file(io.BytesIO(data), format=fmt)
+    segment = segment.set_frame_rate(sample_rate).set_channels(channels).set_sample_width(sample_width)
+    output = io.BytesIO()
+    segment.export(output, format="wav")
+    return output.getvalue()
+
+
+def time_stretch(wav_data: bytes, speed: float) -> bytes:
+    """WAV 变速不变调 (ffmpeg atempo，同步，在进程池中执行)，输出与输入的采样参数相同"""
+    with wave.open(io.BytesIO(wav_data), "rb") as wav_file:
+        channels, sample_width, sample_rate = (
+            wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate()
+        )
+    if sample_width != 2:
+        raise ValueError(f"Unsupported sample width: {sample_width}")
+    # 输出裸 PCM: 写到管道的 WAV 头无法回填长度
+    result = subprocess.run(
+        [
+            "ffmpeg", "-v", "error", "-f", "wav", "-i", "pipe:0",
+            "-filter:a", f"atempo={speed}",
+            "-f", "s16le", "-ac", str(channels), "-ar", str(sample_rate), "pipe:1"
+        ],
+        input=wav_data,
+        capture_output=True,
+        check=True
+    )
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(result.stdout)
+    return output.getvalue()
+
+
+class Transcoder:
+    """转码进程池 (首次使用时创建)"""
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or config.TRANSCODE_WORKERS
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @cached_property
+    def available(self) -> bool:
+        # 首次访问时查找一次 ffmpeg，之后每次写入 / 请求不再扫描 PATH
+        return self.max_workers > 0 and transcoding_available()
+
+    async def _run(self, func, *args) -> bytes:
+        if self._executor is None:
+            # spawn: 避免在多线程的服务进程中 fork (Windows 也只支持 spawn)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def transcode(self, wav_data: bytes, fmt: str) -> bytes:
+        return await self._run(transcode, wav_data, fmt)
+
+    async def decode(self, data: bytes, fmt: str, sample_rate: int, channels: int, sample_width: int) -> bytes:
+        return await self._run(decode, data, fmt, sample_rate, channels, sample_width)
+
+    async def time_stretch(self, wav_data: bytes, speed: float) -> bytes:
+        return await self._run(time_stretch, wav_data, speed)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,52 @@
+"""
+音频缓存内容去重脚本 (One-off Dedupe Pass)
+==========================================
+
+功能:
+    扫描 CACHE_DIR 下所有 <hash>.wav / <hash>.mp3，字节完全相同的文件改为硬链接到同一份数据，
+    并把内容摘要回填到元数据，此后 TTS 服务的新写入会自动与这些文件去重。
+    服务可保持运行: 每个文件都通过 "链接到临时名 + os.replace" 原子替换。
+
+使用方法:
+    cd python_tts_service
+    # 只统计可回收空间，不修改文件
+    python dedupe_cache.py --dry-run
+
+    # 执行去重
+    python dedupe_cache.py
+
+注意:
+    1. 需要 CACHE_DIR 所在文件系统支持硬链接 (不支持时对应文件保持原样)
+    2. 运行中的服务在下次索引对账 (CACHE_INDEX_RECONCILE_INTERVAL) 后才会反映新的磁盘占用
+"""
+import argparse
+import sys
+from pathlib import Path
+
+from core.cache_dedup import CacheDeduplicator
+from core.config import config
+from core.metadata_store import create_metadata_store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Opus TTS cache deduplicator")
+    parser.add_argument("--cache-dir", type=str, default=str(config.CACHE_DIR), help="音频缓存目录。")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不修改文件与元数据。")
+
+    args = parser.parse_args()
+
+    cache_dir = Path(args.cache_dir)
+    if not cache_dir.exists():
+        sys.exit(f"Cache dir not found: {cache_dir}")
+
+    store = create_metadata_store(config.METADATA_BACKEND, cache_dir)
+    try:
+        report = CacheDeduplicator(cache_dir, store=store, dry_run=args.dry_run).run()
+    finally:
+        store.close()
+
+    action = "Would reclaim" if args.dry_run else "Reclaimed"
+    print(
+        f"✅ Scanned {report['scanned_files']} files, linked {report['linked_files']}; "
+        f"{action} {report['reclaimed_bytes'] / (1024 * 1024):.2f} MB"
+    )
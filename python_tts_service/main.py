@@ -17,7 +17,9 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from api.routes import router as tts_router
 from api.websocket import ws_router
+from core.cache import cache_manager
 from core.config import config
+from services.router import tts_service
 
 # 配置结构化日志
 structlog.configure(
@@ -62,14 +64,14 @@ async def startup_event():
     # 验证配置
     try:
         config.validate()
-        # 初始化并发控制 Semaphore (避免 Windows 事件循环绑定问题)
-        import asyncio
-        app.state.semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_REQUESTS)
         logger.info("config_validated", cache_dir=str(config.CACHE_DIR))
     except Exception as e:
         logger.error("config_validation_failed", error=str(e))
         raise
     
+    # 加载缓存索引，启动后台对账 / 布局迁移
+    await cache_manager.start()
+    
     logger.info("tts_service_started", status="ready")
 
 
@@ -77,6 +79,10 @@ async def startup_event():
 async def shutdown_event():
     """应用关闭时的清理"""
     logger.info("tts_service_shutting_down")
+    
+    await cache_manager.stop()
+    cache_manager.close()
+    await tts_service.aclose()
 
 
 @app.get("/", tags=["Root"])
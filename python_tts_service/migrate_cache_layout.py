@@ -0,0 +1,48 @@
+"""
+音频缓存目录布局迁移脚本 (Flat → Sharded)
+==========================================
+
+功能:
+    将 CACHE_DIR 根目录下扁平存放的 <hash>.wav / <hash>.mp3 分批移动到
+    分片目录 ab/cd/<hash>.wav。服务可保持运行: 读路径同时兼容两种布局。
+
+使用方法:
+    cd python_tts_service
+    # 默认读取 CACHE_SHARD_DEPTH / CACHE_SHARD_WIDTH 环境变量
+    python migrate_cache_layout.py --depth 2 --width 2 --batch-size 500 --pause 0.5
+
+    # 只跑 10 批 (试运行)
+    python migrate_cache_layout.py --depth 2 --max-batches 10
+
+注意:
+    1. 迁移前请先以相同的 CACHE_SHARD_DEPTH 重启 TTS 服务，确保新写入直接落在分片目录
+    2. nginx 与 Next.js 已配置旧扁平 URL → 分片路径的回退规则 (仅支持 depth=2, width=2)
+"""
+import argparse
+import sys
+from pathlib import Path
+
+from core.cache_layout import CacheLayout, CacheLayoutMigrator
+from core.config import config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Opus TTS cache layout migrator (flat → sharded)")
+    parser.add_argument("--cache-dir", type=str, default=str(config.CACHE_DIR), help="音频缓存目录。")
+    parser.add_argument("--depth", type=int, default=config.CACHE_SHARD_DEPTH or 2, help="分片层数 (默认 2)。")
+    parser.add_argument("--width", type=int, default=config.CACHE_SHARD_WIDTH, help="每层目录名字符数 (默认 2)。")
+    parser.add_argument("--batch-size", type=int, default=config.CACHE_MIGRATE_BATCH_SIZE, help="每批移动文件数。")
+    parser.add_argument("--pause", type=float, default=config.CACHE_MIGRATE_PAUSE, help="批间休眠秒数。")
+    parser.add_argument("--max-batches", type=int, default=None, help="最多执行批数 (默认跑完)。")
+
+    args = parser.parse_args()
+
+    cache_dir = Path(args.cache_dir)
+    if not cache_dir.exists():
+        sys.exit(f"Cache dir not found: {cache_dir}")
+
+    layout = CacheLayout(cache_dir, depth=args.depth, width=args.width)
+    migrator = CacheLayoutMigrator(layout, batch_size=args.batch_size, pause=args.pause)
+    moved = migrator.run(max_batches=args.max_batches)
+
+    print(f"✅ Migrated {moved} files ({migrator.skipped} stale flat copies removed)")
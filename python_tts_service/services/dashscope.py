@@ -1,25 +1,136 @@
 """
 阿里云 DashScope TTS 服务
+
+两种客户端，由 TTS_CLIENT 选择:
+- async (默认): AsyncDashScopeTTSService，基于 httpx 连接池 (keep-alive 复用) 直接请求 HTTP 接口，
+  增量解析 SSE；并发合成不占用线程
+- sync: DashScopeTTSService，官方 SDK 的阻塞调用，在默认线程池中执行 (每个进行中的合成占用一个线程)；
+  流式分片经线程桥 (core/thread_bridge.py) 无轮询地转交事件循环
 """
 import io
+import json
+import wave
+import struct
 import base64
-from typing import Optional
+import asyncio
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
 
+import httpx
 import structlog
 import dashscope
 
 from core.config import config
+from core.thread_bridge import iterate_in_thread
+from services.provider import TTSProvider, TTSProviderError
 
 logger = structlog.get_logger()
 
 
-class DashScopeError(Exception):
+class DashScopeError(TTSProviderError):
     """DashScope API 错误"""
     pass
 
 
-class DashScopeTTSService:
-    """阿里云 DashScope TTS 服务封装"""
+# 语言代码映射 (Standard Locale -> DashScope Format)
+LANGUAGE_MAP = {
+    "en-US": "English",
+    "en": "English",
+    "zh-CN": "Chinese",
+    "zh": "Chinese",
+    "ja-JP": "Japanese",
+    "ja": "Japanese",
+    "ko-KR": "Korean",
+    "ko": "Korean",
+    "fr-FR": "French",
+    "fr": "French",
+    "es-ES": "Spanish",
+    "es": "Spanish",
+}
+
+# DashScope 原生语言名 → 语言代码 (WebSocket 客户端传原生名，缓存 Key 与 HTTP 接口 / 前端统一用语言代码)
+LANGUAGE_CODES = {
+    "English": "en-US",
+    "Chinese": "zh-CN",
+    "Japanese": "ja-JP",
+    "Korean": "ko-KR",
+    "French": "fr-FR",
+    "Spanish": "es-ES",
+}
+
+
+# DashScope 返回的裸 PCM: 24kHz 16-bit 单声道
+PCM_CHANNELS = 1
+PCM_SAMPLE_WIDTH = 2
+PCM_SAMPLE_RATE = 24000
+
+# 流式响应时数据长度未知，RIFF / data 长度填最大值 (播放器读到流结束为止)
+STREAMING_WAV_SIZE = 0xFFFFFFFF
+
+
+def is_wav(data: bytes) -> bool:
+    return bytes(data[:4]) == b'RIFF' and bytes(data[8:12]) == b'WAVE'
+
+
+def wav_header(data_size: int = STREAMING_WAV_SIZE) -> bytes:
+    """裸 PCM 的 44 字节 WAV 头，与 wave 模块写出的相同"""
+    riff_size = STREAMING_WAV_SIZE if data_size == STREAMING_WAV_SIZE else 36 + data_size
+    block_align = PCM_CHANNELS * PCM_SAMPLE_WIDTH
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, PCM_CHANNELS, PCM_SAMPLE_RATE,
+        PCM_SAMPLE_RATE * block_align, block_align, PCM_SAMPLE_WIDTH * 8,
+        b"data", data_size
+    )
+
+
+def wav_to_pcm(wav_data: bytes) -> bytes:
+    """WAV → 裸 PCM (去掉文件头，用于按 PCM 流转发整段合成的结果)"""
+    with wave.open(io.BytesIO(wav_data), 'rb') as wav_file:
+        return wav_file.readframes(wav_file.getnframes())
+
+
+def to_wav(audio_buffer: bytes, text: str) -> bytes:
+    """
+    合成结果 → WAV
+
+    DashScope 某些模型流式返回的数据解码后已经是完整 WAV (带 RIFF 头)，直接返回；
+    否则为 24kHz 16-bit mono 裸 PCM，补 WAV 头。
+    """
+    if not audio_buffer:
+        raise DashScopeError("No audio data received from API")
+
+    if is_wav(audio_buffer):
+        final_audio = bytes(audio_buffer)
+        logger.info(
+            "tts_success",
+            audio_size_bytes=len(final_audio),
+            format="wav_passthrough",
+            text_preview=text[:50]
+        )
+        return final_audio
+
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, 'wb') as wav_file:
+        wav_file.setnchannels(PCM_CHANNELS)
+        wav_file.setsampwidth(PCM_SAMPLE_WIDTH)
+        wav_file.setframerate(PCM_SAMPLE_RATE)
+        wav_file.writeframes(bytes(audio_buffer))
+
+    final_audio = wav_buffer.getvalue()
+    logger.info(
+        "tts_success",
+        audio_size_bytes=len(final_audio),
+        format="pcm_wrapped",
+        text_preview=text[:50]
+    )
+    return final_audio
+
+
+class DashScopeTTSService(TTSProvider):
+    """阿里云 DashScope TTS 服务封装 (官方 SDK，同步阻塞)"""
+    
+    name = "dashscope"
     
     def __init__(self):
         if not config.OPENAI_API_KEY:
@@ -59,30 +170,30 @@ class DashScopeTTSService:
             speed=speed
         )
         
+        audio_buffer = bytearray()
+        for data in self.stream_chunks(text, voice, language):
+            try:
+                # 解码 Base64 音频数据
+                audio_buffer.extend(base64.b64decode(data))
+            except Exception as decode_err:
+                logger.error("tts_decode_error", error=str(decode_err))
+        return to_wav(audio_buffer, text)
+    
+    def stream_chunks(self, text: str, voice: str = "Cherry", language: str = "en-US") -> Iterator[str]:
+        """
+        流式调用 (阻塞)，逐片产出 base64 编码的音频
+        
+        Raises:
+            DashScopeError: API 调用失败
+        """
         try:
             # Direct passthrough - no mapping needed
             # Frontend now sends DashScope native voice names directly
             # Supported voices: Cherry, Serena, Ethan, Kai, Jennifer, Andre, etc.
             dashscope_voice = voice
             
-            # 语言代码映射 (Standard Locale -> DashScope Format)
-            language_map = {
-                "en-US": "English",
-                "en": "English",
-                "zh-CN": "Chinese",
-                "zh": "Chinese",
-                "ja-JP": "Japanese",
-                "ja": "Japanese",
-                "ko-KR": "Korean",
-                "ko": "Korean",
-                "fr-FR": "French",
-                "fr": "French",
-                "es-ES": "Spanish",
-                "es": "Spanish",
-            }
-            
             # 规范化语言参数
-            dashscope_language = language_map.get(language, language)
+            dashscope_language = LANGUAGE_MAP.get(language, language)
             
             # 使用 MultiModalConversation 调用 (针对 qwen3-tts-flash)
             # 参考: python_tts_service2/main.py
@@ -94,73 +205,221 @@ class DashScopeTTSService:
                 stream=True  # 启用流式输出
             )
             
-            audio_buffer = bytearray()
-            
-            # 遍历流式响应收集音频数据
+            # 遍历流式响应
             for chunk in response:
                 if chunk.status_code != 200:
                    error_msg = f"DashScope API error: {chunk.status_code} - {chunk.message}"
                    logger.error("tts_api_error", status=chunk.status_code, message=chunk.message)
-                   raise DashScopeError(error_msg)
+                   raise DashScopeError(error_msg, status_code=chunk.status_code)
 
                 if hasattr(chunk, 'output') and chunk.output:
                     audio_data_obj = chunk.output.get('audio')
                     if audio_data_obj and 'data' in audio_data_obj:
-                        try:
-                            # 解码 Base64 音频数据
-                            chunk_bytes = base64.b64decode(audio_data_obj['data'])
-                            audio_buffer.extend(chunk_bytes)
-                        except Exception as decode_err:
-                            logger.error("tts_decode_error", error=str(decode_err))
-                            
-            if not audio_buffer:
-                raise DashScopeError("No audio data received from API")
-            
-            # 检查 API 返回的数据是否已经包含了 WAV (RIFF) 头
-            # DashScope 的某些模型流式返回的数据解码后已经是完整的 WAV 格式
-            if bytes(audio_buffer[:4]) == b'RIFF' and bytes(audio_buffer[8:12]) == b'WAVE':
-                final_audio = bytes(audio_buffer)
-                logger.info(
-                    "tts_success",
-                    audio_size_bytes=len(final_audio),
-                    format="wav_passthrough",
-                    text_preview=text[:50]
-                )
-                return final_audio
-
-            # 将 bytearray 转为 bytes (这是原始 PCM 数据)
-            pcm_data = bytes(audio_buffer)
-            
-            # 添加 WAV 头 (DashScope 返回的是 24kHz, 16-bit mono PCM)
-            import wave
-            import io
-            
-            wav_buffer = io.BytesIO()
-            with wave.open(wav_buffer, 'wb') as wav_file:
-                wav_file.setnchannels(1)       # 单声道
-                wav_file.setsampwidth(2)       # 16-bit (2 bytes)
-                wav_file.setframerate(24000)   # 阿里云 TTS 采样率
-                wav_file.writeframes(pcm_data)
-            
-            final_audio = wav_buffer.getvalue()
-            
-            logger.info(
-                "tts_success",
-                audio_size_bytes=len(final_audio),
-                format="pcm_wrapped",
-                text_preview=text[:50]
+                        yield audio_data_obj['data']
+        
+        except Exception as e:
+            logger.error(
+                "tts_generation_failed",
+                error=str(e),
+                text=text[:100]
             )
-            
-            return final_audio
+            raise DashScopeError(f"TTS generation failed: {str(e)}", status_code=getattr(e, "status_code", None))
+    
+    def astream(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US"
+    ) -> AsyncIterator[str]:
+        """stream_chunks 在线程池中执行，分片经 call_soon_threadsafe 直接交给事件循环"""
+        return iterate_in_thread(lambda: self.stream_chunks(text, voice, language))
+    
+    async def asynthesize(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US",
+        speed: float = 1.0
+    ) -> bytes:
+        """在默认线程池中执行 synthesize (对照用的旧路径)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.synthesize, text, voice, language, speed)
+    
+    async def aclose(self) -> None:
+        pass
+
+
+class AsyncDashScopeTTSService(TTSProvider):
+    """
+    DashScope TTS 异步客户端 (HTTP + SSE)
+
+    与 SDK 的 MultiModalConversation.call(stream=True) 请求相同的接口:
+    POST {DASHSCOPE_HTTP_URL}/services/aigc/multimodal-generation/generation
+    - 连接池按事件循环创建，keep-alive 复用 TLS 连接
+    - 按行增量解析 SSE，音频分片到达即产出，不等待整段响应
+    """
+    
+    name = "dashscope"
+    PATH = "/services/aigc/multimodal-generation/generation"
+    
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        if not config.OPENAI_API_KEY:
+            raise ValueError("OPENAI_API_KEY is required for DashScope TTS")
+        
+        self.model = config.TTS_MODEL
+        self.url = config.DASHSCOPE_HTTP_URL.rstrip("/") + self.PATH
+        # 测试 / 基准可注入 transport
+        self._transport = transport
+        self._clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+    
+    def _client(self) -> httpx.AsyncClient:
+        """当前事件循环的连接池 (httpx 连接不能跨事件循环复用)"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            for stale in [other for other in self._clients if other.is_closed()]:
+                del self._clients[stale]
+            client = httpx.AsyncClient(
+                transport=self._transport,
+                limits=httpx.Limits(
+                    max_connections=config.TTS_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.TTS_HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=config.TTS_HTTP_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(config.TTS_API_TIMEOUT, connect=10.0),
+                headers={
+                    "Authorization": f"Bearer {config.OPENAI_API_KEY}",
+                    "Accept": "text/event-stream",
+                    "X-DashScope-SSE": "enable",
+                    "X-Accel-Buffering": "no",
+                }
+            )
+            self._clients[loop] = client
+        return client
+    
+    @staticmethod
+    async def _iter_events(response: httpx.Response) -> AsyncIterator[Tuple[Optional[str], Optional[int], str]]:
+        """增量解析 SSE，产出 (event, status, data)；空行或 data 行结束一个事件"""
+        event, status_code = None, None
+        async for line in response.aiter_lines():
+            line = line.rstrip("\r")
+            if not line:
+                event, status_code = None, None
+            elif line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("status:"):
+                try:
+                    status_code = int(line[len("status:"):].strip())
+                except ValueError:
+                    status_code = None
+            elif line.startswith("data:"):
+                yield event, status_code, line[len("data:"):].strip()
+    
+    async def astream(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US"
+    ) -> AsyncIterator[str]:
+        """
+        流式合成，逐个产出 base64 音频分片 (DashScope 原样，WebSocket 可直接转发)
         
+        Raises:
+            DashScopeError: HTTP 错误或 SSE error 事件
+        """
+        body = {
+            "model": self.model,
+            "input": {
+                "text": text,
+                "voice": voice,
+                "language_type": LANGUAGE_MAP.get(language, language),
+            },
+            "parameters": {},
+        }
+        try:
+            async with self._client().stream("POST", self.url, json=body) as response:
+                if response.status_code != 200:
+                    detail = (await response.aread()).decode("utf-8", errors="replace")
+                    logger.error("tts_api_error", status=response.status_code, message=detail[:200])
+                    raise DashScopeError(
+                        f"DashScope API error: {response.status_code} - {detail[:200]}",
+                        status_code=response.status_code
+                    )
+                
+                async for event, status_code, data in self._iter_events(response):
+                    if event == "done":
+                        continue
+                    try:
+                        message = json.loads(data)
+                    except json.JSONDecodeError:
+                        raise DashScopeError(f"Invalid SSE payload: {data[:200]}")
+                    if event == "error" or (status_code is not None and status_code != 200):
+                        logger.error("tts_api_error", status=status_code, message=message.get("message"))
+                        raise DashScopeError(
+                            f"DashScope API error: {status_code} - {message.get('code')} {message.get('message')}",
+                            status_code=status_code
+                        )
+                    audio = (message.get("output") or {}).get("audio") or {}
+                    if audio.get("data"):
+                        yield audio["data"]
+        except httpx.TimeoutException as e:
+            # 超时 / 连接失败按网关错误处理，准入控制据此判断上游过载
+            raise DashScopeError(f"DashScope request timed out: {e!r}", status_code=504)
+        except httpx.HTTPError as e:
+            raise DashScopeError(f"DashScope request failed: {e!r}", status_code=502)
+    
+    async def asynthesize(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US",
+        speed: float = 1.0
+    ) -> bytes:
+        """
+        调用 DashScope TTS API 生成语音，返回 WAV (speed 暂不支持，保留参数兼容)
+        
+        Raises:
+            DashScopeError: API 调用失败
+        """
+        logger.info(
+            "tts_request",
+            text_length=len(text),
+            voice=voice,
+            language=language,
+            speed=speed
+        )
+        audio_buffer = bytearray()
+        try:
+            async for data in self.astream(text, voice, language):
+                try:
+                    audio_buffer.extend(base64.b64decode(data))
+                except Exception as decode_err:
+                    logger.error("tts_decode_error", error=str(decode_err))
+            return to_wav(audio_buffer, text)
         except Exception as e:
             logger.error(
                 "tts_generation_failed",
                 error=str(e),
                 text=text[:100]
             )
+            if isinstance(e, DashScopeError):
+                raise
             raise DashScopeError(f"TTS generation failed: {str(e)}")
+    
+    async def aclose(self) -> None:
+        """关闭当前事件循环的连接池"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
 
 
-# 全局 TTS 服务实例
-tts_service = DashScopeTTSService()
+def create_dashscope_service() -> Optional[TTSProvider]:
+    """按 TTS_CLIENT 创建 DashScope 客户端 (async | sync)，未配置 API Key 时返回 None"""
+    if not config.OPENAI_API_KEY:
+        logger.warning("tts_provider_unavailable", provider="dashscope", reason="TTS_API_KEY missing")
+        return None
+    if config.TTS_CLIENT == "sync":
+        return DashScopeTTSService()
+    if config.TTS_CLIENT != "async":
+        raise ValueError(f"Unknown TTS_CLIENT: {config.TTS_CLIENT}")
+    return AsyncDashScopeTTSService()
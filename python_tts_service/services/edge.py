@@ -0,0 +1,95 @@
+"""
+微软 Edge-TTS 提供方 (免费，作为 DashScope 的备用)
+
+Edge-TTS 只输出 MP3，整段合成后经转码进程池 (core/transcode.py) 解码为 24kHz 16-bit 单声道 WAV，
+与 DashScope 的缓存格式一致；因此需要 edge-tts 依赖与 ffmpeg，不可用时路由层跳过该提供方。
+Opus 声音标识 (Cherry 等) 没有对应的 Edge 声音，按语言选择 (与 batch_edge_tts.py 一致)。
+"""
+from typing import Optional
+
+import structlog
+
+from core.transcode import Transcoder
+from services.dashscope import PCM_CHANNELS, PCM_SAMPLE_RATE, PCM_SAMPLE_WIDTH
+from services.provider import TTSProvider, TTSProviderError
+
+try:
+    import edge_tts
+except ImportError:  # 可选依赖
+    edge_tts = None
+
+logger = structlog.get_logger()
+
+EDGE_VOICE_MAP = {
+    "en-US": "en-US-AriaNeural",
+    "zh-CN": "zh-CN-XiaoxiaoNeural",
+    "en-GB": "en-GB-SoniaNeural",
+    "en-UK": "en-GB-SoniaNeural",
+}
+DEFAULT_EDGE_VOICE = "en-US-AriaNeural"
+
+
+def normalize_speed(speed: float) -> str:
+    """speed → Edge-TTS 速率，如 1.2 → +20%，0.8 → -20%"""
+    diff_percent = int(round((speed - 1.0) * 100))
+    return f"+{diff_percent}%" if diff_percent >= 0 else f"{diff_percent}%"
+
+
+class EdgeTTSError(TTSProviderError):
+    """Edge-TTS 调用错误"""
+    pass
+
+
+class EdgeTTSService(TTSProvider):
+    """Edge-TTS 客户端 (不支持流式)"""
+
+    name = "edge"
+
+    def __init__(self, transcoder: Transcoder):
+        # 转码进程池由路由层创建并传入 (不依赖缓存模块的全局实例)
+        self.transcoder = transcoder
+
+    @property
+    def available(self) -> bool:
+        return edge_tts is not None and self.transcoder.available
+
+    async def asynthesize(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US",
+        speed: float = 1.0
+    ) -> bytes:
+        edge_voice = EDGE_VOICE_MAP.get(language, DEFAULT_EDGE_VOICE)
+        logger.info("edge_tts_request", text_length=len(text), voice=edge_voice, speed=speed)
+
+        mp3 = bytearray()
+        try:
+            communicate = edge_tts.Communicate(text, edge_voice, rate=normalize_speed(speed))
+            async for chunk in communicate.stream():
+                if chunk["type"] == "audio":
+                    mp3.extend(chunk["data"])
+        except Exception as e:
+            # 网络 / 服务端错误: 可重试，可转移到其他提供方
+            raise EdgeTTSError(f"Edge-TTS request failed: {e}", status_code=502) from e
+        if not mp3:
+            raise EdgeTTSError("No audio data received from Edge-TTS", status_code=502)
+
+        try:
+            return await self.transcoder.decode(
+                bytes(mp3), "mp3", PCM_SAMPLE_RATE, PCM_CHANNELS, PCM_SAMPLE_WIDTH
+            )
+        except Exception as e:
+            raise EdgeTTSError(f"Edge-TTS audio decoding failed: {e}") from e
+
+    async def aclose(self) -> None:
+        self.transcoder.shutdown()
+
+
+def create_edge_service(transcoder: Transcoder) -> Optional[EdgeTTSService]:
+    """依赖缺失时返回 None"""
+    service = EdgeTTSService(transcoder)
+    if not service.available:
+        logger.warning("tts_provider_unavailable", provider="edge", reason="edge-tts or ffmpeg missing")
+        return None
+    return service
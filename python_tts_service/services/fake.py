@@ -0,0 +1,68 @@
+"""
+本地确定性假提供方 (不联网、不计费)
+
+同一 (text, voice, language) 总是生成相同的音频: 正弦音的频率由文本摘要决定，时长与文本长度成正比。
+以流式分片输出，首个分片前等待 FAKE_TTS_LATENCY 秒，用于开发、压测与测试
+(TTS_PROVIDERS=fake，或作为最后的备用)。
+"""
+import math
+import base64
+import struct
+import asyncio
+import hashlib
+from typing import AsyncIterator
+
+from core.config import config
+from services.dashscope import PCM_SAMPLE_RATE, PCM_SAMPLE_WIDTH, to_wav
+from services.provider import TTSProvider
+
+# 每个字符对应的时长 (秒) 与上下限
+_SECONDS_PER_CHAR = 0.06
+_MIN_SECONDS = 0.3
+_MAX_SECONDS = 20.0
+_AMPLITUDE = 8000
+
+
+class FakeTTSService(TTSProvider):
+    """确定性正弦音 TTS"""
+
+    name = "fake"
+
+    def __init__(self, latency: float = None, chunk_seconds: float = 0.2):
+        self.latency = config.FAKE_TTS_LATENCY if latency is None else latency
+        self.chunk_bytes = int(PCM_SAMPLE_RATE * chunk_seconds) * PCM_SAMPLE_WIDTH
+
+    def render(self, text: str, voice: str = "Cherry", language: str = "en-US") -> bytes:
+        """生成 24kHz 16-bit 单声道 PCM"""
+        digest = hashlib.md5(f"{text}_{voice}_{language}".encode("utf-8")).digest()
+        frequency = 220 + int.from_bytes(digest[:2], "big") % 440
+        period = PCM_SAMPLE_RATE // frequency
+        wave_period = b"".join(
+            struct.pack("<h", int(_AMPLITUDE * math.sin(2 * math.pi * i / period)))
+            for i in range(period)
+        )
+        seconds = min(max(len(text) * _SECONDS_PER_CHAR, _MIN_SECONDS), _MAX_SECONDS)
+        samples = int(PCM_SAMPLE_RATE * seconds)
+        return (wave_period * (samples // period + 1))[:samples * PCM_SAMPLE_WIDTH]
+
+    async def astream(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US"
+    ) -> AsyncIterator[str]:
+        pcm = self.render(text, voice, language)
+        await asyncio.sleep(self.latency)
+        for offset in range(0, len(pcm), self.chunk_bytes):
+            yield base64.b64encode(pcm[offset:offset + self.chunk_bytes]).decode("ascii")
+            await asyncio.sleep(0)
+
+    async def asynthesize(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US",
+        speed: float = 1.0
+    ) -> bytes:
+        await asyncio.sleep(self.latency)
+        return to_wav(self.render(text, voice, language), text)
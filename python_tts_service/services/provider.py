@@ -0,0 +1,40 @@
+"""
+TTS 提供方接口
+
+services/router.py 按策略在多个提供方之间选择并故障转移，现有实现:
+- dashscope: DashScopeTTSService / AsyncDashScopeTTSService (services/dashscope.py)
+- edge: EdgeTTSService (services/edge.py)，微软 Edge-TTS，免费，不支持流式
+- fake: FakeTTSService (services/fake.py)，本地确定性假提供方，用于开发 / 压测 / 测试
+
+提供方必须实现 asynthesize (返回 24kHz 16-bit 单声道 WAV)；
+支持流式的提供方另外实现 astream(text, voice, language)，逐片产出 base64 编码的 PCM
+"""
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+class TTSProviderError(Exception):
+    """提供方调用错误 (status_code 为 HTTP / 流式事件状态码，用于判断重试、限流与故障转移)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TTSProvider(ABC):
+    """TTS 提供方基类"""
+
+    name = "provider"
+
+    @abstractmethod
+    async def asynthesize(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US",
+        speed: float = 1.0
+    ) -> bytes:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
@@ -0,0 +1,297 @@
+"""
+多提供方 TTS 路由
+
+TTS_PROVIDERS 按顺序列出启用的提供方 (dashscope / edge / fake，见 services/provider.py)，
+每个提供方各自包装重试与熔断 (core/resilience.py)。每次合成按 TTS_ROUTING_POLICY 给提供方排序后依次尝试，
+可重试错误 (429 / 5xx / 超时) 或熔断打开时转移到下一个:
+
+- priority: TTS_PROVIDERS 的顺序 (默认: DashScope 为主，其余为备用)
+- cost: 每字符成本 (TTS_PROVIDER_COSTS) 低者优先
+- latency: 近期首包延迟 (EWMA) 低者优先
+- balanced: 首包延迟 / (1 - 错误率) + 成本 × 字符数 × TTS_ROUTING_COST_WEIGHT
+
+熔断打开的提供方总是排在最后。缓存 Key 仍由 generate_audio_hash 决定 (与提供方无关)，
+实际完成合成的提供方记录在缓存元数据的 provider 字段。
+"""
+import time
+import base64
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import structlog
+
+from core.config import config
+from core.resilience import STATE_VALUES, CircuitOpenError, anext_or_none, is_retryable, with_resilience
+from core.transcode import Transcoder
+from services.dashscope import create_dashscope_service, to_wav, wav_to_pcm
+from services.edge import create_edge_service
+from services.fake import FakeTTSService
+from services.provider import TTSProvider
+
+logger = structlog.get_logger()
+
+POLICIES = ("priority", "cost", "latency", "balanced")
+
+# EWMA 平滑系数: 首包延迟 / 错误率
+_LATENCY_ALPHA = 0.2
+_ERROR_ALPHA = 0.1
+
+PROVIDER_FACTORIES: Dict[str, Callable[[], Optional[TTSProvider]]] = {
+    "dashscope": create_dashscope_service,
+    # Edge 的 MP3 解码使用自己的转码进程池 (首次使用时才创建进程)
+    "edge": lambda: create_edge_service(Transcoder()),
+    "fake": FakeTTSService,
+}
+
+
+def parse_costs(value: str) -> Dict[str, float]:
+    """"dashscope=0.00008,edge=0" → {"dashscope": 8e-05, "edge": 0.0}"""
+    costs = {}
+    for item in value.split(","):
+        name, _, cost = item.partition("=")
+        if name.strip() and cost.strip():
+            costs[name.strip()] = float(cost)
+    return costs
+
+
+class ProviderStats:
+    """单个提供方的路由统计"""
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.selected = 0
+        self.failures = 0
+
+    def on_success(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else (
+            self.latency + (latency - self.latency) * _LATENCY_ALPHA
+        )
+        self.error_rate *= 1 - _ERROR_ALPHA
+        self.selected += 1
+
+    def on_failure(self) -> None:
+        self.error_rate += (1 - self.error_rate) * _ERROR_ALPHA
+        self.failures += 1
+
+
+class ProviderRouter:
+    """按策略选择提供方并故障转移"""
+
+    def __init__(
+        self,
+        providers: List[Any],
+        policy: str = None,
+        costs: Dict[str, float] = None,
+        cost_weight: float = None
+    ):
+        if not providers:
+            raise ValueError("No TTS provider available")
+        self.providers = providers
+        self.policy = policy or config.TTS_ROUTING_POLICY
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown TTS_ROUTING_POLICY: {self.policy}")
+        self.costs = parse_costs(config.TTS_PROVIDER_COSTS) if costs is None else costs
+        self.cost_weight = config.TTS_ROUTING_COST_WEIGHT if cost_weight is None else cost_weight
+        self.stats = {provider.name: ProviderStats() for provider in providers}
+        self.failovers = 0
+
+    def _score(self, provider: Any, chars: int) -> float:
+        stats = self.stats[provider.name]
+        cost = self.costs.get(provider.name, 0.0)
+        if self.policy == "cost":
+            return cost
+        if self.policy == "latency":
+            return stats.latency or 0.0
+        if self.policy == "balanced":
+            return (stats.latency or 0.0) / max(1 - stats.error_rate, 0.05) + cost * chars * self.cost_weight
+        return 0.0
+
+    def rank(self, chars: int) -> List[Any]:
+        """本次合成的尝试顺序 (同分按 TTS_PROVIDERS 顺序)"""
+        def key(item: Tuple[int, Any]) -> Tuple[bool, float, int]:
+            index, provider = item
+            breaker = getattr(provider, "breaker", None)
+            return (breaker is not None and breaker.is_open, self._score(provider, chars), index)
+
+        return [provider for _, provider in sorted(enumerate(self.providers), key=key)]
+
+    async def _open(
+        self, provider: Any, text: str, voice: str, language: str, speed: float
+    ) -> Tuple[Optional[str], AsyncIterator[str]]:
+        """返回 (第一个 base64 PCM 分片, 后续分片)；不支持流式的提供方整段作为一个分片"""
+        if hasattr(provider, "astream"):
+            stream = provider.astream(text, voice, language)
+            try:
+                return await anext_or_none(stream), stream
+            except BaseException:
+                await stream.aclose()
+                raise
+        wav = await provider.asynthesize(text, voice, language, speed)
+        return base64.b64encode(wav_to_pcm(wav)).decode("ascii"), _empty()
+
+    async def aopen(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US",
+        speed: float = 1.0
+    ) -> Tuple[str, AsyncIterator[str]]:
+        """
+        按策略打开一次合成，等到第一个分片后返回 (提供方名称, base64 PCM 分片)
+
+        Raises:
+            TTSProviderError / CircuitOpenError: 所有提供方都失败 (抛出最后一个错误)；
+                不可重试的错误 (如参数错误) 不转移，直接抛出
+        """
+        last_error: Optional[BaseException] = None
+        for attempt, provider in enumerate(self.rank(len(text))):
+            stats = self.stats[provider.name]
+            started = time.monotonic()
+            try:
+                first, stream = await self._open(provider, text, voice, language, speed)
+            except Exception as e:
+                if not (is_retryable(e) or isinstance(e, CircuitOpenError)):
+                    raise
+                if not isinstance(e, CircuitOpenError):
+                    stats.on_failure()
+                last_error = e
+                logger.warning("tts_provider_failed", provider=provider.name, error=str(e))
+                continue
+            stats.on_success(time.monotonic() - started)
+            if attempt:
+                self.failovers += 1
+                logger.info("tts_provider_failover", provider=provider.name, attempt=attempt + 1)
+            return provider.name, _chain(first, stream)
+        raise last_error
+
+    async def astream(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US"
+    ) -> AsyncIterator[str]:
+        _, stream = await self.aopen(text, voice, language)
+        async for data in stream:
+            yield data
+
+    async def asynthesize(
+        self,
+        text: str,
+        voice: str = "Cherry",
+        language: str = "en-US",
+        speed: float = 1.0
+    ) -> bytes:
+        _, stream = await self.aopen(text, voice, language, speed)
+        pcm = bytearray()
+        async for data in stream:
+            pcm.extend(base64.b64decode(data))
+        return to_wav(pcm, text)
+
+    async def aclose(self) -> None:
+        for provider in self.providers:
+            await provider.aclose()
+
+    def circuit_states(self) -> Dict[str, str]:
+        return {
+            provider.name: provider.breaker.state
+            for provider in self.providers if hasattr(provider, "breaker")
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        providers = {}
+        for provider in self.providers:
+            stats = self.stats[provider.name]
+            providers[provider.name] = {
+                **(provider.get_stats() if hasattr(provider, "get_stats") else {}),
+                "selected": stats.selected,
+                "failures": stats.failures,
+                "latency_ewma_seconds": round(stats.latency, 4) if stats.latency is not None else None,
+                "error_rate": round(stats.error_rate, 4),
+                "cost_per_char": self.costs.get(provider.name, 0.0),
+            }
+        return {"policy": self.policy, "failovers": self.failovers, "providers": providers}
+
+    def metric_lines(self) -> List[str]:
+        """Prometheus 文本格式的指标 (按 provider 标签区分)"""
+        resilient = [p for p in self.providers if hasattr(p, "breaker")]
+        lines = [
+            "# HELP tts_provider_selected_total Syntheses served by provider.",
+            "# TYPE tts_provider_selected_total counter",
+        ]
+        lines += [
+            f'tts_provider_selected_total{{provider="{name}"}} {stats.selected}'
+            for name, stats in self.stats.items()
+        ]
+        lines += [
+            "# HELP tts_provider_failures_total Provider failures that triggered failover.",
+            "# TYPE tts_provider_failures_total counter",
+        ]
+        lines += [
+            f'tts_provider_failures_total{{provider="{name}"}} {stats.failures}'
+            for name, stats in self.stats.items()
+        ]
+        lines += [
+            "# HELP tts_provider_failovers_total Syntheses served by a fallback provider.",
+            "# TYPE tts_provider_failovers_total counter",
+            f"tts_provider_failovers_total {self.failovers}",
+            "# HELP tts_provider_circuit_state Provider circuit breaker state (0 closed, 1 half-open, 2 open).",
+            "# TYPE tts_provider_circuit_state gauge",
+        ]
+        lines += [
+            f'tts_provider_circuit_state{{provider="{p.name}"}} {STATE_VALUES[p.breaker.state]}'
+            for p in resilient
+        ]
+        lines += [
+            "# HELP tts_provider_circuit_rejected_total Calls failed fast by the open circuit.",
+            "# TYPE tts_provider_circuit_rejected_total counter",
+        ]
+        lines += [
+            f'tts_provider_circuit_rejected_total{{provider="{p.name}"}} {p.breaker.rejected}'
+            for p in resilient
+        ]
+        lines += [
+            "# HELP tts_provider_retries_total Provider calls retried.",
+            "# TYPE tts_provider_retries_total counter",
+        ]
+        lines += [f'tts_provider_retries_total{{provider="{p.name}"}} {p.retries}' for p in resilient]
+        lines += [
+            "# HELP tts_provider_hedges_total Hedged provider requests by winner.",
+            "# TYPE tts_provider_hedges_total counter",
+        ]
+        for p in resilient:
+            lines += [
+                f'tts_provider_hedges_total{{provider="{p.name}",winner="primary"}} {p.hedges - p.hedges_won}',
+                f'tts_provider_hedges_total{{provider="{p.name}",winner="hedge"}} {p.hedges_won}',
+            ]
+        return lines
+
+
+async def _empty() -> AsyncIterator[str]:
+    return
+    yield
+
+
+async def _chain(first: Optional[str], stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    try:
+        if first is not None:
+            yield first
+        async for data in stream:
+            yield data
+    finally:
+        await stream.aclose()
+
+
+def create_tts_service() -> ProviderRouter:
+    """按 TTS_PROVIDERS 创建提供方 (跳过依赖缺失的)，各自包装重试与熔断"""
+    providers = []
+    for name in [item.strip() for item in config.TTS_PROVIDERS.split(",") if item.strip()]:
+        if name not in PROVIDER_FACTORIES:
+            raise ValueError(f"Unknown TTS provider: {name}")
+        provider = PROVIDER_FACTORIES[name]()
+        if provider is not None:
+            providers.append(with_resilience(provider))
+    return ProviderRouter(providers)
+
+
+# 全局服务实例
+tts_service = create_tts_service()
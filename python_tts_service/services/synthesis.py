@@ -0,0 +1,423 @@
+"""
+合成并写入缓存 (HTTP / WebSocket 共用)
+
+同一 Hash 的并发未命中只调用一次提供方 (见 core/singleflight.py)，
+提供方调用在准入队列的名额内执行 (见 core/admission.py)；
+提供方由路由层选择 (见 services/router.py)，记录在缓存元数据的 provider 字段
+
+stream_synthesis: 边合成边输出 WAV 字节 (POST /tts/stream 与 WebSocket 未命中)，同一份字节写入临时文件，
+合成结束后原子提交到缓存；HTTP 客户端断开不影响合成与缓存写入
+
+synthesize_long_to_cache: 长文本按句切分后并行合成 (每句单独缓存、各自经过准入队列)，
+按顺序拼接 PCM 写入整段的缓存文件；总耗时接近最慢的一句，其他段落中的相同句子直接命中缓存
+
+synthesize_speed_variant: 非 1.0 语速由 1.0× 主文件在转码进程池中本地变速生成 (不调用提供方)，
+以自己的 Hash 单独缓存；播放器切换语速只是本地 CPU 工作
+"""
+import time
+import wave
+import base64
+import asyncio
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import structlog
+
+from core.admission import admission
+from core.cache import AudioStreamWriter, CachedAudio, cache_manager
+from core.config import config
+from core.hash import generate_audio_hash
+from core.metadata_store import DEFAULT_CACHE_TYPE
+from core.singleflight import Flight, SingleFlight
+from core.text_split import split_sentences
+from services.dashscope import (
+    PCM_CHANNELS, PCM_SAMPLE_RATE, PCM_SAMPLE_WIDTH, DashScopeError, is_wav, to_wav, wav_header
+)
+from services.router import tts_service
+
+logger = structlog.get_logger()
+
+# 进行中的合成登记表: Key 为音频 Hash，HTTP 与 WebSocket 共用 (同一句只调用一次提供方)；
+# Flight 记录订阅者数，WebSocket 发起的合成在最后一个订阅者离开时经 on_idle 中止
+synthesis_flights = SingleFlight()
+
+
+async def _iter_audio(
+    text: str,
+    voice: str,
+    language: str,
+    speed: float,
+    route: Optional[Dict[str, str]] = None
+) -> AsyncIterator[bytes]:
+    """
+    逐片产出解码后的音频；客户端不支持流式 (sync SDK) 时整段产出一次
+
+    经路由层合成时，第一个分片之前把选中的提供方写入 route["provider"]
+    """
+    if hasattr(tts_service, "aopen"):
+        provider, stream = await tts_service.aopen(text, voice, language, speed)
+        if route is not None:
+            route["provider"] = provider
+    elif hasattr(tts_service, "astream"):
+        stream = tts_service.astream(text, voice, language)
+    else:
+        yield await tts_service.asynthesize(text, voice, language, speed)
+        return
+    async for data in stream:
+        try:
+            yield base64.b64decode(data)
+        except Exception as decode_err:
+            logger.error("tts_decode_error", error=str(decode_err))
+
+
+def _with_provider(metadata: Optional[Dict[str, Any]], route: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """
+    记录选中的提供方
+
+    缓存 Key 不含提供方，故障转移到非首选提供方 (音色不同) 的音频只按临时条目缓存，可被淘汰，
+    首选提供方恢复后重新合成即可替换
+    """
+    if "provider" not in route:
+        return metadata
+    metadata = {**(metadata or {}), "provider": route["provider"]}
+    if route["provider"] != tts_service.providers[0].name:
+        metadata["cache_type"] = DEFAULT_CACHE_TYPE
+    return metadata
+
+
+async def synthesize_to_cache(
+    audio_hash: str,
+    text: str,
+    voice: str,
+    language: str,
+    speed: float,
+    metadata: Optional[Dict[str, Any]] = None,
+    priority: str = "interactive"
+) -> Tuple[CachedAudio, bool]:
+    """
+    合成音频并写入缓存
+
+    Returns:
+        (缓存文件, 是否合并到了其他请求的合成)
+
+    Raises:
+        DashScopeError: 合成失败 (所有合并的等待者收到同一异常)
+        AdmissionRejected: 准入队列已满或排队超时
+    """
+    async def run() -> CachedAudio:
+        route: Dict[str, str] = {}
+        async with admission.slot(priority, key=audio_hash) as permit:
+            chunks = []
+            async for chunk in _iter_audio(text, voice, language, speed, route):
+                permit.mark_first_byte()
+                chunks.append(chunk)
+        audio_data = to_wav(b"".join(chunks), text)
+        audio_path = await cache_manager.asave_audio(audio_hash, audio_data, _with_provider(metadata, route))
+        return CachedAudio(audio_path, len(audio_data))
+
+    if audio_hash in synthesis_flights:
+        # 合并到仍在排队的低优先级合成 (如预加载) 时，按本请求的优先级提前
+        admission.promote(audio_hash, priority)
+    return await synthesis_flights.do(audio_hash, run)
+
+
+async def _cached_audio(
+    text: str,
+    voice: str,
+    language: str,
+    speed: float,
+    cache_type: Optional[str],
+    priority: str
+) -> CachedAudio:
+    """命中缓存直接返回，否则合成并缓存 (长文本中的一句 / 变速的 1.0× 主文件)"""
+    audio_hash = generate_audio_hash(text=text, voice=voice, language=language, speed=speed)
+    cached = await cache_manager.alookup(audio_hash, cache_type=cache_type, voice=voice, language=language)
+    if cached:
+        return cached
+    generated, coalesced = await synthesize_text_to_cache(
+        audio_hash,
+        text,
+        voice,
+        language,
+        speed,
+        metadata={
+            "text": text,
+            "voice": voice,
+            "language": language,
+            "speed": speed,
+            "cache_type": cache_type
+        },
+        priority=priority
+    )
+    if coalesced:
+        cache_manager.touch(audio_hash, cache_type)
+    return generated
+
+
+def _stitch(writer: AudioStreamWriter, paths: List[Path]) -> None:
+    """按顺序拼接各句 WAV 的 PCM 数据 (不重新编码)，写成一个完整 WAV"""
+    params = (PCM_CHANNELS, PCM_SAMPLE_WIDTH, PCM_SAMPLE_RATE)
+    data_size = 0
+    for path in paths:
+        with wave.open(str(path), "rb") as wav_file:
+            if (wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate()) != params:
+                raise ValueError(f"Cannot stitch segment {path.name}: unexpected audio format")
+            data_size += wav_file.getnframes() * PCM_CHANNELS * PCM_SAMPLE_WIDTH
+    writer.write(wav_header(data_size))
+    for path in paths:
+        with wave.open(str(path), "rb") as wav_file:
+            while True:
+                frames = wav_file.readframes(65536)
+                if not frames:
+                    break
+                writer.write(frames)
+
+
+async def synthesize_long_to_cache(
+    audio_hash: str,
+    segments: List[str],
+    voice: str,
+    language: str,
+    speed: float,
+    metadata: Optional[Dict[str, Any]] = None,
+    priority: str = "interactive"
+) -> Tuple[CachedAudio, bool]:
+    """
+    长文本: 各句并行合成 (同时最多 LONG_TEXT_MAX_CONCURRENCY 句) 后拼接，写入整段的缓存
+
+    Args:
+        segments: 按顺序的分句 (core/text_split.py)
+
+    Returns:
+        (整段的缓存文件, 是否合并到了其他请求的合成)
+
+    Raises:
+        任一句的合成异常 (已完成的句子仍留在缓存中，重试时直接命中)
+    """
+    cache_type = (metadata or {}).get("cache_type")
+
+    async def run() -> CachedAudio:
+        started = time.monotonic()
+        limiter = asyncio.Semaphore(config.LONG_TEXT_MAX_CONCURRENCY)
+
+        async def segment(text: str) -> CachedAudio:
+            async with limiter:
+                return await _cached_audio(text, voice, language, speed, cache_type, priority)
+
+        tasks = [asyncio.ensure_future(segment(text)) for text in segments]
+        try:
+            parts = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        writer = await cache_manager.aopen_stream(audio_hash)
+        try:
+            await cache_manager.run_io(_stitch, writer, [part.path for part in parts])
+        except BaseException:
+            await cache_manager.run_io(writer.abort)
+            raise
+        cached = await cache_manager.acommit_stream(writer, {**(metadata or {}), "segments": len(segments)})
+        logger.info(
+            "tts_long_text_stitched",
+            hash=audio_hash,
+            segments=len(segments),
+            size_bytes=cached.size,
+            duration_ms=round((time.monotonic() - started) * 1000, 1)
+        )
+        return cached
+
+    return await synthesis_flights.do(audio_hash, run)
+
+
+def local_speed_variant(speed: float) -> bool:
+    """该语速是否由 1.0× 主文件本地变速生成 (Hash 中语速保留一位小数)"""
+    return (
+        config.SPEED_VARIANTS_LOCAL
+        and f"{speed:.1f}" != "1.0"
+        and cache_manager.transcoder.available
+    )
+
+
+async def synthesize_speed_variant(
+    audio_hash: str,
+    text: str,
+    voice: str,
+    language: str,
+    speed: float,
+    metadata: Optional[Dict[str, Any]] = None,
+    priority: str = "interactive"
+) -> Tuple[CachedAudio, bool]:
+    """
+    非 1.0 语速: 取缓存的 1.0× 主文件 (未命中时先合成)，变速不变调后写入本语速的缓存
+
+    Returns:
+        (本语速的缓存文件, 是否合并到了其他请求的合成)
+    """
+    cache_type = (metadata or {}).get("cache_type")
+    # 按 Hash 中的精度变速，同一 Key 的内容与请求的细微差别无关
+    tempo = float(f"{speed:.1f}")
+
+    async def run() -> CachedAudio:
+        started = time.monotonic()
+        master = await _cached_audio(text, voice, language, 1.0, cache_type, priority)
+        master_data = await cache_manager.run_io(master.path.read_bytes)
+        audio_data = await cache_manager.transcoder.time_stretch(master_data, tempo)
+        master_hash = generate_audio_hash(text=text, voice=voice, language=language, speed=1.0)
+        audio_path = await cache_manager.asave_audio(
+            audio_hash, audio_data, {**(metadata or {}), "derived_from": master_hash}
+        )
+        logger.info(
+            "tts_speed_variant_created",
+            hash=audio_hash,
+            master=master_hash,
+            speed=tempo,
+            duration_ms=round((time.monotonic() - started) * 1000, 1)
+        )
+        return CachedAudio(audio_path, len(audio_data))
+
+    return await synthesis_flights.do(audio_hash, run)
+
+
+async def synthesize_text_to_cache(
+    audio_hash: str,
+    text: str,
+    voice: str,
+    language: str,
+    speed: float,
+    metadata: Optional[Dict[str, Any]] = None,
+    priority: str = "interactive"
+) -> Tuple[CachedAudio, bool]:
+    """
+    合成任意长度、语速的文本并写入缓存 (/tts/generate 与批量接口的入口)
+
+    - 非 1.0 语速且可本地变速: synthesize_speed_variant
+    - 超过 MAX_TEXT_LENGTH: synthesize_long_to_cache
+    - 其余: synthesize_to_cache
+    """
+    if local_speed_variant(speed):
+        return await synthesize_speed_variant(audio_hash, text, voice, language, speed, metadata, priority)
+    if len(text) > config.MAX_TEXT_LENGTH:
+        return await synthesize_long_to_cache(
+            audio_hash,
+            split_sentences(text, config.MAX_TEXT_LENGTH),
+            voice,
+            language,
+            speed,
+            metadata,
+            priority
+        )
+    return await synthesize_to_cache(audio_hash, text, voice, language, speed, metadata, priority)
+
+
+# 流式合成的后台任务 (持有引用，避免被回收)
+_stream_tasks: Set[asyncio.Task] = set()
+
+
+async def _stream_to_cache(
+    flight: Flight,
+    text: str,
+    voice: str,
+    language: str,
+    speed: float,
+    metadata: Optional[Dict[str, Any]],
+    priority: str
+) -> None:
+    """
+    leader 的合成任务: 每片 WAV 字节发布到 Flight (订阅者实时转发) 并写入临时文件
+
+    裸 PCM 先发布长度未知的 WAV 头，提交缓存时补写真实长度；
+    DashScope 已返回完整 WAV (带 RIFF 头) 时原样透传
+    """
+    writer: Optional[AudioStreamWriter] = None
+    try:
+        started = time.monotonic()
+        pcm = False
+        route: Dict[str, str] = {}
+        async with admission.slot(priority, key=flight.key) as permit:
+            async for chunk in _iter_audio(text, voice, language, speed, route):
+                if not chunk:
+                    continue
+                if writer is None:
+                    permit.mark_first_byte()
+                    writer = await cache_manager.aopen_stream(flight.key)
+                    pcm = not is_wav(chunk)
+                    if pcm:
+                        header = wav_header()
+                        await cache_manager.run_io(writer.write, header)
+                        flight.publish(header)
+                    logger.info(
+                        "tts_stream_first_chunk",
+                        hash=flight.key,
+                        provider=route.get("provider"),
+                        ttfb_ms=round((time.monotonic() - started) * 1000, 1)
+                    )
+                await cache_manager.run_io(writer.write, chunk)
+                flight.publish(chunk)
+        if writer is None:
+            raise DashScopeError("No audio data received from API")
+        
+        head = wav_header(writer.size - len(wav_header())) if pcm else None
+        cached = await cache_manager.acommit_stream(writer, _with_provider(metadata, route), head=head)
+        logger.info(
+            "tts_stream_completed",
+            hash=flight.key,
+            size_bytes=cached.size,
+            duration_ms=round((time.monotonic() - started) * 1000, 1)
+        )
+        synthesis_flights.finish(flight, result=cached)
+    except BaseException as e:
+        if writer is not None and writer.temp_path.exists():
+            await cache_manager.run_io(writer.abort)
+        logger.error("tts_stream_failed", hash=flight.key, error=str(e))
+        error = RuntimeError("synthesis cancelled") if isinstance(e, asyncio.CancelledError) else e
+        synthesis_flights.finish(flight, error=error)
+        if not isinstance(e, Exception):
+            raise
+
+
+async def _follow(flight: Flight) -> AsyncIterator[bytes]:
+    """转发 Flight 的 WAV 分片；leader 是非流式合成 (/tts/generate) 时等其完成后输出整个文件"""
+    streamed = False
+    async for chunk in flight.stream():
+        streamed = True
+        yield chunk
+    if not streamed:
+        cached: CachedAudio = flight.future.result()
+        yield await cache_manager.run_io(cached.path.read_bytes)
+
+
+def stream_synthesis(
+    audio_hash: str,
+    text: str,
+    voice: str,
+    language: str,
+    speed: float,
+    metadata: Optional[Dict[str, Any]] = None,
+    priority: str = "interactive",
+    abort_when_unused: bool = False
+) -> AsyncIterator[bytes]:
+    """
+    流式合成并写入缓存，返回 WAV 字节流
+
+    同一 Hash 已在合成时 (流式或非流式) 合并为 follower，回放已输出的分片后继续实时接收。
+    合成在独立 Task 中运行，迭代器提前关闭 (客户端断开) 不会中断其他订阅者的接收；
+    默认也不中断合成与缓存写入，abort_when_unused=True (WebSocket 取消) 时由本次发起的合成
+    在最后一个订阅者离开后中止上游流并释放准入名额。
+
+    Raises (迭代时):
+        DashScopeError: 合成失败
+        AdmissionRejected: 准入队列已满或排队超时 (在第一个分片之前抛出)
+    """
+    flight, leader = synthesis_flights.join(audio_hash)
+    if leader:
+        task = asyncio.ensure_future(
+            _stream_to_cache(flight, text, voice, language, speed, metadata, priority)
+        )
+        _stream_tasks.add(task)
+        task.add_done_callback(_stream_tasks.discard)
+        if abort_when_unused:
+            flight.on_idle = task.cancel
+    else:
+        admission.promote(audio_hash, priority)
+    return _follow(flight)
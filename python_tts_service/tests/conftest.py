@@ -80,6 +80,23 @@ def temp_cache_dir():
         yield Path(tmpdir)
 
 
+@pytest.fixture
+def temp_cache(tmp_path):
+    """
+    临时目录上的 CacheManager，替换路由、WebSocket 与合成模块使用的全局实例
+
+    测试结束后关闭；合成结果不会写入真实缓存目录
+    """
+    from core.cache import CacheManager
+    
+    manager = CacheManager(cache_dir=tmp_path)
+    with patch("api.routes.cache_manager", manager), \
+            patch("api.websocket.cache_manager", manager), \
+            patch("services.synthesis.cache_manager", manager):
+        yield manager
+    manager.close()
+
+
 @pytest.fixture
 def mock_config(temp_cache_dir):
     """
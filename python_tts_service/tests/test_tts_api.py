@@ -44,6 +44,21 @@ class TestHealthCheck:
         assert data["status"] == "healthy"
         assert data["dashscope_connected"] is True
 
+    def test_health_without_breaker_reports_unknown(self, client):
+        """没有提供方带熔断器时 (fake 提供方) 应返回 healthy / unknown 而不是 500"""
+        from unittest.mock import patch
+        from services.fake import FakeTTSService
+        from services.router import ProviderRouter
+
+        with patch("api.routes.tts_service", ProviderRouter([FakeTTSService(latency=0)])):
+            response = client.get("/tts/health")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "healthy"
+        assert data["circuit_state"] == "unknown"
+        assert data["providers"] == {}
+
 
 class TestTTSGenerate:
     """TTS 生成接口测试"""
@@ -170,3 +185,271 @@ class TestCacheStats:
         assert "total_files" in data
         assert "total_size_bytes" in data
         assert "cache_dir" in data
+
+
+class TestAudioEndpoint:
+    """音频直出接口测试 (使用临时缓存目录，不调用 DashScope)"""
+    
+    HASH = "0123456789abcdef0123456789abcdef"
+    
+    @pytest.fixture
+    def manager(self, temp_cache):
+        temp_cache.save_audio(self.HASH, b"RIFF" + bytes(range(96)))
+        return temp_cache
+    
+    def test_full_response_with_cache_headers(self, client, manager):
+        """完整响应应带 ETag 与长期缓存头，第二次读取来自内存"""
+        response = client.get(f"/tts/audio/{self.HASH}")
+        assert response.status_code == 200
+        assert response.content[:4] == b"RIFF"
+        assert response.headers["content-type"] == "audio/wav"
+        assert "immutable" in response.headers["cache-control"]
+        assert response.headers["etag"]
+        
+        client.get(f"/tts/audio/{self.HASH}")
+        assert manager.hot_cache.hits == 1
+    
+    def test_if_none_match_returns_304(self, client, manager):
+        """ETag 匹配时返回 304"""
+        etag = client.get(f"/tts/audio/{self.HASH}").headers["etag"]
+        response = client.get(f"/tts/audio/{self.HASH}", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+    
+    def test_range_requests(self, client, manager):
+        """Range 返回 206 / 416"""
+        response = client.get(f"/tts/audio/{self.HASH}", headers={"Range": "bytes=0-3"})
+        assert response.status_code == 206
+        assert response.content == b"RIFF"
+        assert response.headers["content-range"] == "bytes 0-3/100"
+        
+        response = client.get(f"/tts/audio/{self.HASH}", headers={"Range": "bytes=-2"})
+        assert response.content == bytes([94, 95])
+        
+        response = client.get(f"/tts/audio/{self.HASH}", headers={"Range": "bytes=100-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == "bytes */100"
+    
+    def test_missing_audio_returns_404(self, client, manager):
+        """不存在或非法 Hash 返回 404"""
+        assert client.get(f"/tts/audio/{'f' * 32}").status_code == 404
+        assert client.get("/tts/audio/..%2Fmetadata.db").status_code == 404
+
+
+class TestAdmission:
+    """准入队列接口测试 (不调用 DashScope)"""
+    
+    def test_rejected_miss_returns_429_with_retry_after(self, client, temp_cache):
+        """队列已满时返回 429 与 Retry-After"""
+        from unittest.mock import patch
+        from core.admission import AdmissionRejected
+        
+        with patch(
+            "api.routes.synthesize_text_to_cache",
+            side_effect=AdmissionRejected("queue_full", 429, 3)
+        ):
+            response = client.post("/tts/generate", json={"text": "Busy", "priority": "prefetch"})
+        
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "3"
+        assert response.json()["detail"]["error_code"] == "QUEUE_FULL"
+    
+    def test_circuit_open_returns_503(self, client, temp_cache):
+        """上游熔断打开时快速返回 503 与 Retry-After"""
+        from unittest.mock import patch
+        from core.resilience import CircuitOpenError
+        
+        with patch("api.routes.synthesize_text_to_cache", side_effect=CircuitOpenError(7)):
+            response = client.post("/tts/generate", json={"text": "Provider down"})
+        
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "7"
+        assert response.json()["detail"]["error_code"] == "PROVIDER_UNAVAILABLE"
+    
+    def test_cache_hit_skips_admission(self, client, temp_cache):
+        """缓存命中不进入准入队列"""
+        from unittest.mock import patch
+        from core.hash import generate_audio_hash
+        
+        audio_hash = generate_audio_hash(text="Cached", voice="Cherry", language="en-US", speed=1.0)
+        temp_cache.save_audio(audio_hash, b"RIFF" + b"x" * 96)
+        with patch("api.routes.synthesize_text_to_cache") as synthesize:
+            response = client.post("/tts/generate", json={"text": "Cached"})
+        
+        assert response.status_code == 200
+        assert response.json()["cached"] is True
+        synthesize.assert_not_called()
+    
+    def test_metrics_endpoint(self, client, temp_cache):
+        """指标为 Prometheus 文本格式，含各优先级队列深度"""
+        response = client.get("/tts/metrics")
+        assert response.status_code == 200
+        assert 'tts_admission_queue_depth{priority="interactive"}' in response.text
+        assert "tts_admission_wait_seconds_count" in response.text
+        assert 'tts_adaptive_limit_changes_total{reason="throttled"}' in response.text
+
+
+class TestBatchGenerate:
+    """批量生成接口测试 (不调用 DashScope)"""
+    
+    def test_batch_streams_deduplicated_results(self, client, temp_cache):
+        """命中先返回，重复条目只合成一次，失败条目带错误码"""
+        import json
+        import asyncio
+        from unittest.mock import patch
+        from core.admission import AdmissionRejected
+        from core.cache import CachedAudio
+        from core.hash import generate_audio_hash
+        
+        cached_hash = generate_audio_hash(text="Cached", voice="Cherry", language="en-US", speed=1.0)
+        temp_cache.save_audio(cached_hash, b"RIFF" + b"c" * 96)
+        calls = []
+        
+        async def fake_synthesize(audio_hash, text, voice, language, speed, metadata=None, priority="interactive"):
+            calls.append((text, priority))
+            if text == "Busy":
+                raise AdmissionRejected("queue_full", 429, 2)
+            await asyncio.sleep(0.05)
+            path = await temp_cache.asave_audio(audio_hash, b"RIFF" + b"n" * 96)
+            return CachedAudio(path, 100), False
+        
+        items = [{"text": "New"}, {"text": "Cached"}, {"text": "New"}, {"text": "Busy"}]
+        with patch("api.routes.synthesize_text_to_cache", side_effect=fake_synthesize):
+            response = client.post("/tts/generate/batch", json={"items": items})
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert len(lines) == 3
+        by_index = {tuple(line["indices"]): line for line in lines}
+        assert by_index[(1,)]["cached"] is True
+        assert by_index[(0, 2)]["cached"] is False
+        assert by_index[(3,)]["error_code"] == "QUEUE_FULL" and by_index[(3,)]["retry_after"] == 2
+        assert lines[-1]["indices"] == [0, 2]
+        assert sorted(calls) == [("Busy", "prefetch"), ("New", "prefetch")]
+    
+    def test_invalid_items_fail_individually(self, client, temp_cache):
+        """无效条目 (音色不支持 / 空文本 / 过长) 各自返回 INVALID_ITEM 行，其余条目照常生成"""
+        import json
+        from unittest.mock import patch
+        from core.cache import CachedAudio
+        from core.config import config
+        
+        async def fake_synthesize(audio_hash, text, voice, language, speed, metadata=None, priority="interactive"):
+            path = await temp_cache.asave_audio(audio_hash, b"RIFF" + b"n" * 96)
+            return CachedAudio(path, 100), False
+        
+        items = [
+            {"text": "Valid"},
+            {"text": "Bad voice", "voice": "Nobody"},
+            {"text": "   "},
+            {"text": "x" * (config.MAX_LONG_TEXT_LENGTH + 1)},
+        ]
+        with patch("api.routes.synthesize_text_to_cache", side_effect=fake_synthesize):
+            response = client.post("/tts/generate/batch", json={"items": items})
+        
+        assert response.status_code == 200
+        by_index = {tuple(line["indices"]): line for line in map(json.loads, response.text.splitlines())}
+        assert by_index[(0,)]["success"] is True
+        for index in (1, 2, 3):
+            assert by_index[(index,)]["error_code"] == "INVALID_ITEM"
+            assert by_index[(index,)]["status"] == 422
+        assert "voice" in by_index[(1,)]["error"]
+
+
+class TestStreamGenerate:
+    """流式生成接口测试 (不调用 DashScope)"""
+    
+    def test_stream_miss_then_hit(self, client, temp_cache):
+        """未命中边合成边输出并写入缓存，再次请求直接返回缓存文件"""
+        import base64
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        
+        pcm = b"\x05\x00" * 200
+        
+        async def fake_astream(text, voice, language):
+            for i in range(0, len(pcm), 100):
+                yield base64.b64encode(pcm[i:i + 100]).decode()
+        
+        with patch("services.synthesis.tts_service", SimpleNamespace(astream=fake_astream)):
+            miss = client.post("/tts/stream", json={"text": "Stream me"})
+            hit = client.post("/tts/stream", json={"text": "Stream me"})
+        
+        assert miss.status_code == 200
+        assert miss.headers["content-type"] == "audio/wav"
+        assert miss.headers["x-cache"] == "MISS"
+        assert miss.content[:4] == b"RIFF" and miss.content[44:] == pcm
+        assert hit.status_code == 200
+        assert hit.headers["x-cache"] == "HIT"
+        assert hit.headers["x-audio-hash"] == miss.headers["x-audio-hash"]
+        assert hit.content[44:] == pcm and hit.content[40:44] == len(pcm).to_bytes(4, "little")
+    
+    def test_stream_error_before_first_chunk(self, client, temp_cache, tmp_path):
+        """第一个分片之前失败返回错误状态码"""
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        from services.dashscope import DashScopeError
+        
+        async def failing_astream(text, voice, language):
+            raise DashScopeError("DashScope API error: 401")
+            yield
+        
+        with patch("services.synthesis.tts_service", SimpleNamespace(astream=failing_astream)):
+            response = client.post("/tts/stream", json={"text": "Broken"})
+        
+        assert response.status_code == 500
+        assert response.json()["detail"]["error_code"] == "DASHSCOPE_ERROR"
+        assert not list(tmp_path.rglob("*.wav"))
+
+
+class TestLongTextGenerate:
+    """长文本分句合成接口测试 (不调用 DashScope)"""
+    
+    def test_long_text_is_split_cached_and_stitched(self, client, temp_cache):
+        """超过 MAX_TEXT_LENGTH 的文本按句合成，每句单独缓存，整段为各句 PCM 的拼接"""
+        import base64
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        from core.config import config
+        from core.hash import generate_audio_hash
+        
+        sentences = [f"Sentence number {i} is here." for i in range(30)]
+        text = " ".join(sentences)
+        assert len(text) > config.MAX_TEXT_LENGTH
+        
+        def pcm_for(sentence):
+            return sentence.encode()[:20].ljust(20, b"\x00")
+        
+        async def fake_astream(text, voice, language):
+            yield base64.b64encode(pcm_for(text)).decode()
+        
+        with patch("services.synthesis.tts_service", SimpleNamespace(astream=fake_astream)):
+            response = client.post("/tts/generate", json={"text": text})
+            rejected = client.post("/tts/stream", json={"text": text})
+        
+        assert response.status_code == 200
+        stitched = temp_cache.lookup(response.json()["hash"]).path.read_bytes()
+        assert stitched[44:] == b"".join(pcm_for(s) for s in sentences)
+        assert temp_cache.exists(generate_audio_hash(sentences[3]))
+        assert temp_cache.get_metadata(response.json()["hash"])["segments"] == 30
+        assert rejected.status_code == 400
+        assert rejected.json()["detail"]["error_code"] == "TEXT_TOO_LONG"
+
+
+class TestBulkCheck:
+    """批量缓存检查接口测试"""
+    
+    def test_bulk_check_returns_each_hash(self, client, temp_cache):
+        """已缓存的返回 URL 与大小，未缓存 / 非法 Hash 返回 exists=False"""
+        cached = "0123456789abcdef0123456789abcdef"
+        temp_cache.save_audio(cached, b"RIFF" + b"x" * 96)
+        hashes = [cached, "f" * 32, "../metadata"]
+        response = client.post("/tts/check", json={"hashes": hashes})
+        
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert list(results) == hashes
+        assert results[cached] == {"exists": True, "url": f"/audio/{cached}.wav", "file_size": 100}
+        assert results["f" * 32]["exists"] is False
+        assert results["../metadata"]["exists"] is False
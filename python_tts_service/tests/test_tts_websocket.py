@@ -19,6 +19,21 @@ def client():
     return TestClient(app)
 
 
+@pytest.fixture
+def shared_loop_client():
+    """
+    所有连接与 HTTP 请求共用一个事件循环的测试客户端 (不触发 startup / shutdown)
+
+    默认的 TestClient 每个连接各起一个事件循环，跨连接合并同一合成的测试需要与生产环境一样共用一个
+    """
+    import anyio
+    
+    test_client = TestClient(app)
+    with anyio.from_thread.start_blocking_portal() as portal:
+        test_client.portal = portal
+        yield test_client
+
+
 class TestWebSocketConnection:
     """WebSocket 连接测试"""
     
@@ -134,3 +149,421 @@ class TestWebSocketConnectionReuse:
                 websocket.send_json({"type": "ping"})
                 response = websocket.receive_json()
                 assert response["type"] == "pong"
+
+
+class TestWebSocketBinaryProtocol:
+    """二进制音频帧协议测试 (假提供方，不访问网络)"""
+    
+    def _collect(self, websocket, request_id):
+        """收集音频帧直到 done，返回 (帧列表, done 消息)"""
+        frames = []
+        while True:
+            message = websocket.receive()
+            if message.get("bytes") is not None:
+                frames.append(message["bytes"])
+                continue
+            response = json.loads(message["text"])
+            if response["type"] == "done":
+                assert response["requestId"] == request_id
+                return frames, response
+            assert response["type"] == "audio", response
+            frames.append(response)
+    
+    def test_binary_subprotocol_sends_raw_pcm(self, client, temp_cache):
+        """W06: 协商 tts.binary.v1 后音频为二进制帧 (头 + 裸 PCM)，与 JSON 模式内容一致"""
+        import base64
+        from unittest.mock import patch
+        from api.websocket import SUBPROTOCOL_BINARY, decode_audio_frame
+        from services.fake import FakeTTSService
+        
+        fake = FakeTTSService(latency=0)
+        expected = fake.render("Binary frames", "Cherry", "en-US")
+        with patch("services.synthesis.tts_service", fake):
+            with client.websocket_connect("/ws/tts", subprotocols=[SUBPROTOCOL_BINARY]) as websocket:
+                assert websocket.accepted_subprotocol == SUBPROTOCOL_BINARY
+                websocket.send_json({"text": "Binary frames", "requestId": "bin-1"})
+                frames, _ = self._collect(websocket, "bin-1")
+            
+            with client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": "Binary frames", "requestId": "json-1"})
+                messages, _ = self._collect(websocket, "json-1")
+        
+        decoded = [decode_audio_frame(frame) for frame in frames]
+        assert [header["seq"] for header, _ in decoded] == list(range(len(frames)))
+        assert all(header["requestId"] == "bin-1" and header["sample_rate"] == 24000 for header, _ in decoded)
+        assert b"".join(pcm for _, pcm in decoded) == expected
+        
+        assert all(isinstance(msg, dict) and msg["requestId"] == "json-1" for msg in messages)
+        assert b"".join(base64.b64decode(msg["data"]) for msg in messages) == expected
+        assert sum(len(frame) for frame in frames) < sum(len(msg["data"]) for msg in messages)
+    
+    def test_binary_query_parameter(self, client, temp_cache):
+        """无法设置子协议的客户端可用 ?protocol=binary；控制消息仍为 JSON"""
+        from unittest.mock import patch
+        from services.fake import FakeTTSService
+        
+        with patch("services.synthesis.tts_service", FakeTTSService(latency=0)):
+            with client.websocket_connect("/ws/tts?protocol=binary") as websocket:
+                websocket.send_json({"type": "ping"})
+                assert websocket.receive_json()["type"] == "pong"
+                websocket.send_json({"text": "Query binary", "requestId": "bin-2"})
+                frames, _ = self._collect(websocket, "bin-2")
+        
+        assert frames and all(isinstance(frame, bytes) for frame in frames)
+
+
+class _SlowStream:
+    """每个分片间隔 delay 秒的提供方，记录被关闭的流"""
+    
+    def __init__(self, chunks=50, delay=0.02):
+        self.chunks = chunks
+        self.delay = delay
+        self.closed = []
+    
+    async def astream(self, text, voice="Cherry", language="en-US"):
+        import asyncio
+        try:
+            for _ in range(self.chunks):
+                await asyncio.sleep(self.delay)
+                yield "AAAAAAAA"
+        finally:
+            self.closed.append(text)
+
+
+class TestWebSocketMultiplexing:
+    """同一连接上的多路并发与取消测试 (不访问网络)"""
+    
+    def test_concurrent_requests_interleave(self, client, temp_cache):
+        """W07: 同一连接的多个请求同时进行，分片交错到达，各自以 done 结束"""
+        from unittest.mock import patch
+        
+        with patch("services.synthesis.tts_service", _SlowStream(chunks=5)):
+            with client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": "Multiplex one", "requestId": "a"})
+                websocket.send_json({"text": "Multiplex two", "requestId": "b"})
+                order = []
+                done = set()
+                while len(done) < 2:
+                    response = websocket.receive_json()
+                    if response["type"] == "audio":
+                        order.append(response["requestId"])
+                    elif response["type"] == "done":
+                        done.add(response["requestId"])
+        
+        assert order.count("a") == 5 and order.count("b") == 5
+        # 交错: b 的第一个分片早于 a 的最后一个分片
+        assert order.index("b") < len(order) - 1 - order[::-1].index("a")
+    
+    def test_cancel_stops_upstream_stream(self, client, temp_cache):
+        """W08: cancel 立即停止该请求的上游流，其他请求不受影响"""
+        from unittest.mock import patch
+        
+        provider = _SlowStream(chunks=200, delay=0.01)
+        with patch("services.synthesis.tts_service", provider):
+            with client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": "Cancel me", "requestId": "c"})
+                assert websocket.receive_json()["requestId"] == "c"
+                websocket.send_json({"type": "cancel", "requestId": "c"})
+                while True:
+                    response = websocket.receive_json()
+                    if response["type"] == "cancelled":
+                        break
+                    assert response["type"] == "audio"
+                
+                websocket.send_json({"type": "ping"})
+                assert websocket.receive_json()["type"] == "pong"
+        
+        assert provider.closed == ["Cancel me"]
+    
+    def test_cancel_releases_admission_slot(self, client, temp_cache):
+        """合成占用准入名额 (与 HTTP 接口相同)；取消后名额释放"""
+        import time
+        from unittest.mock import patch
+        from core.admission import admission
+        
+        provider = _SlowStream(chunks=200, delay=0.01)
+        with patch("services.synthesis.tts_service", provider):
+            with client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": "Hold a slot", "requestId": "s"})
+                assert websocket.receive_json()["type"] == "audio"
+                assert admission.get_stats()["in_use"] == 1
+                websocket.send_json({"type": "cancel", "requestId": "s"})
+                
+                deadline = time.monotonic() + 5
+                while admission.get_stats()["in_use"] and time.monotonic() < deadline:
+                    time.sleep(0.01)
+        
+        assert admission.get_stats()["in_use"] == 0
+        assert provider.closed == ["Hold a slot"]
+    
+    def test_follower_survives_leader_cancel(self, shared_loop_client, temp_cache):
+        """另一连接合并到同一合成时，发起方取消只让发起方停止接收，合成继续并写入缓存"""
+        import base64
+        import time
+        from unittest.mock import patch
+        from core.hash import generate_audio_hash
+        
+        provider = _SlowStream(chunks=30, delay=0.01)
+        with patch("services.synthesis.tts_service", provider):
+            with shared_loop_client.websocket_connect("/ws/tts") as leader, shared_loop_client.websocket_connect("/ws/tts") as follower:
+                leader.send_json({"text": "Shared sentence", "requestId": "l"})
+                assert leader.receive_json()["type"] == "audio"
+                follower.send_json({"text": "Shared sentence", "requestId": "f"})
+                first = follower.receive_json()
+                assert first["type"] == "audio"
+                leader.send_json({"type": "cancel", "requestId": "l"})
+                
+                pcm = base64.b64decode(first["data"])
+                while True:
+                    response = follower.receive_json()
+                    if response["type"] == "done":
+                        break
+                    assert response["type"] == "audio", response
+                    pcm += base64.b64decode(response["data"])
+                
+                audio_hash = generate_audio_hash("Shared sentence", "Cherry", "en-US", 1.0)
+                deadline = time.monotonic() + 5
+                while temp_cache.lookup(audio_hash) is None and time.monotonic() < deadline:
+                    time.sleep(0.01)
+        
+        # 合成只进行一次且完整: 发起方取消前已发布的分片经回放补齐
+        assert provider.closed == ["Shared sentence"]
+        assert pcm == b"\x00" * 6 * 30
+        assert temp_cache.lookup(audio_hash) is not None
+    
+    def test_in_flight_cap(self, client, temp_cache):
+        """超过 WS_MAX_IN_FLIGHT 的请求返回 error；重复的 requestId 同样拒绝"""
+        from unittest.mock import patch
+        
+        with patch("services.synthesis.tts_service", _SlowStream(chunks=100, delay=0.01)), \
+                patch("core.config.config.WS_MAX_IN_FLIGHT", 2):
+            with client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": "Cap one", "requestId": "1"})
+                websocket.send_json({"text": "Cap two", "requestId": "2"})
+                websocket.send_json({"text": "Cap two again", "requestId": "2"})
+                websocket.send_json({"text": "Cap three", "requestId": "3"})
+                errors = {}
+                while len(errors) < 2:
+                    response = websocket.receive_json()
+                    if response["type"] == "error":
+                        errors[response["requestId"]] = response["message"]
+        
+        assert set(errors) == {"2", "3"}
+
+
+class _CountingFake:
+    """记录调用次数的假提供方"""
+    
+    def __init__(self):
+        from services.fake import FakeTTSService
+        self.fake = FakeTTSService(latency=0)
+        self.calls = 0
+    
+    def astream(self, text, voice="Cherry", language="en-US"):
+        self.calls += 1
+        return self.fake.astream(text, voice, language)
+
+
+class TestWebSocketCache:
+    """WebSocket 与 HTTP 共用缓存测试 (不访问网络)"""
+    
+    def _receive_audio(self, websocket, request_id):
+        import base64
+        pcm = b""
+        while True:
+            response = websocket.receive_json()
+            if response["type"] == "done":
+                return pcm
+            assert response["type"] == "audio" and response["requestId"] == request_id, response
+            pcm += base64.b64decode(response["data"])
+    
+    def test_miss_is_cached_under_canonical_hash_then_served(self, client, temp_cache):
+        """W09: 未命中按 generate_audio_hash 写入缓存；再次请求由缓存发送，不调用提供方"""
+        import time
+        from unittest.mock import patch
+        from core.hash import generate_audio_hash
+        
+        provider = _CountingFake()
+        audio_hash = generate_audio_hash("Warm sentence.", "Cherry", "en-US", 1.0)
+        with patch("services.synthesis.tts_service", provider):
+            with client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": "Warm sentence.", "requestId": "1", "language": "English"})
+                first = self._receive_audio(websocket, "1")
+                
+                deadline = time.monotonic() + 5
+                while temp_cache.lookup(audio_hash) is None and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                
+                websocket.send_json({"text": "Warm sentence.", "requestId": "2", "language": "English"})
+                second = self._receive_audio(websocket, "2")
+        
+        assert provider.calls == 1
+        assert second == first == provider.fake.render("Warm sentence.", "Cherry", "en-US")
+        assert temp_cache.get_metadata(audio_hash)["language"] == "en-US"
+    
+    def test_ws_and_http_miss_share_one_synthesis(self, shared_loop_client, temp_cache):
+        """WebSocket 与 POST /tts/stream 同时未命中同一句: 合并为一次提供方调用，两边音频相同"""
+        import base64
+        from unittest.mock import patch
+        from services.dashscope import wav_to_pcm
+        
+        provider = _SlowStream(chunks=30, delay=0.01)
+        with patch("services.synthesis.tts_service", provider):
+            with shared_loop_client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": "Shared by both", "requestId": "w", "language": "English"})
+                first = websocket.receive_json()
+                assert first["type"] == "audio"
+                
+                response = shared_loop_client.post("/tts/stream", json={"text": "Shared by both", "language": "en-US"})
+                pcm = base64.b64decode(first["data"]) + self._receive_audio(websocket, "w")
+        
+        assert response.status_code == 200 and response.headers["X-Cache"] == "MISS"
+        assert provider.closed == ["Shared by both"]
+        assert wav_to_pcm(response.content) == pcm == b"\x00" * 6 * 30
+    
+    def test_same_cache_key_as_http(self, client, temp_cache):
+        """WebSocket 不另做文本清洗: 含 Markdown 的文本与 HTTP 接口得到同一个 Hash，写入后 HTTP 直接命中"""
+        import time
+        from unittest.mock import patch
+        from core.hash import generate_audio_hash
+        
+        text = "# Heading with **bold** and *italic* text"
+        audio_hash = generate_audio_hash(text, "Cherry", "en-US", 1.0)
+        provider = _CountingFake()
+        with patch("services.synthesis.tts_service", provider):
+            with client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": text, "requestId": "md", "language": "English"})
+                self._receive_audio(websocket, "md")
+            
+            deadline = time.monotonic() + 5
+            while temp_cache.lookup(audio_hash) is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            response = client.post("/tts/stream", json={"text": text, "language": "en-US"})
+        
+        assert response.headers["X-Audio-Hash"] == audio_hash
+        assert response.headers["X-Cache"] == "HIT"
+        assert provider.calls == 1
+    
+    def test_cached_audio_is_paced(self):
+        """命中的音频: 预缓冲部分立即发送，其余按实时倍数发送"""
+        import asyncio
+        import time
+        from unittest.mock import patch
+        from api.websocket import _Pacer, _audio_seconds, _cached_messages
+        
+        pcm = b"\x00\x00" * 24000 * 2  # 2 秒
+        
+        async def collect():
+            pacer = _Pacer()
+            times = []
+            for msg in _cached_messages(pcm):
+                await pacer.wait()
+                times.append(time.monotonic() - pacer.started)
+                pacer.advance(_audio_seconds(msg))
+            return times
+        
+        with patch("core.config.config.WS_CACHE_CHUNK_MS", 500), \
+                patch("core.config.config.WS_CACHE_PREBUFFER_MS", 1000), \
+                patch("core.config.config.WS_CACHE_PACE", 10.0):
+            chunks = _cached_messages(pcm)
+            times = asyncio.run(collect())
+        
+        assert b"".join(msg["pcm"] for msg in chunks) == pcm and len(chunks) == 4
+        assert times[2] < 0.02
+        # 第 4 片起点 1.5 秒，超出预缓冲 0.5 秒，10 倍速 → 约 0.05 秒
+        assert 0.04 <= times[3] < 0.5
+
+
+class _ConcurrencyFake(_CountingFake):
+    """记录同时进行的合成数"""
+    
+    def __init__(self):
+        super().__init__()
+        self.fake.latency = 0.05
+        self.active = 0
+        self.peak = 0
+    
+    async def astream(self, text, voice="Cherry", language="en-US"):
+        self.calls += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            async for data in self.fake.astream(text, voice, language):
+                yield data
+        finally:
+            self.active -= 1
+
+
+class TestWebSocketLongText:
+    """长文本分段流水线测试 (不访问网络)"""
+    
+    SENTENCES = [f"Sentence number {i} is long enough to need its own segment here." for i in range(5)]
+    
+    def test_all_segments_streamed_in_order_and_cached(self, client, temp_cache):
+        """W10: 每段都合成并按顺序发送 (seq 连续、segment 递增)，预取深度受限，各段单独缓存"""
+        import base64
+        import time
+        from unittest.mock import patch
+        from core.hash import generate_audio_hash
+        from core.stream_metrics import ws_latency
+        
+        provider = _ConcurrencyFake()
+        text = " ".join(self.SENTENCES)
+        gaps_before = ws_latency.segment_gap.count
+        with patch("services.synthesis.tts_service", provider), \
+                patch("core.config.config.MAX_TEXT_LENGTH", 80), \
+                patch("core.config.config.WS_PIPELINE_DEPTH", 2):
+            with client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": text, "requestId": "long", "language": "English"})
+                messages = []
+                while True:
+                    response = websocket.receive_json()
+                    if response["type"] == "done":
+                        break
+                    assert response["type"] == "audio", response
+                    messages.append(response)
+        
+        assert response["segments"] == 5 and response["chunks"] == len(messages)
+        assert [msg["seq"] for msg in messages] == list(range(len(messages)))
+        segments = [msg["segment"] for msg in messages]
+        assert segments == sorted(segments) and set(segments) == set(range(5))
+        expected = b"".join(provider.fake.render(s, "Cherry", "en-US") for s in self.SENTENCES)
+        assert b"".join(base64.b64decode(msg["data"]) for msg in messages) == expected
+        assert provider.calls == 5 and provider.peak == 2
+        assert ws_latency.segment_gap.count - gaps_before == 4
+        
+        hashes = [generate_audio_hash(s, "Cherry", "en-US", 1.0) for s in self.SENTENCES]
+        deadline = time.monotonic() + 5
+        while not all(temp_cache.lookup(h) for h in hashes) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert all(temp_cache.lookup(h) for h in hashes)
+    
+    def test_error_stops_remaining_segments(self, client, temp_cache):
+        """某段失败: 发送 error 与 done，不再发送后续段，失败段不写入缓存"""
+        from unittest.mock import patch
+        from core.hash import generate_audio_hash
+        
+        class Failing(_CountingFake):
+            def astream(self, text, voice="Cherry", language="en-US"):
+                if "number 1" in text:
+                    raise RuntimeError("upstream down")
+                return super().astream(text, voice, language)
+        
+        provider = Failing()
+        with patch("services.synthesis.tts_service", provider), \
+                patch("core.config.config.MAX_TEXT_LENGTH", 80):
+            with client.websocket_connect("/ws/tts") as websocket:
+                websocket.send_json({"text": " ".join(self.SENTENCES[:3]), "requestId": "fail"})
+                types = []
+                segments = set()
+                while True:
+                    response = websocket.receive_json()
+                    types.append(response["type"])
+                    if response["type"] == "audio":
+                        segments.add(response["segment"])
+                    if response["type"] == "done":
+                        break
+        
+        assert segments == {0}
+        assert types[-2:] == ["error", "done"]
+        assert temp_cache.lookup(generate_audio_hash(self.SENTENCES[1], "Cherry", "en-US", 1.0)) is None
@@ -11,6 +11,7 @@ TTS 单元测试 (Pure Unit Tests with Mocking)
 import pytest
 from unittest.mock import patch, MagicMock
 import wave
+import shutil
 import io
 
 # 模拟的 PCM 数据 (1 秒 24kHz 16-bit mono)
@@ -96,9 +97,1561 @@ class TestCacheManagerUnit:
         # 写入后不应存在 .tmp 文件
         manager.save_audio("atomic_test", b"data")
         
-        tmp_files = list(tmp_path.glob("*.tmp"))
+        tmp_files = list(tmp_path.rglob("*.tmp"))
         assert len(tmp_files) == 0
 
+    def test_atomic_write_variants_do_not_share_temp_file(self, tmp_path):
+        """同一 Hash 的主文件与各格式变体并发写入时各自使用唯一的临时文件，内容互不覆盖"""
+        from concurrent.futures import ThreadPoolExecutor
+        from core.cache import CacheManager
+
+        paths = {ext: tmp_path / f"{'a' * 32}.{ext}" for ext in ("wav", "opus", "mp3", "aac")}
+        payloads = {ext: ext.encode() * 200000 for ext in paths}
+
+        def write(ext):
+            for _ in range(5):
+                CacheManager._atomic_write(paths[ext], payloads[ext])
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(write, paths))
+
+        assert all(paths[ext].read_bytes() == payloads[ext] for ext in paths)
+        assert not list(tmp_path.rglob("*.tmp"))
+        assert all(paths[ext].stat().st_mode & 0o777 == 0o644 for ext in paths)
+
+
+class TestCacheLayoutUnit:
+    """分片目录布局单元测试"""
+
+    HASH = "abcdef0123456789abcdef0123456789"
+
+    def test_sharded_path_and_url(self, tmp_path):
+        """分片布局应生成 ab/cd/<hash>.wav 路径与对应 URL"""
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path, shard_depth=2, shard_width=2)
+        path = manager.save_audio(self.HASH, b"data")
+
+        assert path == tmp_path / "ab" / "cd" / f"{self.HASH}.wav"
+        assert manager.get_audio_url(self.HASH, path) == f"/audio/ab/cd/{self.HASH}.wav"
+
+    def test_read_falls_back_to_flat(self, tmp_path):
+        """过渡期扁平文件仍应命中，并返回扁平 URL"""
+        from core.cache import CacheManager
+
+        (tmp_path / f"{self.HASH}.wav").write_bytes(b"legacy")
+        manager = CacheManager(cache_dir=tmp_path, shard_depth=2, shard_width=2)
+
+        path = manager.find_audio_path(self.HASH)
+        assert manager.exists(self.HASH) is True
+        assert manager.get_audio_url(self.HASH, path) == f"/audio/{self.HASH}.wav"
+
+    def test_migrator_moves_in_batches(self, tmp_path):
+        """迁移器应分批移动扁平文件，且不触碰非 Hash 文件"""
+        from core.cache_layout import CacheLayout, CacheLayoutMigrator
+
+        hashes = [f"{i:02x}" + "0" * 30 for i in range(5)]
+        for h in hashes:
+            (tmp_path / f"{h}.wav").write_bytes(b"x")
+        (tmp_path / "metadata.json").write_text("{}")
+
+        layout = CacheLayout(tmp_path, depth=2, width=2)
+        migrator = CacheLayoutMigrator(layout, batch_size=2, pause=0)
+
+        assert migrator.migrate_batch() == 2
+        assert migrator.run() == 5
+        assert all(layout.path_for(h, "wav").exists() for h in hashes)
+        assert not list(tmp_path.glob("*.wav"))
+        assert (tmp_path / "metadata.json").exists()
+
+    def test_fallback_rules_share_extensions(self):
+        """迁移器、Nginx 与 Next.js 的扁平 URL 回退规则覆盖同一组扩展名"""
+        import re
+        from pathlib import Path
+        from core.cache_layout import HASH_FILE_EXTENSIONS
+        from core.transcode import AUDIO_VARIANTS
+
+        import pytest
+
+        root = Path(__file__).resolve().parents[2]
+        if not (root / "nginx" / "nginx.conf").exists():
+            pytest.skip("仅在完整仓库中运行 (TTS 服务镜像不含 Nginx/Next.js 配置)")
+        nginx = re.search(r'\[0-9a-f\]\{28\}\\\.\(([a-z0-9|]+)\)', (root / "nginx" / "nginx.conf").read_text())
+        nextjs = re.search(r'\[0-9a-f\]\{28\}\\\\\.\(\?:([a-z0-9|]+)\)', (root / "next.config.mjs").read_text())
+
+        assert nginx.group(1).split("|") == list(HASH_FILE_EXTENSIONS)
+        assert nextjs.group(1).split("|") == list(HASH_FILE_EXTENSIONS)
+        assert {variant.ext for variant in AUDIO_VARIANTS.values()} <= set(HASH_FILE_EXTENSIONS)
+
+
+class TestMetadataStoreUnit:
+    """SQLite 元数据后端单元测试"""
+
+    def test_upsert_and_get(self, tmp_path):
+        """upsert 后应能按 Hash 读取，额外字段保留"""
+        from core.metadata_store import SQLiteMetadataStore
+
+        store = SQLiteMetadataStore(tmp_path / "metadata.db")
+        store.upsert("h1", {"text": "Hello", "voice": "Cherry", "language": "en-US",
+                            "speed": 1.0, "created_at": "2026-01-01T00:00:00", "source": "aliyun"})
+        store.upsert("h1", {"text": "Hello", "voice": "Cherry", "language": "en-US",
+                            "speed": 1.0, "created_at": "2026-02-01T00:00:00"})
+
+        item = store.get("h1")
+        assert item["voice"] == "Cherry"
+        assert item["created_at"] == "2026-01-01T00:00:00"
+        assert store.get("missing") is None
+        assert store.count() == 1
+
+    def test_query_filters(self, tmp_path):
+        """应支持按 voice / language / created_at 过滤"""
+        from core.metadata_store import SQLiteMetadataStore
+
+        store = SQLiteMetadataStore(tmp_path / "metadata.db")
+        store.upsert_many([
+            {"hash": "a", "voice": "Cherry", "language": "en-US", "created_at": "2026-01-01"},
+            {"hash": "b", "voice": "Ethan", "language": "en-US", "created_at": "2026-01-02"},
+            {"hash": "c", "voice": "Cherry", "language": "zh-CN", "created_at": "2026-01-03"},
+        ])
+
+        assert [i["hash"] for i in store.query(voice="Cherry")] == ["c", "a"]
+        assert [i["hash"] for i in store.query(language="en-US", since="2026-01-02")] == ["b"]
+
+    def test_legacy_json_imported_once(self, tmp_path):
+        """首次启动应导入 metadata.json 并归档"""
+        import json
+        from core.cache import CacheManager
+
+        (tmp_path / "metadata.json").write_text(json.dumps({
+            "legacy": {"text": "Old", "voice": "Cherry", "created_at": "2025-12-01"}
+        }))
+
+        manager = CacheManager(cache_dir=tmp_path)
+        assert manager.get_metadata("legacy")["text"] == "Old"
+        assert not (tmp_path / "metadata.json").exists()
+        assert (tmp_path / "metadata.json.imported").exists()
+
+    def test_incomplete_backend_cannot_be_instantiated(self):
+        """后端缺少必需方法时在构造阶段报错，而不是运行到某条路径才抛 NotImplementedError"""
+        import pytest
+        from core.metadata_store import JsonMetadataStore, MetadataStore, SQLiteMetadataStore
+
+        class PartialStore(MetadataStore):
+            def get(self, hash_key):
+                return None
+
+        with pytest.raises(TypeError):
+            PartialStore()
+        assert not JsonMetadataStore.__abstractmethods__
+        assert not SQLiteMetadataStore.__abstractmethods__
+
+
+class TestCacheIndexUnit:
+    """缓存存在性索引单元测试"""
+
+    HASH = "0123456789abcdef0123456789abcdef"
+
+    def test_hit_without_syscalls(self, tmp_path):
+        """索引加载后命中判断不应访问磁盘"""
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.index.load()
+        manager.save_audio(self.HASH, b"audio data")
+
+        with patch("pathlib.Path.stat", side_effect=AssertionError("stat called")):
+            cached = manager.lookup(self.HASH)
+
+        assert cached.size == len(b"audio data")
+        assert cached.path == manager.get_audio_path(self.HASH)
+
+    def test_miss_verified_on_disk(self, tmp_path):
+        """其他进程写入的文件应在未命中确认时补进索引"""
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.index.load()
+        (tmp_path / f"{self.HASH}.wav").write_bytes(b"external")
+
+        assert manager.exists(self.HASH) is True
+        assert manager.index.get(self.HASH).size == len(b"external")
+
+    def test_snapshot_round_trip(self, tmp_path):
+        """快照重新加载后应恢复全部条目，且不重扫目录"""
+        from core.cache import CacheManager
+        from core.cache_index import CacheIndex
+
+        manager = CacheManager(cache_dir=tmp_path, shard_depth=2)
+        manager.index.load()
+        manager.save_audio(self.HASH, b"12345")
+        assert manager.index.save_snapshot()
+
+        index = CacheIndex(manager.layout, "wav")
+        with patch.object(CacheIndex, "scan", side_effect=AssertionError("rescanned")):
+            index.load()
+
+        assert index.get(self.HASH).size == 5
+        assert index.path_for(self.HASH, index.get(self.HASH)) == manager.get_audio_path(self.HASH)
+
+    def test_rebuild_keeps_updates_made_during_scan(self, tmp_path):
+        """对账扫描期间的写入保留、删除生效；bloom 模式重复写入不重复计数"""
+        from core.cache import CacheManager
+        from core.cache_index import CacheIndex
+
+        manager = CacheManager(cache_dir=tmp_path)
+        for key in ("a" * 32, "b" * 32):
+            manager.save_audio(key, b"audio")
+        index = manager.index
+        index.load()
+        real_scan = CacheIndex.scan
+
+        def scan_with_updates(self):
+            for item in real_scan(self):
+                yield item
+            # 扫描已看到 a / b 之后: 写入 c，淘汰 a
+            index.add("c" * 32, 5, 0)
+            index.discard("a" * 32)
+
+        with patch.object(CacheIndex, "scan", scan_with_updates):
+            assert index.build() == 2
+
+        assert index.get("a" * 32) is None
+        assert index.get("b" * 32) is not None and index.get("c" * 32) is not None
+
+        bloom = CacheIndex(manager.layout, "wav", mode="bloom")
+        bloom.add(self.HASH, 5, 0)
+        bloom.add(self.HASH, 5, 0)
+        assert bloom.count == 1 and bloom.total_bytes == 5
+
+    def test_bloom_filter_false_positive_rate(self):
+        """Bloom Filter 不应漏报，误报率应在设计范围内"""
+        from core.cache_index import BloomFilter
+
+        bloom = BloomFilter(capacity=1000)
+        bloom.add(self.HASH)
+
+        assert self.HASH in bloom
+        assert sum(f"{i:032x}" in bloom for i in range(1000)) < 50
+
+
+class TestCacheEvictionUnit:
+    """容量淘汰单元测试"""
+
+    def _manager(self, tmp_path, budget_bytes):
+        import os
+        from core.cache import CacheManager
+        from core.cache_eviction import CacheEvictor
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.index.load()
+        manager.evictor = CacheEvictor(manager, budget_bytes=budget_bytes, low_watermark=1.0)
+
+        # 写入 4 个 100 字节的条目 (内容各不相同，不触发去重)，访问时间依次递增
+        for i, cache_type in enumerate(["temporary", "temporary", "vocab", "temporary"]):
+            hash_key = f"{i:032x}"
+            path = manager.save_audio(hash_key, bytes([i]) * 100, {"cache_type": cache_type})
+            os.utime(path, (1000 + i, 1000 + i))
+            manager.metadata_store.record_access({hash_key: (1000 + i, 0, None)})
+        return manager
+
+    def test_lru_evicts_oldest_temporary_first(self, tmp_path):
+        """超出预算时按 LRU 淘汰 temporary，vocab 永不淘汰"""
+        manager = self._manager(tmp_path, budget_bytes=200)
+
+        evicted = manager.evictor.tick()
+
+        assert evicted == 2
+        assert manager.lookup(f"{0:032x}") is None
+        assert manager.lookup(f"{1:032x}") is None
+        assert manager.lookup(f"{2:032x}") is not None
+        assert manager.get_cache_stats()["eviction"]["evicted_bytes"] == 200
+
+    def test_recent_hit_protects_entry(self, tmp_path):
+        """最近命中的条目应排到淘汰队列末尾"""
+        manager = self._manager(tmp_path, budget_bytes=300)
+
+        manager.lookup(f"{0:032x}")
+        manager.evictor.tick()
+
+        assert manager.lookup(f"{0:032x}") is not None
+        assert manager.lookup(f"{1:032x}") is None
+
+    def test_permanent_entries_never_evicted(self, tmp_path):
+        """只剩永久条目时即使超预算也不删除"""
+        manager = self._manager(tmp_path, budget_bytes=1)
+
+        for _ in range(3):
+            manager.evictor.tick()
+
+        assert manager.lookup(f"{2:032x}") is not None
+        assert manager.evictor.evictions == 3
+
+
+class TestCacheStatsUnit:
+    """增量缓存统计单元测试"""
+
+    def test_counters_track_writes_hits_and_misses(self, tmp_path):
+        """写入 / 命中 / 未命中按维度累加，读取不遍历目录"""
+        from unittest.mock import patch
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.save_audio("a" * 32, b"x" * 100, {"voice": "Cherry", "language": "en-US"})
+        manager.save_audio("b" * 32, b"x" * 50, {"voice": "Ethan", "language": "en-US"})
+        manager.lookup("a" * 32, voice="Cherry")
+        manager.lookup("c" * 32, voice="Cherry")
+
+        with patch("os.walk") as walk, patch("pathlib.Path.glob") as glob:
+            stats = manager.get_cache_stats()
+            walk.assert_not_called()
+            glob.assert_not_called()
+
+        assert stats["total_files"] == 2
+        assert stats["total_size_bytes"] == 150
+        assert stats["writes"] == 2
+        assert stats["hits"] == 1 and stats["misses"] == 1
+        assert stats["by_voice"]["Cherry"] == {"files": 1, "bytes": 100, "writes": 1, "hits": 1, "misses": 1}
+        assert stats["by_language"]["en-US"]["bytes"] == 150
+        assert stats["by_format"]["wav"]["files"] == 2
+
+    def test_counters_persist_across_restart(self, tmp_path):
+        """落库后新实例可读到历史计数；覆盖写入只更新字节数"""
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.save_audio("a" * 32, b"x" * 100, {"voice": "Cherry"})
+        manager.save_audio("a" * 32, b"x" * 40, {"voice": "Cherry"})
+        manager.stats.flush()
+        manager.close()
+
+        stats = CacheManager(cache_dir=tmp_path).get_cache_stats()
+        assert stats["total_files"] == 1
+        assert stats["total_size_bytes"] == 40
+        assert stats["writes"] == 2
+
+    def test_recompute_audits_directory(self, tmp_path):
+        """recompute 以磁盘为准修正 files / bytes，保留历史累计值"""
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.save_audio("a" * 32, b"x" * 100, {"voice": "Cherry"})
+        manager.save_audio("b" * 32, b"x" * 100, {"voice": "Cherry"})
+        # 外部删除一个文件，另一个进程写入一个没有元数据的文件
+        manager.get_audio_path("a" * 32).unlink()
+        (tmp_path / f"{'d' * 32}.wav").write_bytes(b"x" * 10)
+
+        stats = manager.get_cache_stats(recompute=True)
+
+        assert stats["total_files"] == 2
+        assert stats["total_size_bytes"] == 110
+        assert stats["writes"] == 2
+        assert stats["by_voice"]["Cherry"]["files"] == 1
+        assert stats["by_format"]["wav"]["bytes"] == 110
+        assert stats["last_audit_at"] is not None
+
+
+class TestCacheAsyncIOUnit:
+    """缓存异步接口单元测试"""
+
+    def test_slow_write_does_not_block_event_loop(self, tmp_path):
+        """慢盘写入期间事件循环延迟应保持平稳"""
+        import asyncio
+        import os
+        import time
+        from unittest.mock import patch
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        real_replace = os.replace
+
+        def slow_replace(src, dst):
+            time.sleep(0.3)
+            real_replace(src, dst)
+
+        async def measure_lag():
+            worst = 0.0
+            for _ in range(20):
+                started = time.monotonic()
+                await asyncio.sleep(0.01)
+                worst = max(worst, time.monotonic() - started - 0.01)
+            return worst
+
+        async def scenario():
+            with patch("core.cache.os.replace", side_effect=slow_replace):
+                save = asyncio.create_task(manager.asave_audio("a" * 32, b"x" * 100))
+                lag = await measure_lag()
+                await save
+            return lag
+
+        lag = asyncio.run(scenario())
+        manager.close()
+
+        assert lag < 0.1
+        assert (tmp_path / f"{'a' * 32}.wav").read_bytes() == b"x" * 100
+
+    def test_alookup_hit_resolved_by_index(self, tmp_path):
+        """索引命中时不进入线程池"""
+        import asyncio
+        from unittest.mock import patch
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.index.load()
+        manager.save_audio("a" * 32, b"x" * 100)
+
+        with patch.object(manager, "run_io") as run_io:
+            cached = asyncio.run(manager.alookup("a" * 32))
+            run_io.assert_not_called()
+
+        assert cached.size == 100
+        manager.close()
+
+
+    def test_access_log_flush_is_thread_safe(self, tmp_path):
+        """多线程记录命中的同时落库，访问次数不丢失"""
+        import threading
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        recorded = {}
+
+        def record_access(records):
+            for hash_key, (_, hits, _) in records.items():
+                recorded[hash_key] = recorded.get(hash_key, 0) + hits
+
+        manager.metadata_store.record_access = record_access
+        keys = [f"{i:032x}" for i in range(50)]
+
+        def hit():
+            for _ in range(40):
+                for key in keys:
+                    manager.touch(key)
+
+        threads = [threading.Thread(target=hit) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            manager.flush_access_log()
+        manager.flush_access_log()
+        manager.close()
+
+        assert sum(recorded.values()) == 4 * 40 * len(keys)
+
+
+class TestCacheDedupUnit:
+    """内容去重单元测试"""
+
+    def test_identical_audio_shares_one_file(self, tmp_path):
+        """相同内容的不同 Hash 硬链接到同一数据，磁盘只占一份"""
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.index.load()
+        first = manager.save_audio("a" * 32, b"x" * 100)
+        second = manager.save_audio("b" * 32, b"x" * 100)
+
+        assert first.stat().st_ino == second.stat().st_ino
+        assert manager.index.total_bytes == 200
+        assert manager.index.unique_bytes == 100
+        assert manager.get_cache_stats()["deduped_bytes"] == 100
+
+        # 对账重建后共享字节数保持一致
+        manager.index.build()
+        assert manager.index.unique_bytes == 100
+
+    def test_evicting_shared_link_frees_nothing(self, tmp_path):
+        """淘汰仍被引用的链接不计入释放字节，数据对其他 Hash 保持可用"""
+        from core.cache import CacheManager
+        from core.cache_eviction import CacheEvictor
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.index.load()
+        manager.save_audio("a" * 32, b"x" * 100)
+        manager.save_audio("b" * 32, b"x" * 100, {"cache_type": "vocab"})
+        manager.save_audio("c" * 32, b"y" * 100)
+        manager.evictor = CacheEvictor(manager, budget_bytes=150, low_watermark=1.0)
+
+        manager.evictor.tick()
+
+        assert manager.lookup("a" * 32) is None
+        assert manager.lookup("c" * 32) is None
+        assert manager.lookup("b" * 32).path.read_bytes() == b"x" * 100
+        assert manager.evictor.evicted_bytes == 100
+        assert manager.index.unique_bytes == 100
+
+    def test_dedupe_pass_reclaims_existing_duplicates(self, tmp_path):
+        """一次性去重: 已有的重复文件改为硬链接并报告回收空间"""
+        from core.cache_dedup import CacheDeduplicator
+        from core.metadata_store import SQLiteMetadataStore
+
+        for name in ("a", "b", "c"):
+            (tmp_path / f"{name * 32}.wav").write_bytes(b"x" * 100)
+        (tmp_path / f"{'d' * 32}.wav").write_bytes(b"z" * 100)
+        store = SQLiteMetadataStore(tmp_path / "metadata.db")
+
+        dry = CacheDeduplicator(tmp_path, store=store, dry_run=True).run()
+        report = CacheDeduplicator(tmp_path, store=store).run()
+
+        assert dry["reclaimed_bytes"] == report["reclaimed_bytes"] == 200
+        assert len({(tmp_path / f"{n * 32}.wav").stat().st_ino for n in "abc"}) == 1
+        assert sorted(store.find_by_digest(store.get("a" * 32)["digest"])) == ["a" * 32, "b" * 32, "c" * 32]
+        assert CacheDeduplicator(tmp_path, store=store).run()["reclaimed_bytes"] == 0
+
+
+class TestHotAudioCacheUnit:
+    """热点音频内存缓存单元测试"""
+
+    def test_lru_respects_byte_budget(self):
+        """超出字节预算时淘汰最久未用条目，超大条目不装入"""
+        from core.hot_cache import HotAudio, HotAudioCache
+
+        cache = HotAudioCache(max_bytes=250, max_item_bytes=150)
+        for key in ("a", "b"):
+            assert cache.put(key, HotAudio(b"x" * 100, '"etag"', "wav"))
+        cache.get("a")
+        cache.put("c", HotAudio(b"x" * 100, '"etag"', "wav"))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.used_bytes == 200
+        assert cache.put("big", HotAudio(b"x" * 200, '"etag"', "wav")) is False
+
+    def test_save_invalidates_hot_entry(self, tmp_path):
+        """覆盖写入后不再返回旧的内存内容"""
+        import asyncio
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.save_audio("a" * 32, b"old")
+        assert asyncio.run(manager.aread_audio("a" * 32)).data == b"old"
+
+        manager.save_audio("a" * 32, b"new")
+        assert asyncio.run(manager.aread_audio("a" * 32)).data == b"new"
+        manager.close()
+
+
+class TestTranscodeUnit:
+    """压缩变体与格式协商单元测试"""
+
+    def test_negotiate_format_from_accept(self):
+        """按 q 值选择已支持的音频类型，非音频类型忽略"""
+        from core.transcode import negotiate_format
+
+        assert negotiate_format(None) is None
+        assert negotiate_format("application/json, */*") is None
+        assert negotiate_format("audio/ogg; codecs=opus, audio/mpeg;q=0.8") == "opus"
+        assert negotiate_format("audio/ogg;q=0.5, audio/mpeg") == "mp3"
+        assert negotiate_format("audio/mp4;q=0, audio/wav;q=0.1") == "wav"
+
+    def test_availability_resolved_once(self):
+        """ffmpeg 只在首次检查时查找一次；关闭转码时不查找"""
+        from unittest.mock import patch
+        from core.transcode import Transcoder
+
+        transcoder = Transcoder(max_workers=1)
+        with patch("core.transcode.shutil.which", return_value="/usr/bin/ffmpeg") as which:
+            assert all(transcoder.available for _ in range(3))
+            assert Transcoder(max_workers=-1).available is False
+        assert which.call_count == 1
+
+    def test_variant_created_lazily_and_removed_with_source(self, tmp_path):
+        """首次请求时转码生成变体；主文件淘汰 / 覆盖时变体一并删除"""
+        import asyncio
+        from unittest.mock import patch
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.save_audio("a" * 32, b"RIFF" + b"x" * 96)
+
+        async def fake_transcode(wav_data, fmt):
+            return f"{fmt}:{len(wav_data)}".encode()
+
+        manager.transcoder.transcode = fake_transcode
+        with patch("core.transcode.transcoding_available", return_value=True):
+            variant = asyncio.run(manager.aensure_variant("a" * 32, "opus"))
+            audio = asyncio.run(manager.aread_audio("a" * 32, "opus"))
+
+        assert variant.path == tmp_path / f"{'a' * 32}.opus"
+        assert audio.data == b"opus:100"
+        assert manager.get_cache_stats()["by_format"]["opus"]["files"] == 1
+
+        manager.save_audio("a" * 32, b"RIFF" + b"y" * 96)
+        assert not variant.path.exists()
+        manager.close()
+
+    def test_variant_unavailable_without_ffmpeg(self, tmp_path):
+        """ffmpeg 不可用时返回 None，由调用方回退为 wav"""
+        import asyncio
+        from unittest.mock import patch
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        manager.save_audio("a" * 32, b"RIFF" + b"x" * 96)
+
+        with patch("core.transcode.transcoding_available", return_value=False):
+            assert asyncio.run(manager.aensure_variant("a" * 32, "mp3")) is None
+            assert asyncio.run(manager.aensure_variant("a" * 32, "wav")).size == 100
+        manager.close()
+
+    @pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="需要 ffmpeg")
+    def test_transcode_to_opus_is_smaller(self):
+        """真实转码: 1 秒静音 WAV → Opus 体积明显更小"""
+        import io
+        import wave
+        from core.transcode import transcode
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(24000)
+            wav_file.writeframes(b"\x00\x00" * 24000)
+        wav_data = buffer.getvalue()
+
+        opus_data = transcode(wav_data, "opus")
+        assert opus_data[:4] == b"OggS"
+        assert len(opus_data) * 5 < len(wav_data)
+
+
+class TestCacheBulkCheckUnit:
+    """批量存在性检查单元测试"""
+
+    @staticmethod
+    def _hashes(count):
+        return [f"{i:032x}" for i in range(count)]
+
+    def test_disk_pass_covers_sharded_and_flat_files(self, tmp_path):
+        """未加载索引时按目录批量查磁盘 (scandir 与逐个 stat 两条路径)"""
+        from unittest.mock import patch
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path, shard_depth=2, shard_width=2)
+        hashes = self._hashes(40)
+        for h in hashes[:20]:
+            manager.save_audio(h, b"RIFF" + h.encode())
+        (tmp_path / f"{hashes[20]}.wav").write_bytes(b"legacy")
+        (tmp_path / f"{hashes[21]}.wav").write_bytes(b"")
+
+        for scandir_min in (1, 1000):
+            with patch("core.cache.config.CACHE_CHECK_SCANDIR_MIN", scandir_min):
+                results = manager.check_many(hashes)
+            assert list(results) == hashes
+            assert results[hashes[0]] == (f"/audio/00/00/{hashes[0]}.wav", 36)
+            assert all(results[h][1] == 36 for h in hashes[:20])
+            assert results[hashes[20]] == (f"/audio/{hashes[20]}.wav", 6)
+            assert all(results[h] is None for h in hashes[21:])
+
+        assert manager.get_cache_stats()["hits"] == 0
+        manager.close()
+
+    def test_index_answers_without_disk(self, tmp_path):
+        """索引已加载且不确认未命中时，不触碰磁盘"""
+        import asyncio
+        from unittest.mock import patch
+        from core.cache import CacheManager
+
+        manager = CacheManager(cache_dir=tmp_path)
+        hashes = self._hashes(1000)
+        for h in hashes[:10]:
+            manager.save_audio(h, b"RIFF" + h.encode())
+        manager.index.load()
+
+        with patch("core.cache.config.CACHE_INDEX_VERIFY_MISSES", False), \
+                patch.object(manager, "_check_on_disk", side_effect=AssertionError("disk")):
+            results = asyncio.run(manager.acheck_many(hashes))
+
+        assert sum(1 for audio in results.values() if audio) == 10
+        assert results[hashes[0]] == (f"/audio/{hashes[0]}.wav", 36)
+        manager.close()
+
+
+class TestSingleFlightUnit:
+    """请求合并单元测试"""
+
+    def test_concurrent_calls_share_one_execution(self):
+        """并发的相同 Key 只执行一次，所有等待者得到同一结果"""
+        import asyncio
+        from core.singleflight import SingleFlight
+
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "audio"
+
+        async def scenario():
+            return await asyncio.gather(*(flights.do("k", work) for _ in range(5)))
+
+        results = asyncio.run(scenario())
+
+        assert len(calls) == 1
+        assert [r for r, _ in results] == ["audio"] * 5
+        assert [shared for _, shared in results].count(False) == 1
+        assert flights.get_stats() == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+    def test_error_propagates_and_leader_cancel_is_isolated(self):
+        """异常传递给所有等待者；leader 被取消时 follower 仍拿到结果"""
+        import asyncio
+        from core.singleflight import SingleFlight
+
+        flights = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        async def scenario():
+            errors = await asyncio.gather(
+                flights.do("bad", fail), flights.do("bad", fail), return_exceptions=True
+            )
+            leader = asyncio.ensure_future(flights.do("k", slow))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flights.do("k", slow))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return errors, await follower
+
+        errors, (result, shared) = asyncio.run(scenario())
+
+        assert all(isinstance(e, ValueError) for e in errors)
+        assert result == "ok" and shared is True
+
+    def test_stream_replays_published_chunks(self):
+        """follower 先回放已发布的分片，再接收后续分片"""
+        import asyncio
+        from core.singleflight import SingleFlight
+
+        flights = SingleFlight()
+
+        async def scenario():
+            flight, leader = flights.join("a" * 32)
+            flight.publish("c1")
+            follower, is_leader = flights.join("a" * 32)
+            received = []
+
+            async def consume():
+                async for chunk in follower.stream():
+                    received.append(chunk)
+
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0)
+            flight.publish("c2")
+            flights.finish(flight)
+            await task
+            return leader, is_leader, received
+
+        leader, is_leader, received = asyncio.run(scenario())
+
+        assert leader is True and is_leader is False
+        assert received == ["c1", "c2"]
+
+    def test_on_idle_fires_when_last_subscriber_leaves(self):
+        """订阅者 (stream / wait) 全部离开且未完成时调用 on_idle；仍有订阅者时不调用"""
+        import asyncio
+        from core.singleflight import SingleFlight
+
+        flights = SingleFlight()
+        idle = []
+
+        async def scenario():
+            flight, _ = flights.join("k")
+            flight.on_idle = lambda: idle.append(flight.subscribers)
+
+            async def consume():
+                async for _ in flight.stream():
+                    pass
+
+            streaming = asyncio.ensure_future(consume())
+            waiting = asyncio.ensure_future(flight.wait())
+            await asyncio.sleep(0)
+            assert flight.subscribers == 2
+            streaming.cancel()
+            await asyncio.sleep(0)
+            assert idle == []
+            waiting.cancel()
+            await asyncio.sleep(0)
+            return flight
+
+        flight = asyncio.run(scenario())
+
+        assert idle == [0] and flight.subscribers == 0
+
+    def test_synthesize_to_cache_calls_dashscope_once(self, temp_cache):
+        """并发未命中只调用一次合成并写入一次缓存"""
+        import asyncio
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        from services.synthesis import synthesize_to_cache
+
+        calls = []
+
+        async def fake_synthesize(text, voice, language, speed):
+            calls.append(text)
+            await asyncio.sleep(0.05)
+            return b"RIFF" + b"\x00" * 4 + b"WAVE" + b"x" * 88
+
+        async def scenario():
+            return await asyncio.gather(*(
+                synthesize_to_cache("a" * 32, "hi", "Cherry", "en-US", 1.0) for _ in range(3)
+            ))
+
+        with patch("services.synthesis.tts_service", SimpleNamespace(asynthesize=fake_synthesize)):
+            results = asyncio.run(scenario())
+
+        assert calls == ["hi"]
+        assert {audio.size for audio, _ in results} == {100}
+        assert temp_cache.get_cache_stats()["writes"] == 1
+
+
+class TestTextSplitUnit:
+    """长文本分句单元测试"""
+
+    def test_splits_sentences_and_long_clauses(self):
+        """中英文句末断句，缩写不断句，超长句在逗号 / 空白处切开"""
+        from core.text_split import split_sentences
+
+        assert split_sentences('Hello Mr. Smith. How are you? "Fine." Pi is 3.14 today!', 500) == [
+            "Hello Mr. Smith.", "How are you?", '"Fine."', "Pi is 3.14 today!"
+        ]
+        assert split_sentences("你好。今天天气很好！是吗", 500) == ["你好。", "今天天气很好！", "是吗"]
+        chunks = split_sentences("one, two, three, four, five " + "x" * 30, 12)
+        assert chunks[:2] == ["one, two,", "three, four,"]
+        assert all(len(chunk) <= 12 for chunk in chunks)
+        assert "".join(chunks).replace(" ", "") == "one,two,three,four,five" + "x" * 30
+
+
+class TestLongTextSynthesisUnit:
+    """长文本并行合成与拼接单元测试"""
+
+    def test_segments_run_in_parallel_and_reuse_cache(self, temp_cache):
+        """各句并行合成，整段耗时接近最慢一句；共享句子的其他段落直接复用缓存"""
+        import asyncio
+        import base64
+        import time
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        from core.admission import AdmissionController
+        from services.synthesis import synthesize_long_to_cache
+
+        calls = []
+
+        async def fake_astream(text, voice, language):
+            calls.append(text)
+            await asyncio.sleep(0.1)
+            yield base64.b64encode(text.encode()).decode()
+
+        async def scenario():
+            first = ["Alpha one.", "Bravo two.", "Charlie three.", "Delta four."]
+            started = time.monotonic()
+            cached, _ = await synthesize_long_to_cache("c" * 32, first, "Cherry", "en-US", 1.0)
+            elapsed = time.monotonic() - started
+            second, _ = await synthesize_long_to_cache(
+                "d" * 32, ["Bravo two.", "Echo five."], "Cherry", "en-US", 1.0
+            )
+            return cached, elapsed, second
+
+        with patch("services.synthesis.tts_service", SimpleNamespace(astream=fake_astream)), \
+                patch("services.synthesis.admission", AdmissionController(capacity=8)):
+            cached, elapsed, second = asyncio.run(scenario())
+
+        assert elapsed < 0.3
+        assert cached.path.read_bytes()[44:] == b"Alpha one.Bravo two.Charlie three.Delta four."
+        assert second.path.read_bytes()[44:] == b"Bravo two.Echo five."
+        assert sorted(calls) == ["Alpha one.", "Bravo two.", "Charlie three.", "Delta four.", "Echo five."]
+
+
+class TestSpeedVariantUnit:
+    """本地变速单元测试"""
+
+    def test_speed_variants_derive_from_master(self, temp_cache):
+        """非 1.0 语速只合成一次 1.0× 主文件，各语速由主文件变速并按各自的 Hash 缓存"""
+        import asyncio
+        import base64
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        from core.hash import generate_audio_hash
+        from services.synthesis import synthesize_text_to_cache
+
+        calls = []
+        tempos = []
+
+        async def fake_astream(text, voice, language):
+            calls.append(text)
+            yield base64.b64encode(b"\x01\x00" * 100).decode()
+
+        async def fake_time_stretch(wav_data, speed):
+            tempos.append(speed)
+            return wav_data[:44] + b"\x00" * int(200 / speed)
+
+        async def scenario():
+            results = []
+            for speed in (1.5, 0.8, 1.52):
+                audio_hash = generate_audio_hash("Slow down", speed=speed)
+                results.append(await synthesize_text_to_cache(
+                    audio_hash, "Slow down", "Cherry", "en-US", speed, {"text": "Slow down", "speed": speed}
+                ))
+            return results
+
+        with patch("services.synthesis.tts_service", SimpleNamespace(astream=fake_astream)), \
+                patch("core.transcode.transcoding_available", return_value=True), \
+                patch.object(temp_cache.transcoder, "time_stretch", side_effect=fake_time_stretch):
+            (fast, _), (slow, _), (rounded, _) = asyncio.run(scenario())
+
+        master_hash = generate_audio_hash("Slow down", speed=1.0)
+        assert calls == ["Slow down"]
+        assert tempos == [1.5, 0.8, 1.5]
+        assert temp_cache.exists(master_hash)
+        assert fast.size == 44 + 133 and slow.size == 44 + 250
+        assert temp_cache.get_metadata(generate_audio_hash("Slow down", speed=1.5))["derived_from"] == master_hash
+
+    @pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="需要 ffmpeg")
+    def test_time_stretch_changes_duration(self):
+        """真实变速: 2.0× 时长减半，采样参数不变"""
+        import io
+        import wave
+        from core.transcode import time_stretch
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(24000)
+            wav_file.writeframes(b"\x10\x00\xf0\xff" * 12000)
+
+        with wave.open(io.BytesIO(time_stretch(buffer.getvalue(), 2.0)), "rb") as wav_file:
+            assert wav_file.getframerate() == 24000 and wav_file.getnchannels() == 1
+            assert abs(wav_file.getnframes() - 12000) < 1200
+
+
+class TestStreamSynthesisUnit:
+    """流式合成 (tee-to-cache) 单元测试"""
+
+    def test_stream_followers_share_one_synthesis(self, temp_cache, tmp_path):
+        """并发流式 / 非流式请求只调用一次 DashScope，字节流与提交的缓存文件都是完整 WAV"""
+        import asyncio
+        import base64
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        from services.dashscope import to_wav
+        from services.synthesis import stream_synthesis, synthesize_to_cache
+
+        pcm_chunks = [b"\x01\x00" * 50, b"\x02\x00" * 50, b"\x03\x00" * 50]
+        calls = []
+
+        async def fake_astream(text, voice, language):
+            calls.append(text)
+            for chunk in pcm_chunks:
+                await asyncio.sleep(0.01)
+                yield base64.b64encode(chunk).decode()
+
+        async def collect(chunks):
+            return b"".join([chunk async for chunk in chunks])
+
+        async def scenario():
+            leader = stream_synthesis("b" * 32, "hi", "Cherry", "en-US", 1.0)
+            await asyncio.sleep(0.015)
+            follower = stream_synthesis("b" * 32, "hi", "Cherry", "en-US", 1.0)
+            return await asyncio.gather(
+                collect(leader),
+                collect(follower),
+                synthesize_to_cache("b" * 32, "hi", "Cherry", "en-US", 1.0)
+            )
+
+        fake_service = SimpleNamespace(astream=fake_astream)
+        with patch("services.synthesis.tts_service", fake_service):
+            leader_bytes, follower_bytes, (generated, coalesced) = asyncio.run(scenario())
+
+        expected = to_wav(b"".join(pcm_chunks), "hi")
+        assert calls == ["hi"]
+        assert coalesced is True
+        # 流式输出的 WAV 头长度未知，其余字节与缓存文件一致
+        assert leader_bytes == follower_bytes
+        assert leader_bytes[44:] == expected[44:]
+        assert generated.path.read_bytes() == expected
+        assert not list(tmp_path.rglob("*.part"))
+        assert temp_cache.get_cache_stats()["writes"] == 1
+
+
+class TestAdmissionUnit:
+    """合成准入队列单元测试"""
+
+    def test_reserved_capacity_is_kept_for_interactive(self):
+        """预加载占满共享名额后，用户点击仍可使用预留名额"""
+        import asyncio
+        from core.admission import AdmissionController
+
+        async def scenario():
+            admission = AdmissionController(
+                capacity=2, reserved={"interactive": 1}, max_queue={"default": 5},
+                queue_timeout={"default": 0.05}
+            )
+            prefetch = await admission.acquire("prefetch")
+            interactive = await admission.acquire("interactive")
+            try:
+                await admission.acquire("prefetch")
+            except Exception as e:
+                rejected = e
+            admission.release(prefetch)
+            admission.release(interactive)
+            return admission, rejected
+
+        admission, rejected = asyncio.run(scenario())
+
+        assert rejected.status_code == 503 and rejected.retry_after >= 1
+        stats = admission.get_stats()
+        assert stats["in_use"] == 0
+        assert stats["classes"]["prefetch"]["rejected"]["queue_timeout"] == 1
+
+    def test_at_least_one_shared_slot(self, tmp_path):
+        """预留名额等于总并发时仍保留 1 个共享名额；配置校验拒绝这种配置"""
+        import asyncio
+        from core.admission import AdmissionController
+        from core.config import Config
+
+        async def scenario():
+            admission = AdmissionController(
+                capacity=1, reserved={"interactive": 1}, max_queue={"default": 5},
+                queue_timeout={"default": 0.05}
+            )
+            slot = await admission.acquire("prefetch")
+            admission.release(slot)
+            return admission
+
+        admission = asyncio.run(scenario())
+        assert admission.shared_capacity == 1 and admission.reserved["interactive"] == 0
+        assert admission.get_stats()["classes"]["prefetch"]["admitted"] == 1
+
+        with patch.object(Config, "ADAPTIVE_CONCURRENCY", True), \
+                patch.object(Config, "ADAPTIVE_MIN_LIMIT", 1), \
+                patch.object(Config, "CACHE_DIR", tmp_path):
+            with pytest.raises(ValueError, match="shared slot"):
+                Config.validate()
+
+    def test_higher_priority_is_dispatched_first_and_queue_is_bounded(self):
+        """名额释放时先唤醒 interactive；队列满立即 429"""
+        import asyncio
+        from core.admission import AdmissionController, AdmissionRejected
+
+        async def scenario():
+            admission = AdmissionController(
+                capacity=1, reserved={}, max_queue={"bulk": 1, "default": 5},
+                queue_timeout={"default": 1.0}
+            )
+            order = []
+
+            async def worker(priority, delay=0.0):
+                await asyncio.sleep(delay)
+                async with admission.slot(priority):
+                    order.append(priority)
+                    await asyncio.sleep(0.01)
+
+            holder = await admission.acquire("bulk")
+            tasks = [
+                asyncio.ensure_future(worker("bulk")),
+                asyncio.ensure_future(worker("prefetch")),
+                asyncio.ensure_future(worker("interactive")),
+            ]
+            await asyncio.sleep(0.01)
+            try:
+                await admission.acquire("bulk")
+            except AdmissionRejected as e:
+                full = e
+            admission.release(holder)
+            await asyncio.gather(*tasks)
+            return order, full
+
+        order, full = asyncio.run(scenario())
+
+        assert order == ["interactive", "prefetch", "bulk"]
+        assert full.status_code == 429
+
+    def test_promote_moves_queued_prefetch_ahead(self):
+        """排队中的预加载被用户点击合并时提升为 interactive"""
+        import asyncio
+        from core.admission import AdmissionController
+
+        async def scenario():
+            admission = AdmissionController(
+                capacity=1, reserved={}, max_queue={"default": 5}, queue_timeout={"default": 1.0}
+            )
+            holder = await admission.acquire("bulk")
+            other = asyncio.ensure_future(admission.acquire("prefetch", key="other"))
+            clicked = asyncio.ensure_future(admission.acquire("prefetch", key="clicked"))
+            await asyncio.sleep(0)
+            promoted = admission.promote("clicked", "interactive")
+            admission.release(holder)
+            slot = await clicked
+            admission.release(slot)
+            admission.release(await other)
+            return promoted, slot
+
+        promoted, slot = asyncio.run(scenario())
+
+        assert promoted is True
+        assert slot[0] == "interactive"
+
+
+class TestAdaptiveLimitUnit:
+    """自适应并发上限单元测试"""
+
+    def test_aimd_rules(self):
+        """用满时加性增长，延迟超标 / 限流乘性减小，同一次拥塞只减一次，上下限生效"""
+        import time
+        from core.adaptive_limit import IGNORED, OK, THROTTLED, AdaptiveLimit, classify_error
+        from services.dashscope import DashScopeError
+
+        limit = AdaptiveLimit(
+            initial=4, min_limit=2, max_limit=6, latency_tolerance=2.0,
+            latency_backoff=0.5, throttle_backoff=0.5
+        )
+        started = time.monotonic()
+        for _ in range(5):
+            limit.on_sample(0.1, started, OK, saturated=True)
+        assert limit.limit == 5
+        # 未用满时不增长
+        for _ in range(20):
+            limit.on_sample(0.1, started, OK, saturated=False)
+        assert limit.limit == 5
+
+        assert limit.on_sample(0.1, time.monotonic(), THROTTLED, saturated=True) == "throttled"
+        assert limit.limit == 2
+        # 减小之前开始的合成不再触发减小；下限为 2
+        assert limit.on_sample(0.1, started, THROTTLED, saturated=True) is None
+        assert limit.on_sample(0.5, time.monotonic(), OK, saturated=True) is None
+        assert limit.limit == 2
+        assert limit.changes == {"increase": 1, "latency": 0, "throttled": 1}
+
+        for _ in range(100):
+            limit.on_sample(0.1, time.monotonic(), OK, saturated=True)
+        assert limit.limit == 6
+        assert limit.on_sample(0.5, time.monotonic(), OK, saturated=True) == "latency"
+        assert limit.last_change["from"] == 6 and limit.last_change["to"] == 3
+
+        assert classify_error(DashScopeError("throttled", status_code=429)) == THROTTLED
+        assert classify_error(DashScopeError("gateway", status_code=504)) == THROTTLED
+        assert classify_error(DashScopeError("bad voice", status_code=400)) == IGNORED
+
+    def test_converges_against_fake_provider(self):
+        """本地假 DashScope: 超过 4 并发延迟上升，超过 6 并发返回 429；并发上限在其附近收敛"""
+        import asyncio
+        from core.adaptive_limit import AdaptiveLimit
+        from core.admission import AdmissionController
+        from services.dashscope import DashScopeError
+
+        class FakeProvider:
+            def __init__(self, capacity=4, throttle_at=6, base_latency=0.005):
+                self.capacity = capacity
+                self.throttle_at = throttle_at
+                self.base_latency = base_latency
+                self.in_flight = 0
+                self.peak = 0
+
+            async def synthesize(self, permit):
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                try:
+                    if self.in_flight > self.throttle_at:
+                        await asyncio.sleep(self.base_latency / 5)
+                        raise DashScopeError("Throttling.RateQuota", status_code=429)
+                    await asyncio.sleep(self.base_latency * max(1.0, self.in_flight / self.capacity) ** 2)
+                    permit.mark_first_byte()
+                finally:
+                    self.in_flight -= 1
+
+        async def scenario():
+            provider = FakeProvider()
+            adaptive = AdaptiveLimit(initial=2, min_limit=1, max_limit=20)
+            admission = AdmissionController(
+                reserved={}, max_queue={"default": 1000}, queue_timeout={"default": 60}, adaptive=adaptive
+            )
+            limits = []
+
+            async def client():
+                for _ in range(15):
+                    try:
+                        async with admission.slot("bulk") as permit:
+                            await provider.synthesize(permit)
+                    except DashScopeError:
+                        pass
+                    limits.append(admission.capacity)
+
+            await asyncio.gather(*(client() for _ in range(30)))
+            return provider, adaptive, admission, limits
+
+        provider, adaptive, admission, limits = asyncio.run(scenario())
+
+        assert max(limits) > 2
+        assert adaptive.changes["increase"] > 0
+        assert adaptive.changes["throttled"] + adaptive.changes["latency"] > 0
+        # 上限随样本调整，准入并发始终不超过当前上限的峰值
+        assert provider.peak <= max(limits)
+        assert 1 <= admission.capacity <= 8
+        assert sum(limits[-50:]) / 50 <= 8
+        assert any(line.startswith("tts_adaptive_limit ") for line in admission.metric_lines())
+
+
+class TestResilienceUnit:
+    """上游容错层 (重试 / 熔断 / 对冲) 单元测试"""
+
+    def test_retries_retryable_errors_then_opens_circuit(self):
+        """429 / 5xx 抖动重试后成功；连续失败打开熔断，冷却后探测成功关闭；4xx 不重试"""
+        import asyncio
+        import time
+        from core.resilience import CircuitBreaker, CircuitOpenError, ResilientTTSService
+        from services.dashscope import DashScopeError
+
+        class FlakyProvider:
+            def __init__(self):
+                self.calls = 0
+                self.errors = []
+
+            async def asynthesize(self, text, voice, language, speed):
+                self.calls += 1
+                if self.errors:
+                    raise DashScopeError("upstream", status_code=self.errors.pop(0))
+                return b"audio"
+
+        async def scenario():
+            provider = FlakyProvider()
+            service = ResilientTTSService(
+                provider, attempts=3, base_delay=0, breaker=CircuitBreaker(failure_threshold=3, cooldown=0.05)
+            )
+            provider.errors = [429, 503]
+            assert await service.asynthesize("hi") == b"audio"
+            assert provider.calls == 3 and service.retries == 2
+
+            provider.errors = [400]
+            try:
+                await service.asynthesize("hi")
+            except DashScopeError as e:
+                assert e.status_code == 400
+            assert provider.calls == 4 and service.breaker.state == "closed"
+
+            provider.errors = [500, 500, 500]
+            try:
+                await service.asynthesize("hi")
+            except DashScopeError:
+                pass
+            assert service.breaker.state == "open"
+            try:
+                await service.asynthesize("hi")
+            except CircuitOpenError as e:
+                fail_fast = e
+            assert provider.calls == 7
+
+            time.sleep(0.06)
+            assert await service.asynthesize("hi") == b"audio"
+            return service, fail_fast
+
+        service, fail_fast = asyncio.run(scenario())
+
+        assert fail_fast.status_code == 503 and fail_fast.retry_after >= 1
+        assert service.breaker.state == "closed"
+        assert service.get_stats()["circuit"] == {
+            "state": "closed", "consecutive_failures": 0, "opened": 1, "rejected": 1
+        }
+
+    def test_hedged_stream_cancels_slow_attempt(self):
+        """首包超过 p95 时发出对冲请求，先到首个分片的一方胜出，另一方被取消"""
+        import asyncio
+        from core.resilience import ResilientStreamingTTSService
+        from services.dashscope import DashScopeError
+
+        class SlowThenFastProvider:
+            def __init__(self):
+                self.calls = 0
+                self.closed = []
+
+            async def astream(self, text, voice, language):
+                self.calls += 1
+                call = self.calls
+                try:
+                    if call == 1:
+                        raise DashScopeError("overloaded", status_code=503)
+                    await asyncio.sleep(0.5 if call == 2 else 0.01)
+                    for i in range(3):
+                        yield f"call{call}-chunk{i}"
+                finally:
+                    self.closed.append(call)
+
+        async def scenario():
+            provider = SlowThenFastProvider()
+            service = ResilientStreamingTTSService(
+                provider, attempts=2, base_delay=0, hedge=True, hedge_quantile=0.95, hedge_min_delay=0.02
+            )
+            for _ in range(20):
+                service.ttfb.add(0.01)
+            chunks = [chunk async for chunk in service.astream("hi")]
+            return provider, service, chunks
+
+        provider, service, chunks = asyncio.run(scenario())
+
+        # 第 1 次 503 重试；第 2 次首包过慢触发对冲，第 3 次胜出
+        assert chunks == ["call3-chunk0", "call3-chunk1", "call3-chunk2"]
+        assert service.retries == 1
+        assert service.hedges == 1 and service.hedges_won == 1
+        assert sorted(provider.closed) == [1, 2, 3]
+
+
+class TestProviderRouterUnit:
+    """多提供方路由单元测试"""
+
+    def test_fails_over_and_orders_by_policy(self):
+        """可重试错误 / 熔断打开时转移到下一个提供方；参数错误不转移；策略决定尝试顺序"""
+        import asyncio
+        import base64
+        from core.resilience import CircuitBreaker, ResilientTTSService
+        from services.fake import FakeTTSService
+        from services.provider import TTSProvider, TTSProviderError
+        from services.router import ProviderRouter
+
+        class BrokenProvider(TTSProvider):
+            name = "broken"
+            status_code = 503
+
+            async def asynthesize(self, text, voice="Cherry", language="en-US", speed=1.0):
+                raise TTSProviderError("down", status_code=self.status_code)
+
+        broken = BrokenProvider()
+        primary = ResilientTTSService(broken, attempts=1, breaker=CircuitBreaker(failure_threshold=1, cooldown=60))
+        fallback = FakeTTSService(latency=0)
+        router = ProviderRouter([primary, fallback], policy="priority", costs={"broken": 0.001, "fake": 0})
+
+        async def scenario():
+            results = []
+            for _ in range(2):
+                provider, stream = await router.aopen("Hello", "Cherry", "en-US")
+                pcm = b"".join([base64.b64decode(data) async for data in stream])
+                results.append((provider, pcm))
+            broken.status_code = 400
+            invalid = ProviderRouter([ResilientTTSService(broken, attempts=1), fallback], policy="priority")
+            try:
+                await invalid.aopen("Hello")
+            except TTSProviderError as e:
+                results.append(e.status_code)
+            return results
+
+        first, second, rejected = asyncio.run(scenario())
+
+        assert first == ("fake", fallback.render("Hello", "Cherry", "en-US"))
+        # 第二次熔断已打开: 直接排到最后，不再调用
+        assert second[0] == "fake"
+        assert primary.breaker.state == "open" and router.failovers == 1
+        assert rejected == 400
+        stats = router.get_stats()["providers"]
+        assert stats["broken"]["failures"] == 1 and stats["fake"]["selected"] == 2
+        assert 'tts_provider_selected_total{provider="fake"} 2' in router.metric_lines()
+
+        free = ResilientTTSService(BrokenProvider(), attempts=1)
+        cheap_first = ProviderRouter([fallback, free], policy="cost", costs={"broken": 0, "fake": 0.001})
+        assert [p.name for p in cheap_first.rank(10)] == ["broken", "fake"]
+        balanced = ProviderRouter([free, fallback], policy="balanced", costs={"broken": 0, "fake": 0.001}, cost_weight=100)
+        balanced.stats["fake"].latency = 0.1
+        balanced.stats["broken"].latency = 0.5
+        # 短文本延迟占主导，长文本成本占主导
+        assert [p.name for p in balanced.rank(1)] == ["fake", "broken"]
+        assert [p.name for p in balanced.rank(500)] == ["broken", "fake"]
+
+    def test_fake_provider_is_deterministic(self):
+        """同一文本生成相同音频，不同文本不同；时长随文本长度增长"""
+        import asyncio
+        import wave
+        import io
+        from services.fake import FakeTTSService
+
+        fake = FakeTTSService(latency=0)
+        assert fake.render("Hello") == fake.render("Hello")
+        assert fake.render("Hello") != fake.render("Hullo")
+        assert len(fake.render("Hello world, this is longer")) > len(fake.render("Hello"))
+
+        wav_data = asyncio.run(fake.asynthesize("Hello"))
+        with wave.open(io.BytesIO(wav_data), "rb") as wav_file:
+            assert wav_file.getframerate() == 24000
+            assert wav_file.readframes(wav_file.getnframes()) == fake.render("Hello")
+
+    def test_provider_recorded_in_cache_metadata(self, temp_cache):
+        """缓存 Key 不变，元数据记录实际合成的提供方"""
+        import asyncio
+        from unittest.mock import patch
+        from services.fake import FakeTTSService
+        from services.router import ProviderRouter
+        from services.synthesis import synthesize_to_cache
+
+        router = ProviderRouter([FakeTTSService(latency=0)], policy="priority", costs={})
+
+        with patch("services.synthesis.tts_service", router):
+            cached, _ = asyncio.run(synthesize_to_cache("b" * 32, "Hi", "Cherry", "en-US", 1.0, {"text": "Hi"}))
+
+        assert cached.path.name == "b" * 32 + ".wav"
+        assert temp_cache.get_metadata("b" * 32)["provider"] == "fake"
+
+    def test_failover_output_is_not_cached_permanently(self, temp_cache):
+        """非首选提供方合成的音频 (音色不同) 只按临时条目缓存；首选提供方保留请求的 cache_type"""
+        import asyncio
+        from unittest.mock import patch
+        from core.resilience import ResilientTTSService
+        from services.fake import FakeTTSService
+        from services.provider import TTSProvider, TTSProviderError
+        from services.router import ProviderRouter
+        from services.synthesis import synthesize_to_cache
+
+        class BrokenProvider(TTSProvider):
+            name = "broken"
+
+            async def asynthesize(self, text, voice="Cherry", language="en-US", speed=1.0):
+                raise TTSProviderError("down", status_code=503)
+
+        failover = ProviderRouter([ResilientTTSService(BrokenProvider(), attempts=1), FakeTTSService(latency=0)])
+        primary = ProviderRouter([FakeTTSService(latency=0)])
+        metadata = {"text": "Hi", "cache_type": "permanent"}
+
+        with patch("services.synthesis.tts_service", failover):
+            asyncio.run(synthesize_to_cache("c" * 32, "Hi", "Cherry", "en-US", 1.0, metadata))
+        with patch("services.synthesis.tts_service", primary):
+            asyncio.run(synthesize_to_cache("d" * 32, "Hi", "Cherry", "en-US", 1.0, metadata))
+
+        assert temp_cache.get_metadata("c" * 32)["cache_type"] == "temporary"
+        assert temp_cache.get_metadata("d" * 32)["cache_type"] == "permanent"
+
+    def test_dashscope_factory_skipped_without_api_key(self):
+        """未配置 API Key 时 DashScope 工厂与 Edge 一样返回 None，而不是在导入时抛错"""
+        from unittest.mock import patch
+        from services.dashscope import create_dashscope_service
+
+        with patch("services.dashscope.config.OPENAI_API_KEY", None):
+            assert create_dashscope_service() is None
+
+    def test_edge_uses_injected_transcoder(self):
+        """Edge 使用传入的转码器判断可用性并在关闭时释放它，不借用缓存模块的全局实例"""
+        import asyncio
+        from unittest.mock import MagicMock, patch
+        from services.edge import EdgeTTSService, create_edge_service
+
+        transcoder = MagicMock(available=False)
+        with patch("services.edge.edge_tts", object()):
+            assert create_edge_service(transcoder) is None
+            transcoder.available = True
+            service = create_edge_service(transcoder)
+
+        assert service.transcoder is transcoder
+        asyncio.run(service.aclose())
+        transcoder.shutdown.assert_called_once()
+        assert isinstance(service, EdgeTTSService)
+
+    def test_provider_without_asynthesize_rejected(self):
+        """未实现 asynthesize 的提供方在构造时报错，不会进入路由后才失败"""
+        import pytest
+        from services.provider import TTSProvider
+
+        class StreamOnlyProvider(TTSProvider):
+            name = "stream-only"
+
+            async def astream(self, text, voice="Cherry", language="en-US"):
+                yield ""
+
+        with pytest.raises(TypeError):
+            StreamOnlyProvider()
+
+
+class TestThreadBridgeUnit:
+    """线程桥与流式延迟统计单元测试"""
+
+    def test_items_in_order_and_errors_propagate(self):
+        """按顺序产出；迭代器抛出的异常在事件循环侧原样抛出"""
+        import asyncio
+        from core.thread_bridge import iterate_in_thread
+
+        def failing():
+            yield 1
+            yield 2
+            raise ValueError("boom")
+
+        async def scenario():
+            items = [item async for item in iterate_in_thread(lambda: iter(range(5)))]
+            received = []
+            with pytest.raises(ValueError):
+                async for item in iterate_in_thread(failing):
+                    received.append(item)
+            return items, received
+
+        assert asyncio.run(scenario()) == ([0, 1, 2, 3, 4], [1, 2])
+
+    def test_consumer_close_stops_producer(self):
+        """消费者提前结束后生产者停止读取并关闭迭代器"""
+        import asyncio
+        import time
+        import threading
+        from core.thread_bridge import iterate_in_thread
+
+        produced = []
+        closed = threading.Event()
+
+        def endless():
+            try:
+                while True:
+                    time.sleep(0.01)
+                    produced.append(1)
+                    yield len(produced)
+            finally:
+                closed.set()
+
+        async def scenario():
+            stream = iterate_in_thread(endless)
+            first = await stream.__anext__()
+            await stream.aclose()
+            await asyncio.get_running_loop().run_in_executor(None, closed.wait, 2)
+            return first
+
+        assert asyncio.run(scenario()) == 1
+        assert closed.is_set()
+        assert len(produced) < 10
+
+    @patch('services.dashscope.dashscope')
+    def test_sync_dashscope_astream(self, mock_dashscope):
+        """sync 客户端经线程桥流式产出分片；非 200 分片抛出 DashScopeError"""
+        import asyncio
+        from services.dashscope import DashScopeError, DashScopeTTSService
+
+        def chunk(data, status_code=200):
+            return MagicMock(status_code=status_code, output={"audio": {"data": data}}, message="err")
+
+        service = DashScopeTTSService()
+
+        async def collect():
+            return [data async for data in service.astream("hello")]
+
+        mock_dashscope.MultiModalConversation.call.return_value = iter([chunk("AAAA"), chunk("BBBB")])
+        assert asyncio.run(collect()) == ["AAAA", "BBBB"]
+
+        mock_dashscope.MultiModalConversation.call.return_value = iter([chunk("AAAA"), chunk(None, 429)])
+        with pytest.raises(DashScopeError) as exc:
+            asyncio.run(collect())
+        assert exc.value.status_code == 429
+
+    def test_stream_latency_metrics(self):
+        """首包延迟与分片间隔计入直方图"""
+        from core.stream_metrics import StreamLatency
+
+        latency = StreamLatency("test_ws")
+        timer = latency.start()
+        for _ in range(3):
+            timer.chunk()
+
+        summary = timer.summary()
+        assert summary["chunks"] == 3 and summary["ttfb_ms"] is not None
+        stats = latency.get_stats()
+        assert stats["first_chunk"]["count"] == 1
+        assert stats["chunk_gap"]["count"] == 2
+        lines = latency.metric_lines()
+        assert 'test_ws_first_chunk_seconds_bucket{le="+Inf"} 1' in lines
+        assert "test_ws_chunk_gap_seconds_count 2" in lines
+
 
 class TestDashScopeServiceUnit:
     """DashScope 服务单元测试 (完全 Mock)"""
@@ -134,6 +1687,83 @@ class TestDashScopeServiceUnit:
         #     service.synthesize("test")
 
 
+class TestAsyncDashScopeClientUnit:
+    """DashScope 异步客户端单元测试 (httpx MockTransport，不访问网络)"""
+
+    @staticmethod
+    def _sse(*events):
+        import json
+        lines = []
+        for event, status, payload in events:
+            lines += [f"id:{len(lines)}", f"event:{event}", f":HTTP_STATUS/{status}", f"data:{json.dumps(payload)}", ""]
+        return "\n".join(lines).encode()
+
+    def test_streams_sse_chunks_and_wraps_pcm(self):
+        """增量解析 SSE 音频分片，裸 PCM 包装为 WAV，请求体与 SDK 一致"""
+        import asyncio
+        import base64
+        import json
+        import httpx
+        from services.dashscope import AsyncDashScopeTTSService
+
+        requests = []
+        chunks = [b"\x01\x00" * 10, b"\x02\x00" * 10]
+
+        def handler(request):
+            requests.append(request)
+            body = self._sse(
+                *[("result", 200, {"output": {"audio": {"data": base64.b64encode(c).decode()}}}) for c in chunks],
+                ("result", 200, {"output": {"finish_reason": "stop"}})
+            )
+            return httpx.Response(200, content=body, headers={"content-type": "text/event-stream"})
+
+        service = AsyncDashScopeTTSService(transport=httpx.MockTransport(handler))
+
+        async def scenario():
+            audio = await service.asynthesize("Hello", "Cherry", "en-US")
+            again = await service.asynthesize("Hello", "Cherry", "en-US")
+            await service.aclose()
+            return audio, again
+
+        audio, again = asyncio.run(scenario())
+
+        assert audio == again
+        with wave.open(io.BytesIO(audio)) as wav_file:
+            assert wav_file.getframerate() == 24000
+            assert wav_file.readframes(wav_file.getnframes()) == b"".join(chunks)
+        body = json.loads(requests[0].content)
+        assert body["input"] == {"text": "Hello", "voice": "Cherry", "language_type": "English"}
+        assert requests[0].headers["x-dashscope-sse"] == "enable"
+        assert requests[0].url.path.endswith("/services/aigc/multimodal-generation/generation")
+
+    def test_error_event_and_http_error_raise(self):
+        """SSE error 事件与非 200 响应都抛出 DashScopeError"""
+        import asyncio
+        import httpx
+        from services.dashscope import AsyncDashScopeTTSService, DashScopeError
+
+        responses = iter([
+            httpx.Response(200, content=self._sse(("error", 400, {"code": "InvalidParameter", "message": "bad voice"}))),
+            httpx.Response(401, content=b'{"code": "InvalidApiKey"}'),
+        ])
+        service = AsyncDashScopeTTSService(transport=httpx.MockTransport(lambda request: next(responses)))
+
+        async def scenario():
+            errors = []
+            for _ in range(2):
+                try:
+                    await service.asynthesize("Hello")
+                except DashScopeError as e:
+                    errors.append(str(e))
+            await service.aclose()
+            return errors
+
+        errors = asyncio.run(scenario())
+
+        assert "bad voice" in errors[0]
+        assert "401" in errors[1]
+
+
 class TestWAVHeaderUnit:
     """WAV 头处理单元测试"""
     
@@ -156,6 +1786,14 @@ class TestWAVHeaderUnit:
         assert wav_data[:4] == b'RIFF'
         assert wav_data[8:12] == b'WAVE'
     
+    def test_wav_header_matches_wave_module(self):
+        """流式 WAV 头补写长度后与 wave 模块整段包装的结果一致"""
+        from services.dashscope import STREAMING_WAV_SIZE, to_wav, wav_header
+        
+        pcm_data = b'\x01\x02' * 500
+        assert wav_header(len(pcm_data)) + pcm_data == to_wav(pcm_data, "text")
+        assert wav_header()[40:44] == STREAMING_WAV_SIZE.to_bytes(4, "little")
+    
     def test_wav_can_be_reopened(self):
         """生成的 WAV 应可被正确读取"""
         pcm_data = b'\x00\x00' * 24000  # 1 秒